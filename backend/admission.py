@@ -0,0 +1,396 @@
+# backend/admission.py
+import time
+import heapq
+import asyncio
+import inspect
+import itertools
+import functools
+import threading
+from backend.config import get_config # 从 config 模块导入
+from backend.metrics import registry, Histogram
+
+# ai.json 中用于准入控制配置的保留键
+ADMISSION_CONFIG_KEY = 'admission'
+
+DEFAULT_ADMISSION_CONFIG = {
+    "max_concurrency_per_model": 8,   # 每个模型同时进行的上游调用数
+    "max_concurrency_per_key": 4,     # 每个 API key 同时进行的上游调用数
+    "max_queue": 64,                  # 等待队列长度上限，队列满时立即拒绝
+    "queue_timeout_seconds": 30,      # 在队列中等待的最长时间
+    "retry_after_seconds": 5,         # 拒绝时 Retry-After 的最小建议值
+    "per_model": {},                  # 按模型覆盖并发数，如 {"gemini-2.5-pro": {"max_concurrency": 2}}
+}
+
+# 优先级：数值越小越先获得执行槽位
+PRIORITY_INTERACTIVE = 0   # 举报信息分析等短请求
+PRIORITY_TRANSCRIPTION = 5 # 整段音频转录
+PRIORITY_BATCH = 10        # 批量任务等可以稍后执行的请求
+
+# 等待时间直方图的桶上界 (秒)
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60)
+
+admission_wait = registry.register(Histogram(
+    'admission_wait_seconds', '上游调用等待执行槽位的时间', ('model',), buckets=WAIT_BUCKETS
+))
+
+def get_admission_config():
+    """返回合并默认值后的准入控制配置"""
+    admission_config = dict(DEFAULT_ADMISSION_CONFIG)
+    admission_config.update(get_config().get(ADMISSION_CONFIG_KEY) or {})
+    return admission_config
+
+class AdmissionRejected(Exception):
+    """队列已满或排队超时；retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message, retry_after):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+class Ticket:
+    """一次已获准的上游调用；release() 可重复调用"""
+
+    def __init__(self, controller, model_name, key):
+        self._controller = controller
+        self.model_name = model_name
+        self.key = key
+        self.started_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        with self._controller._cond: # 流被回收 (__del__) 时可能与 close() 在不同线程同时释放
+            if self._released:
+                return
+            self._released = True
+        self._controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'model_name', 'key', 'enqueued_at', 'loop', 'event')
+
+    def __init__(self, priority, seq, model_name, key, loop=None):
+        self.priority = priority
+        self.seq = seq
+        self.model_name = model_name
+        self.key = key
+        self.enqueued_at = time.monotonic()
+        # 异步等待者：在自己的事件循环中等待 event，不占用线程
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class AdmissionController:
+    """上游模型调用的准入控制
+
+    - 按模型、按 API key 限制同时进行的调用数，超出时进入有界优先级队列
+    - 槽位释放后，按 (优先级, 入队顺序) 把槽位交给第一个条件满足的等待者
+    - 队列满时立即拒绝；排队超过 queue_timeout_seconds 时超时拒绝
+    - 同步调用者在条件变量上等待；异步调用者 (admit_async) 在事件循环中等待，不占用线程池线程
+    - 记录队列深度、进行中调用数和等待时间分布
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiters = []          # 堆，按 (priority, seq) 排序
+        self._seq = itertools.count()
+        self._model_active = {}     # model_name -> 进行中的调用数
+        self._key_active = {}       # key -> 进行中的调用数
+        self._admitted = 0
+        self._rejected_full = 0
+        self._rejected_timeout = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+        self._recent_hold = 1.0     # 最近一次调用的持有时长 (秒)，用于估算 Retry-After
+
+    def _model_limit(self, admission_config, model_name):
+        override = (admission_config.get('per_model') or {}).get(model_name) or {}
+        return override.get('max_concurrency', admission_config['max_concurrency_per_model'])
+
+    def _has_capacity(self, admission_config, model_name, key):
+        if self._model_active.get(model_name, 0) >= self._model_limit(admission_config, model_name):
+            return False
+        return key is None or self._key_active.get(key, 0) < admission_config['max_concurrency_per_key']
+
+    def _first_eligible(self, admission_config):
+        """按优先级顺序返回第一个当前可以执行的等待者"""
+        for waiter in sorted(self._waiters):
+            if self._has_capacity(admission_config, waiter.model_name, waiter.key):
+                return waiter
+        return None
+
+    def _retry_after(self, admission_config):
+        # 粗略估算：排在前面的请求数 / 模型并发数 * 单次调用时长
+        estimate = len(self._waiters) / max(admission_config['max_concurrency_per_model'], 1) * self._recent_hold
+        return max(admission_config['retry_after_seconds'], int(estimate + 0.5))
+
+    def _record_wait(self, model_name, waited):
+        admission_wait.observe(waited, model=model_name)
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if waited <= bound:
+                self._wait_buckets[i] += 1
+                break
+        else:
+            self._wait_buckets[-1] += 1
+
+    def _notify_waiters(self):
+        """唤醒全部等待者重新检查条件 (调用方持有 self._cond)"""
+        self._cond.notify_all()
+        for waiter in self._waiters:
+            if waiter.loop is not None:
+                try:
+                    waiter.loop.call_soon_threadsafe(waiter.event.set)
+                except RuntimeError:
+                    pass # 事件循环已关闭
+
+    def _remove_waiter(self, waiter):
+        self._waiters.remove(waiter)
+        heapq.heapify(self._waiters)
+        # 自己离开队列后，排在后面的等待者可能已经满足条件
+        self._notify_waiters()
+
+    def _enter_or_enqueue(self, admission_config, model_name, key, priority, loop=None):
+        """有空闲槽位时直接返回 Ticket，否则入队并返回等待者 (调用方持有 self._cond)"""
+        # 有空闲槽位且没有可以先执行的等待者时直接放行
+        if self._has_capacity(admission_config, model_name, key) and self._first_eligible(admission_config) is None:
+            self._record_wait(model_name, 0.0)
+            return self._take(model_name, key)
+
+        if len(self._waiters) >= admission_config['max_queue']:
+            self._rejected_full += 1
+            retry_after = self._retry_after(admission_config)
+            print(f"准入控制: 队列已满 ({len(self._waiters)})，拒绝 {model_name} 调用")
+            raise AdmissionRejected("服务繁忙，排队请求过多，请稍后重试", retry_after)
+
+        waiter = _Waiter(priority, next(self._seq), model_name, key, loop)
+        heapq.heappush(self._waiters, waiter)
+        return waiter
+
+    def _reject_timeout(self, admission_config, model_name):
+        self._rejected_timeout += 1
+        print(f"准入控制: {model_name} 调用排队超时")
+        return AdmissionRejected("服务繁忙，排队等待超时，请稍后重试", self._retry_after(admission_config))
+
+    def _take(self, model_name, key):
+        self._model_active[model_name] = self._model_active.get(model_name, 0) + 1
+        if key is not None:
+            self._key_active[key] = self._key_active.get(key, 0) + 1
+        self._admitted += 1
+        return Ticket(self, model_name, key)
+
+    def admit(self, model_name, key=None, priority=PRIORITY_TRANSCRIPTION):
+        """获取执行槽位，返回 Ticket (调用结束后 release)；队列满或超时抛出 AdmissionRejected"""
+        admission_config = get_admission_config()
+        with self._cond:
+            waiter = self._enter_or_enqueue(admission_config, model_name, key, priority)
+            if isinstance(waiter, Ticket):
+                return waiter
+            deadline = waiter.enqueued_at + admission_config['queue_timeout_seconds']
+            try:
+                while self._first_eligible(admission_config) is not waiter:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject_timeout(admission_config, model_name)
+                    self._cond.wait(remaining)
+            finally:
+                self._remove_waiter(waiter)
+            self._record_wait(model_name, time.monotonic() - waiter.enqueued_at)
+            return self._take(model_name, key)
+
+    async def admit_async(self, model_name, key=None, priority=PRIORITY_TRANSCRIPTION):
+        """admit 的异步版本：排队期间只挂起协程，槽位释放时由释放方通过 call_soon_threadsafe 唤醒"""
+        admission_config = get_admission_config()
+        with self._cond:
+            waiter = self._enter_or_enqueue(admission_config, model_name, key, priority, asyncio.get_running_loop())
+            if isinstance(waiter, Ticket):
+                return waiter
+        deadline = waiter.enqueued_at + admission_config['queue_timeout_seconds']
+        try:
+            while True:
+                with self._cond:
+                    if self._first_eligible(admission_config) is waiter:
+                        self._remove_waiter(waiter)
+                        self._record_wait(model_name, time.monotonic() - waiter.enqueued_at)
+                        return self._take(model_name, key)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject_timeout(admission_config, model_name)
+                    waiter.event.clear() # 之后的状态变化都会重新 set
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException: # 超时拒绝或协程被取消 (客户端断开)
+            with self._cond:
+                if waiter in self._waiters:
+                    self._remove_waiter(waiter)
+            raise
+
+    def _release(self, ticket):
+        with self._cond:
+            self._model_active[ticket.model_name] -= 1
+            if ticket.key is not None:
+                self._key_active[ticket.key] -= 1
+            self._recent_hold = time.monotonic() - ticket.started_at
+            self._notify_waiters()
+
+    def stats(self):
+        """返回队列深度、进行中调用数和等待时间统计 (key 仅保留末尾 6 位)"""
+        with self._cond:
+            admitted = self._admitted
+            return {
+                "queue_depth": len(self._waiters),
+                "active_by_model": {k: v for k, v in self._model_active.items() if v},
+                "active_by_key": {f"...{k[-6:]}": v for k, v in self._key_active.items() if v},
+                "admitted": admitted,
+                "rejected_queue_full": self._rejected_full,
+                "rejected_timeout": self._rejected_timeout,
+                "wait_seconds_total": round(self._wait_total, 3),
+                "wait_seconds_avg": round(self._wait_total / admitted, 3) if admitted else 0.0,
+                "wait_seconds_max": round(self._wait_max, 3),
+                "wait_seconds_buckets": {
+                    **{str(bound): count for bound, count in zip(WAIT_BUCKETS, self._wait_buckets)},
+                    "+Inf": self._wait_buckets[-1]
+                }
+            }
+
+admission_controller = AdmissionController()
+
+@registry.register_collector
+def _collect_admission_metrics():
+    """导出队列深度和进行中调用数 (/metrics)；等待时间由 admission_wait 直方图记录"""
+    stats = admission_controller.stats()
+    return [
+        ("admission_queue_depth", "gauge", "等待执行槽位的上游调用数", [({}, stats['queue_depth'])]),
+        ("admission_active_calls", "gauge", "进行中的上游调用数",
+         [({"model": model}, count) for model, count in stats['active_by_model'].items()]),
+        ("admission_rejected_total", "counter", "被准入控制拒绝的调用数", [
+            ({"reason": "queue_full"}, stats['rejected_queue_full']),
+            ({"reason": "timeout"}, stats['rejected_timeout']),
+        ]),
+    ]
+
+def admit_model_call(model_config, priority=PRIORITY_TRANSCRIPTION):
+    """为一次上游模型调用获取执行槽位"""
+    return admission_controller.admit(model_config.get('model'), model_config.get('api_key'), priority)
+
+async def admit_model_call_async(model_config, priority=PRIORITY_TRANSCRIPTION):
+    """admit_model_call 的异步版本 (排队时不占用线程)"""
+    return await admission_controller.admit_async(model_config.get('model'), model_config.get('api_key'), priority)
+
+class _AdmittedStream:
+    """持有执行槽位的流式结果：迭代结束、出错、close() 或被回收时关闭内部生成器并释放槽位
+
+    与包一层生成器不同，从未开始迭代就被丢弃的流也会归还槽位。
+    """
+
+    def __init__(self, generator, ticket):
+        self._generator = generator
+        self._ticket = ticket
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._generator)
+        except BaseException: # 包括 StopIteration
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            self._generator.close()
+        finally:
+            self._ticket.release()
+
+    def __del__(self):
+        self.close()
+
+class _AdmittedAsyncStream:
+    """_AdmittedStream 的异步版本
+
+    被回收时只释放槽位；已开始的内部异步生成器由事件循环的 asyncgen 钩子负责 aclose。
+    """
+
+    def __init__(self, generator, ticket):
+        self._generator = generator
+        self._ticket = ticket
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._generator.__anext__()
+        except BaseException: # 包括 StopAsyncIteration 和取消
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        try:
+            await self._generator.aclose()
+        finally:
+            self._ticket.release()
+
+    def __del__(self):
+        self._ticket.release()
+
+def primed(generator):
+    """执行到生成器开头的空 yield 后返回
+
+    上游响应在生成器外部打开时，生成器需要以一个空 yield 开头并经过 primed()，
+    这样即使流从未被迭代，close() 也会执行生成器中关闭响应的 finally。
+    """
+    next(generator)
+    return generator
+
+async def aprimed(generator):
+    """primed 的异步版本"""
+    await generator.__anext__()
+    return generator
+
+def admitted(priority):
+    """装饰第一个参数为 model_config 的上游调用函数
+
+    调用前获取槽位；返回生成器时在流结束、被关闭或被丢弃后释放槽位，否则在函数返回时释放。
+    同时支持同步函数和异步函数 (异步函数在事件循环中排队，不阻塞事件循环也不占用线程)。
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(model_config, *args, **kwargs):
+                ticket = await admit_model_call_async(model_config, priority)
+                try:
+                    result = await fn(model_config, *args, **kwargs)
+                except BaseException:
+                    ticket.release()
+                    raise
+                if inspect.isasyncgen(result):
+                    return _AdmittedAsyncStream(result, ticket)
+                ticket.release()
+                return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(model_config, *args, **kwargs):
+            ticket = admit_model_call(model_config, priority)
+            try:
+                result = fn(model_config, *args, **kwargs)
+            except BaseException:
+                ticket.release()
+                raise
+            if inspect.isgenerator(result):
+                return _AdmittedStream(result, ticket)
+            ticket.release()
+            return result
+        return wrapper
+    return decorator
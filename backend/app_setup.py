@@ -1,10 +1,14 @@
 # backend/app_setup.py
 import os
-from flask import Flask, jsonify
+import time
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
 from flask_limiter import Limiter, RateLimitExceeded
 from flask_limiter.util import get_remote_address
 from backend.config import get_script_dir # 从 config 模块导入
+from backend.rate_limit import get_storage_uri # 导入时注册 sqlite:// 限流存储
+from backend.metrics import http_request_duration
+from backend.database_service import PoolTimeout
 
 # 获取脚本目录
 script_dir = get_script_dir()
@@ -26,7 +30,7 @@ def create_app():
         get_remote_address,
         app=app,
         default_limits=["300 per hour"],  # 默认限制
-        storage_uri="memory://",
+        storage_uri=get_storage_uri(), # 多 worker 部署时配置共享存储，所有进程共用一份计数
     )
 
     # 注册速率限制错误处理程序
@@ -37,6 +41,27 @@ def create_app():
             error=f"请求频率过高，已超出限制：{e.description}，请稍后重试。"
         ), 429
 
+    # 数据库连接池耗尽时返回 503，提示客户端稍后重试
+    @app.errorhandler(PoolTimeout)
+    def handle_pool_timeout(e):
+        return jsonify(error=str(e)), 503, {"Retry-After": str(e.retry_after)}
+
+    # 按路由统计请求耗时；流式响应在响应体发送完毕 (call_on_close) 时才计入
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_duration(response):
+        start = g.get('request_start')
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            method, status = request.method, response.status_code
+            response.call_on_close(lambda: http_request_duration.observe(
+                time.perf_counter() - start, route=route, method=method, status=status
+            ))
+        return response
+
     # 将 limiter 附加到 app 对象，以便在其他模块中访问
     app.limiter = limiter
 
@@ -0,0 +1,109 @@
+# backend/asgi_app.py
+"""ASGI 服务模式
+
+流式 LLM 接口 (/query_stream、/api/transcribe-audio) 由异步视图处理，
+每个打开的流只占用一个协程而不是一个工作线程；其余路由原样转发给
+create_app() 创建的同步 Flask 应用。
+
+运行方式 (在仓库根目录):
+    uvicorn backend.asgi_app:app --host :: --port 5000
+
+依赖 starlette、asgiref 和一个 ASGI 服务器 (如 uvicorn)，仅在使用该模式时需要安装。
+异步路由通过 limited() 套用与 Flask 侧相同的限额，计数存放在 Flask-Limiter 的同一存储中。
+"""
+import time
+import asyncio
+from functools import wraps
+from contextlib import asynccontextmanager
+from limits import parse
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from asgiref.wsgi import WsgiToAsgi
+from backend.app import app as flask_app # 复用同步应用 (含代理设置与全部路由)
+from backend.config import get_model_list
+from backend.llm_service import query_llm_async
+from backend.audio_service import transcribe_audio_async
+from backend.client_pool import aclose_all_clients
+from backend.sse import wants_sse
+
+AUDIO_FOLDER = flask_app.config['AUDIO_FOLDER']
+SCRIPT_DIR = flask_app.config['SCRIPT_DIR']
+
+def limited(limit_string):
+    """异步路由的限流装饰器，与 @limiter.limit 相同：按客户端 IP 计数，超出时返回 429"""
+    item = parse(limit_string)
+
+    def decorator(route):
+        @wraps(route)
+        async def wrapper(request):
+            limiter = flask_app.limiter
+            if limiter.enabled:
+                key = request.client.host if request.client else '127.0.0.1'
+                # 存储可能是 SQLite 等同步后端，计数操作放到线程中执行
+                allowed = await asyncio.to_thread(limiter.limiter.hit, item, key, route.__name__)
+                if not allowed:
+                    reset_at, _ = await asyncio.to_thread(limiter.limiter.get_window_stats, item, key, route.__name__)
+                    print("Rate limit exceeded handler called")
+                    return JSONResponse(
+                        {'error': f"请求频率过高，已超出限制：{item}，请稍后重试。"}, status_code=429,
+                        headers={'Retry-After': str(max(int(reset_at - time.time()), 1))}
+                    )
+            return await route(request)
+        return wrapper
+    return decorator
+
+@limited("300 per hour")
+async def query_llm_stream_route(request):
+    """处理流式 LLM 查询的异步路由"""
+    data = await request.json()
+    model_name = data.get('model')
+    prompt = data.get('prompt')
+    msg = data.get('msg')
+
+    if model_name not in get_model_list():
+        return JSONResponse({'error': f'不支持的模型: {model_name}'}, status_code=400)
+
+    sse = wants_sse(request.headers.get('accept'), data)
+    result = await query_llm_async(model_name, prompt, msg, sse=sse)
+    if isinstance(result, tuple): # 如果返回的是错误元组
+        error_msg, status_code = result
+        return JSONResponse(error_msg, status_code=status_code)
+    if sse:
+        return StreamingResponse(result, media_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    return StreamingResponse(result, media_type='text/html; charset=utf-8')
+
+@limited("60 per hour")
+async def transcribe_audio_route(request):
+    """处理音频转录请求的异步路由"""
+    data = await request.json()
+    result = await transcribe_audio_async(
+        AUDIO_FOLDER, SCRIPT_DIR, data.get('object_name'), data.get('model'), segmented=data.get('segmented')
+    )
+    if isinstance(result, tuple): # (错误字典, 状态码[, 响应头])
+        error_msg, status_code, *headers = result
+        return JSONResponse(error_msg, status_code=status_code, headers=headers[0] if headers else None)
+    return StreamingResponse(result, media_type='text/html; charset=utf-8')
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await aclose_all_clients() # 关闭时释放异步连接池
+
+def create_asgi_app():
+    """创建 ASGI 应用：流式路由异步处理，其余路由交给同步 Flask 应用"""
+    return Starlette(
+        routes=[
+            Route('/query_stream', query_llm_stream_route, methods=['POST']),
+            Route('/api/transcribe-audio', transcribe_audio_route, methods=['POST']),
+            Mount('/', app=WsgiToAsgi(flask_app)),
+        ],
+        # 与 Flask 侧的 CORS(app) 保持一致
+        middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+        lifespan=lifespan
+    )
+
+app = create_asgi_app()
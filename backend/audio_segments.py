@@ -0,0 +1,154 @@
+# backend/audio_segments.py
+import io
+import re
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from backend.config import get_config # 从 config 模块导入
+
+# ai.json 中用于分段转录配置的保留键
+SEGMENTED_CONFIG_KEY = 'segmented_transcription'
+
+DEFAULT_SEGMENTED_CONFIG = {
+    "enabled": False,              # 是否对长音频自动启用分段转录 (请求中也可显式指定)
+    "min_duration_seconds": 600,   # 自动启用分段的最短时长
+    "segment_seconds": 300,        # 每段时长
+    "overlap_seconds": 8,          # 相邻两段的重叠时长
+    "max_workers": 4,              # 并发转录的段数上限
+}
+
+# 转录行末尾的时间段，如 [01:02.345-01:05.000]
+_TIME_RANGE_RE = re.compile(r'\[(\d+):(\d+(?:\.\d+)?)-(\d+):(\d+(?:\.\d+)?)\]\s*$')
+
+def get_segmented_config():
+    """返回合并默认值后的分段转录配置"""
+    segmented_config = dict(DEFAULT_SEGMENTED_CONFIG)
+    segmented_config.update(get_config().get(SEGMENTED_CONFIG_KEY) or {})
+    return segmented_config
+
+# --- WAV 切分 ---
+
+def wav_info(local_path):
+    """返回 (总帧数, 采样率)；不是可解析的 WAV 文件时返回 None"""
+    try:
+        with wave.open(local_path, 'rb') as w:
+            return w.getnframes(), w.getframerate()
+    except (wave.Error, EOFError, OSError):
+        return None
+
+def plan_segments(total_frames, framerate, segment_seconds, overlap_seconds):
+    """规划分段，返回 [(start_frame, end_frame), ...]，相邻两段重叠 overlap_seconds"""
+    segment_frames = max(int(segment_seconds * framerate), 1)
+    overlap_frames = min(int(overlap_seconds * framerate), segment_frames // 2)
+    step = segment_frames - overlap_frames
+    segments = []
+    start = 0
+    while True:
+        end = min(start + segment_frames, total_frames)
+        segments.append((start, end))
+        if end >= total_frames:
+            break
+        start += step
+    return segments
+
+def read_wav_segment(local_path, start_frame, end_frame):
+    """读取 [start_frame, end_frame) 区间并封装为独立的 WAV 字节串"""
+    with wave.open(local_path, 'rb') as src:
+        params = src.getparams()
+        src.setpos(start_frame)
+        frames = src.readframes(end_frame - start_frame)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as dst:
+        dst.setparams(params)
+        dst.writeframes(frames)
+    return buffer.getvalue()
+
+# --- 结果拼接 ---
+
+def _format_time(seconds):
+    minutes, seconds = divmod(max(seconds, 0.0), 60)
+    return f"{int(minutes):02d}:{seconds:06.3f}"
+
+def shift_line(line, offset_seconds):
+    """将转录行末尾的时间段平移 offset_seconds，返回 (新行, 起始秒数)；没有时间段时起始秒数为 None"""
+    match = _TIME_RANGE_RE.search(line)
+    if not match:
+        return line, None
+    start = int(match.group(1)) * 60 + float(match.group(2)) + offset_seconds
+    end = int(match.group(3)) * 60 + float(match.group(4)) + offset_seconds
+    return f"{line[:match.start()]}[{_format_time(start)}-{_format_time(end)}]", start
+
+def merge_segment_text(text, offset_seconds, keep_from, keep_until, previous_lines):
+    """处理一段的转录结果
+
+    时间段平移到整段音频的时间轴后，只保留起始时间落在 [keep_from, keep_until) 内的行，
+    从而去掉重叠区域里重复识别的内容；没有时间段的行则与上一段末尾的行逐字比较去重。
+    """
+    recent = {line.strip() for line in previous_lines[-5:]}
+    kept = []
+    for raw_line in text.splitlines():
+        if not raw_line.strip():
+            continue
+        line, start = shift_line(raw_line.strip(), offset_seconds)
+        if start is None:
+            if line in recent:
+                continue
+        elif start < keep_from or start >= keep_until:
+            continue
+        kept.append(line)
+    return kept
+
+def transcribe_segmented(local_path, transcribe_segment, on_complete=None, segmented_config=None):
+    """将 WAV 音频切成重叠的段并发转录，按顺序流式输出拼接后的结果
+
+    Args:
+        local_path: WAV 文件路径
+        transcribe_segment: 回调 (segment_index, wav_bytes) -> 转录文本，失败时抛出异常 (重试由回调自行负责，本函数不再重试)
+        on_complete: 可选回调，所有段都成功时以完整转录文本调用
+
+    Returns:
+        generator: 逐段产出文本
+    """
+    segmented_config = segmented_config or get_segmented_config()
+    total_frames, framerate = wav_info(local_path)
+    segments = plan_segments(
+        total_frames, framerate,
+        segmented_config['segment_seconds'], segmented_config['overlap_seconds']
+    )
+
+    def run_segment(index, start_frame, end_frame):
+        wav_bytes = read_wav_segment(local_path, start_frame, end_frame)
+        try:
+            return transcribe_segment(index, wav_bytes)
+        except Exception as e:
+            print(f"第 {index + 1}/{len(segments)} 段转录失败: {e}")
+            raise
+
+    def generate():
+        print(f"分段转录: {len(segments)} 段，并发 {segmented_config['max_workers']}")
+        executor = ThreadPoolExecutor(max_workers=segmented_config['max_workers'], thread_name_prefix='segment')
+        futures = [executor.submit(run_segment, i, start, end) for i, (start, end) in enumerate(segments)]
+        all_lines = []
+        failed = False
+        try:
+            for i, future in enumerate(futures):
+                start, end = segments[i]
+                # 相邻两段以重叠区的中点为界
+                keep_from = (start + segments[i - 1][1]) / 2 / framerate if i > 0 else float('-inf')
+                keep_until = (segments[i + 1][0] + end) / 2 / framerate if i + 1 < len(segments) else float('inf')
+                try:
+                    text = future.result()
+                except Exception as e:
+                    failed = True
+                    yield f"Error in stream: 第 {i + 1} 段转录失败: {e}\n"
+                    continue
+                lines = merge_segment_text(text, start / framerate, keep_from, keep_until, all_lines)
+                all_lines.extend(lines)
+                if lines:
+                    yield '\n'.join(lines) + '\n'
+            if on_complete and not failed:
+                on_complete('\n'.join(all_lines))
+        finally:
+            # 客户端断开或出错时，取消尚未开始的段
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return generate()
@@ -1,13 +1,26 @@
 # backend/audio_service.py
 import os
 import time
+import asyncio
 import base64
 import json
 import openai
 import requests
 import httpx # 导入 httpx 用于代理
 from flask import jsonify, Response, stream_with_context
-from backend.config import get_model_config, get_script_dir, get_gemini_config # 导入配置
+from backend.config import get_model_config, get_script_dir, get_prompt, report_rate_limited # 导入配置
+from backend.client_pool import get_client, get_async_client # 复用进程级 OpenAI 客户端
+from backend.rate_limit import acquire_upstream, acquire_upstream_async, UpstreamRateLimitExceeded # 多进程共享的上游令牌桶
+from backend.stream_log import StreamLog # 采样、非阻塞的流式日志与首 token 指标
+from backend.resilience import call_with_failover, call_with_failover_async, UpstreamStatusError, UpstreamRateLimited # 重试与故障转移
+from backend.admission import admitted, primed, aprimed, admit_model_call, AdmissionRejected, PRIORITY_INTERACTIVE, PRIORITY_TRANSCRIPTION # 上游调用准入控制
+from backend.cache_service import transcription_cache, report_cache, text_fingerprint # 转录/分析结果缓存
+from backend.singleflight import transcription_flight, report_flight # 合并并发的相同请求
+from backend.audio_upload import should_stream_upload, stream_audio_completion, stream_audio_completion_async # 大文件流式上传
+from backend.audio_segments import get_segmented_config, wav_info, transcribe_segmented # 长音频分段并发转录
+from backend.chunked_upload import audio_extension, save_stream_atomically # 上传文件落盘与哈希校验
+from backend.audio_store import get_audio_store, is_valid_object_name # 分片音频存储
+from backend.transcode import schedule_transcode # 上传后后台转码为压缩格式
 
 # --- 音频文件处理逻辑 ---
 
@@ -16,21 +29,12 @@ def check_audio_file_status(audio_folder, content_type, file_hash):
     if not file_hash:
         return {"error": "缺少文件哈希参数"}, 400
 
-    # 根据 content_type 推断文件扩展名
-    extension = '.mp3'
-    if '/' in content_type:
-        mime_suffix = content_type.split('/')[-1]
-        if mime_suffix == 'wav': extension = '.wav'
-        elif mime_suffix == 'ogg': extension = '.ogg'
-        elif mime_suffix == 'aac': extension = '.aac'
-        # 可以根据需要添加更多格式
-
+    extension = audio_extension(content_type) # 根据 content_type 推断文件扩展名
     object_name = f"{file_hash}{extension}"
-    local_path = os.path.join(audio_folder, object_name)
 
     try:
-        if os.path.exists(local_path):
-            print(f"本地文件已存在: {local_path}")
+        if get_audio_store(audio_folder).exists(object_name):
+            print(f"本地文件已存在: {object_name}")
             return {
                 "status": "exists",
                 "object_name": object_name # 返回文件名供后续使用
@@ -45,8 +49,8 @@ def check_audio_file_status(audio_folder, content_type, file_hash):
         print(f"检查本地音频文件状态时出错: {e}")
         return {"error": f"检查文件状态失败: {str(e)}"}, 500
 
-def save_uploaded_audio(audio_folder, file, object_name):
-    """保存上传的音频文件到本地"""
+def save_uploaded_audio(audio_folder, file, object_name, keep_original=None):
+    """保存上传的音频文件到本地，之后按配置在后台转码 (keep_original 指定是否保留原文件)"""
     if not file:
         return {"error": "缺少文件部分"}, 400
     if not object_name:
@@ -54,24 +58,35 @@ def save_uploaded_audio(audio_folder, file, object_name):
     if file.filename == '':
         return {"error": "未选择文件"}, 400
 
+    if not is_valid_object_name(object_name):
+        return {"error": f"非法的 object_name: {object_name}"}, 400
+
     try:
-        local_path = os.path.join(audio_folder, object_name)
-        file.save(local_path)
-        print(f"文件已保存到本地: {local_path}")
+        # 先流式写入临时文件并计算 MD5，校验通过后原子移动，中断的上传不会留下半个文件
+        save_stream_atomically(audio_folder, file.stream, object_name)
+        print(f"文件已保存到本地: {object_name}")
+        schedule_transcode(audio_folder, object_name, keep_original)
         return {"message": "文件上传成功", "object_name": object_name}, 200
+    except ValueError as e: # 哈希不一致或超过大小上限
+        print(f"上传文件校验失败 ({object_name}): {e}")
+        return {"error": str(e)}, 400
     except Exception as e:
         print(f"保存上传文件时出错: {e}")
         return {"error": f"保存文件失败: {str(e)}"}, 500
 
 # --- AI 音频处理逻辑 ---
 
-def _process_audio_with_ai(model_config, audio_data_base64, audio_format, audio_prompt_text):
-    """内部函数：使用 AI 模型处理音频数据"""
+@admitted(PRIORITY_TRANSCRIPTION) # 排队获取执行槽位，流结束后释放
+def _process_audio_with_ai(model_config, audio_data_base64, audio_format, audio_prompt_text, on_complete=None):
+    """内部函数：使用 AI 模型处理音频数据
+
+    on_complete: 可选回调，仅在流完整结束且未出错时以完整转录文本调用
+    """
+    acquire_upstream(model_config) # 共享令牌桶，等待超时抛出 UpstreamRateLimitExceeded (ValueError)
+    stream_log = StreamLog('transcription', model_config.get('model'))
     try:
-        client = openai.OpenAI(
-            api_key=model_config['api_key'],
-            base_url=model_config['base_url']
-        )
+        # 重试由 call_with_failover 负责 (换 key / 备用模型)，关闭 SDK 自带的原地重试
+        client = get_client(model_config['api_key'], model_config['base_url']).with_options(max_retries=0)
         response = client.chat.completions.create(
             model=model_config['model'],
             messages=[
@@ -96,29 +111,36 @@ def _process_audio_with_ai(model_config, audio_data_base64, audio_format, audio_
 
         # 生成器函数，用于流式返回
         def generate():
+            parts = []
             try:
-                print(f"识别结果: ")
+                yield # 由 primed() 消费：之后即使从未迭代，关闭流时也会关闭上游响应
                 for chunk in response:
                     delta = chunk.choices[0].delta.content
                     if delta:
+                        parts.append(delta)
                         yield delta
-                        print(delta, end='', flush=True) # 实时打印到控制台
-                print("\n--- 识别结束 ---") # 标记流结束
+                        stream_log.chunk(delta) # 采样输出到日志，不逐 token 打印
+                stream_log.finish()
+                if on_complete:
+                    on_complete(''.join(parts))
             except Exception as e:
-                print(f"\n音频流处理中发生错误: {e}")
+                stream_log.finish(error=e)
                 yield f"Error in stream: {e}" # 在流中返回错误信息
+            finally:
+                response.close()
 
-        return generate() # 返回生成器
+        return primed(generate()) # 返回生成器
 
     except openai.APIConnectionError as e:
         print(f"无法连接到 API ({model_config.get('model', '未知模型')}): {e}")
         raise ConnectionError(f"无法连接到 API: {e}") # 抛出特定异常
     except openai.RateLimitError as e:
         print(f"API 请求频率受限 ({model_config.get('model', '未知模型')}): {e}")
-        raise ValueError(f"API 请求频率过高: {e}") # 抛出特定异常
+        report_rate_limited(model_config, e.response.headers.get('retry-after'))
+        raise UpstreamRateLimited(f"API 请求频率过高: {e}") # 抛出特定异常
     except openai.APIStatusError as e:
         print(f"API 返回错误状态 ({model_config.get('model', '未知模型')}): {e.status_code} - {e.response}")
-        raise RuntimeError(f"API 返回错误: {e.status_code} {e.message}") # 抛出特定异常
+        raise UpstreamStatusError(f"API 返回错误: {e.status_code} {e.message}", e.status_code) # 抛出特定异常
     except Exception as e:
         print(f"调用 AI 处理音频时发生未知错误: {e}")
         import traceback
@@ -126,13 +148,138 @@ def _process_audio_with_ai(model_config, audio_data_base64, audio_format, audio_
         raise RuntimeError(f"AI 处理音频失败: {str(e)}") # 抛出通用异常
 
 
-def transcribe_audio(audio_folder, script_dir, object_name, model_name):
-    """处理音频转录请求"""
+def _should_segment(local_path, file_format, segmented):
+    """判断是否使用分段并发转录：请求显式指定，或配置开启且 WAV 时长超过阈值"""
+    if segmented is False or file_format != 'wav':
+        if segmented:
+            print(f"分段转录目前仅支持 WAV，{local_path} 将整段转录")
+        return False
+    info = wav_info(local_path)
+    if info is None:
+        return False
+    if segmented:
+        return True
+    segmented_config = get_segmented_config()
+    total_frames, framerate = info
+    return segmented_config['enabled'] and total_frames / framerate >= segmented_config['min_duration_seconds']
+
+def _transcribe_wav_segment(model_name, audio_prompt, index, wav_bytes):
+    """内部函数：转录一段 WAV 音频，返回完整文本
+
+    建立连接和读完整段转录流在同一次尝试中完成，重试和换 key 只由 call_with_failover 负责。
+    """
+    audio_base64 = base64.b64encode(wav_bytes).decode('utf-8')
+
+    def attempt(md):
+        completed = []
+        last_chunk = None
+        for last_chunk in _process_audio_with_ai(md, audio_base64, 'wav', audio_prompt, on_complete=completed.append):
+            pass
+        if not completed:
+            # 流中途出错 (错误以 "Error in stream: ..." 写在最后一块中)，按连接失败处理以便重试
+            raise ConnectionError(f"第 {index + 1} 段转录流未正常结束: {last_chunk}")
+        return completed[0]
+
+    return call_with_failover(model_name, attempt)
+
+def _load_audio_prompt(script_dir):
+    """返回 (audio prompt 文本, 版本)，文件不存在时使用空提示"""
+    audio_prompt_path = os.path.join(script_dir, 'audio_prompt.txt')
+    snapshot = get_prompt(audio_prompt_path)
+    if snapshot is None:
+        print(f"警告: {audio_prompt_path} 未找到，将使用空提示。")
+        return "", text_fingerprint("")
+    return snapshot.value, snapshot.version
+
+def _audio_format(local_path):
+    """按实际文件的扩展名返回音频格式 (转码后与 object_name 的扩展名不同)，无扩展名时按 mp3 处理"""
+    extension = os.path.splitext(local_path)[1].lower()
+    return extension[1:] if extension else "mp3"
+
+class _TranscriptionPlan:
+    """一次转录请求解析后的参数，同步与异步转录共用 (缓存键、合并键与是否分段在此统一确定)"""
+    __slots__ = ('object_name', 'model_name', 'audio_prompt', 'prompt_hash', 'local_path',
+                 'file_format', 'use_segments', 'cache_model_name', 'flight_key', 'cached_transcript')
+
+    def __init__(self, object_name, model_name, audio_prompt, prompt_hash, local_path, segmented):
+        self.object_name = object_name
+        self.model_name = model_name
+        self.audio_prompt = audio_prompt
+        self.prompt_hash = prompt_hash
+        self.local_path = local_path
+        self.file_format = _audio_format(local_path)
+        self.use_segments = _should_segment(local_path, self.file_format, segmented)
+        # 分段转录的结果与整段转录不同，使用独立的缓存键
+        self.cache_model_name = f"{model_name}#segmented" if self.use_segments else model_name
+        self.flight_key = (object_name, self.cache_model_name, prompt_hash)
+        # object_name 即音频内容哈希，命中缓存时直接回放，无需读取和上传音频
+        self.cached_transcript = transcription_cache.get(object_name, self.cache_model_name, prompt_hash)
+
+    def save_to_cache(self, transcript):
+        transcription_cache.put(self.object_name, self.cache_model_name, self.prompt_hash, transcript)
+
+    def transcribe_segments(self):
+        """分段并发转录，返回逐段产出文本的生成器 (各段自行读取对应区间)"""
+        return transcribe_segmented(
+            self.local_path,
+            lambda index, wav_bytes: _transcribe_wav_segment(self.model_name, self.audio_prompt, index, wav_bytes),
+            on_complete=self.save_to_cache
+        )
+
+def _plan_transcription(audio_folder, script_dir, object_name, model_name, segmented=None):
+    """解析转录请求，返回 _TranscriptionPlan 或 (错误字典, 状态码)"""
     if not object_name:
-        return jsonify({"error": "缺少 object_name 参数"}), 400
+        return {"error": "缺少 object_name 参数"}, 400
+
+    # 读取 audio prompt (常驻内存，文件修改后自动重新加载)
+    audio_prompt, prompt_hash = _load_audio_prompt(script_dir)
+
+    local_path = get_audio_store(audio_folder).resolve(object_name) # 分片目录 (或尚未迁移的平铺目录) 中的路径
+    if local_path is None:
+        return {"error": f"非法的 object_name: {object_name}"}, 400
+    plan = _TranscriptionPlan(object_name, model_name, audio_prompt, prompt_hash, local_path, segmented)
+    if plan.cached_transcript is not None:
+        print(f"转录缓存命中: {object_name} ({model_name})")
+    return plan
+
+def _transcription_error(e, object_name, model_name):
+    """将开始转录时抛出的异常转换为 (错误字典, 状态码[, 响应头])"""
+    if isinstance(e, AdmissionRejected): # 上游调用排队已满或排队超时
+        return {"error": str(e)}, 429, {"Retry-After": str(e.retry_after)}
+    if isinstance(e, (ConnectionError, ValueError, RuntimeError)): # 捕获内部函数抛出的特定异常
+        # 这些是 AI 调用相关的错误
+        status_code = 503 if isinstance(e, ConnectionError) else \
+                      429 if isinstance(e, ValueError) else 500
+        return {"error": str(e)}, status_code
+    if isinstance(e, KeyError):
+        return {"error": f"无效的模型名称: {model_name}"}, 400
+    print(f"处理音频识别时发生未知错误 ({object_name}): {e}")
+    import traceback
+    traceback.print_exc()
+    return {"error": f"处理音频识别失败: {str(e)}"}, 500
 
-    local_path = os.path.join(audio_folder, object_name)
+def open_transcription(audio_folder, script_dir, object_name, model_name, segmented=None):
+    """开始 (或加入、回放) 一次转录
+
+    segmented: True/False 显式指定是否分段并发转录 (仅 WAV)，None 时按配置自动判断
+
+    Returns:
+        生成器 (逐块产出转录文本，出错时在流中返回 "Error in stream: ...")，或 (错误字典, 状态码[, 响应头])
+    """
+    plan = _plan_transcription(audio_folder, script_dir, object_name, model_name, segmented)
+    if isinstance(plan, tuple):
+        return plan
+    if plan.cached_transcript is not None:
+        return transcription_cache.replay(plan.cached_transcript)
+
+    # 相同音频正在转录时，直接订阅进行中的流
+    joined_stream = transcription_flight.join(plan.flight_key)
+    if joined_stream is not None:
+        return joined_stream
+
+    local_path = plan.local_path
     file_content = None
+    stream_upload = False # 大文件不读入内存，发送时从磁盘逐块 base64 编码
 
     # 尝试读取本地文件，增加重试逻辑
     for attempt in range(3):
@@ -142,6 +289,12 @@ def transcribe_audio(audio_folder, script_dir, object_name, model_name):
                 time.sleep(0.2 * (attempt + 1))
                 continue
             with open(local_path, 'rb') as f:
+                if plan.use_segments:
+                    break # 分段转录时由各段自行读取对应区间
+                if should_stream_upload(os.fstat(f.fileno()).st_size):
+                    stream_upload = True
+                    print(f"文件 {local_path} 较大，将流式编码上传。")
+                    break
                 file_content = f.read()
                 print(f"文件 {local_path} 读取成功。")
                 break
@@ -152,90 +305,228 @@ def transcribe_audio(audio_folder, script_dir, object_name, model_name):
             print(f"尝试 {attempt + 1}/3: 读取本地文件时发生意外错误 ({local_path}): {e}")
             time.sleep(0.2 * (attempt + 1))
 
-    if file_content is None:
+    if file_content is None and not stream_upload and not plan.use_segments:
         print(f"尝试多次后仍无法读取文件: {local_path}")
-        return jsonify({"error": f"无法读取本地文件: {object_name} (尝试3次后失败)"}), 500
+        return {"error": f"无法读取本地文件: {object_name} (尝试3次后失败)"}, 500
+
+    try:
+        if plan.use_segments:
+            return transcription_flight.stream(plan.flight_key, plan.transcribe_segments)
+
+        # 每次尝试都重新获取模型配置：失败时换 key 或备用模型重试，音频无需重新上传到本服务
+        if stream_upload:
+            start_upstream = lambda: call_with_failover(model_name, lambda md: stream_audio_completion(
+                md, local_path, plan.file_format, plan.audio_prompt, on_complete=plan.save_to_cache
+            ))
+        else:
+            # Base64 编码
+            base64_audio = base64.b64encode(file_content).decode('utf-8')
+            file_content = None # 尽早释放原始字节
+            start_upstream = lambda: call_with_failover(model_name, lambda md: _process_audio_with_ai(
+                md, base64_audio, plan.file_format, plan.audio_prompt, on_complete=plan.save_to_cache
+            ))
+
+        return transcription_flight.stream(plan.flight_key, start_upstream)
+    except Exception as e:
+        return _transcription_error(e, object_name, model_name)
+
+def transcribe_audio(audio_folder, script_dir, object_name, model_name, segmented=None):
+    """处理音频转录请求，返回流式 Response 或 (jsonify(...), 状态码[, 响应头])"""
+    result = open_transcription(audio_folder, script_dir, object_name, model_name, segmented)
+    if isinstance(result, tuple):
+        return (jsonify(result[0]),) + tuple(result[1:])
+    return Response(stream_with_context(result))
 
+
+# --- 异步 (ASGI) 音频转录逻辑 ---
+
+@admitted(PRIORITY_TRANSCRIPTION)
+async def _process_audio_with_ai_async(model_config, audio_data_base64, audio_format, audio_prompt_text, on_complete=None):
+    """_process_audio_with_ai 的异步版本，异常约定相同"""
+    await acquire_upstream_async(model_config)
+    stream_log = StreamLog('transcription', model_config.get('model'))
     try:
-        # 推断格式和获取模型配置
-        file_format = object_name.split('.')[-1].lower() if '.' in object_name else "mp3"
-        md = get_gemini_config(model_name)
-        if not md:
-             return jsonify({"error": f"无效的模型名称: {model_name}"}), 400
-
-        # 读取 audio prompt
-        audio_prompt_path = os.path.join(script_dir, 'audio_prompt.txt')
+        client = get_async_client(model_config['api_key'], model_config['base_url']).with_options(max_retries=0)
+        response = await client.chat.completions.create(
+            model=model_config['model'],
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "input_audio",
+                            "input_audio": {
+                                "data": audio_data_base64,
+                                "format": audio_format
+                            }
+                        },
+                        {"type": "text", "text": audio_prompt_text}
+                    ]
+                }
+            ],
+            modalities=["text"],
+            stream=True
+        )
+    except openai.APIConnectionError as e:
+        print(f"无法连接到 API ({model_config.get('model', '未知模型')}): {e}")
+        raise ConnectionError(f"无法连接到 API: {e}")
+    except openai.RateLimitError as e:
+        print(f"API 请求频率受限 ({model_config.get('model', '未知模型')}): {e}")
+        report_rate_limited(model_config, e.response.headers.get('retry-after'))
+        raise UpstreamRateLimited(f"API 请求频率过高: {e}")
+    except openai.APIStatusError as e:
+        print(f"API 返回错误状态 ({model_config.get('model', '未知模型')}): {e.status_code} - {e.response}")
+        raise UpstreamStatusError(f"API 返回错误: {e.status_code} {e.message}", e.status_code)
+
+    async def generate():
+        parts = []
         try:
-            with open(audio_prompt_path, 'r', encoding='utf-8') as file:
-                audio_prompt = file.read()
-        except FileNotFoundError:
-            print(f"警告: {audio_prompt_path} 未找到，将使用空提示。")
-            audio_prompt = ""
+            yield # 由 aprimed() 消费
+            async for chunk in response:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+                    stream_log.chunk(delta)
+            stream_log.finish()
+            if on_complete:
+                on_complete(''.join(parts))
         except Exception as e:
-             print(f"读取 audio_prompt.txt 时出错: {e}")
-             return jsonify({"error": f"读取音频提示失败: {str(e)}"}), 500
+            stream_log.finish(error=e)
+            yield f"Error in stream: {e}"
+        finally:
+            await response.close()
 
-        # Base64 编码
-        base64_audio = base64.b64encode(file_content).decode('utf-8')
+    return await aprimed(generate())
 
-        # 调用内部函数处理 AI 逻辑
-        generator = _process_audio_with_ai(md, base64_audio, file_format, audio_prompt)
-        # 直接返回 Response 对象，包含流式生成器
-        return Response(stream_with_context(generator))
+async def transcribe_audio_async(audio_folder, script_dir, object_name, model_name, segmented=None):
+    """transcribe_audio 的异步版本 (ASGI 模式)
 
-    except (ConnectionError, ValueError, RuntimeError) as e: # 捕获内部函数抛出的特定异常
-        # 这些是 AI 调用相关的错误
-        status_code = 503 if isinstance(e, ConnectionError) else \
-                      429 if isinstance(e, ValueError) else 500
-        return jsonify({"error": str(e)}), status_code
-    except KeyError:
-         return jsonify({"error": f"无效的模型名称: {model_name}"}), 400
+    与同步版本共用缓存键、并发合并 (同一音频的同步与异步请求共享一次上游调用) 和分段转录逻辑。
+
+    Returns:
+        异步生成器 (逐块产出转录文本)，或 (错误字典, 状态码[, 响应头])
+    """
+    plan = await asyncio.to_thread(_plan_transcription, audio_folder, script_dir, object_name, model_name, segmented)
+    if isinstance(plan, tuple):
+        return plan
+    if plan.cached_transcript is not None:
+        async def replay():
+            for chunk in transcription_cache.replay(plan.cached_transcript):
+                yield chunk
+        return replay()
+
+    joined_stream = await transcription_flight.join_async(plan.flight_key)
+    if joined_stream is not None:
+        return joined_stream
+
+    local_path = plan.local_path
+    for attempt in range(3):
+        if os.path.exists(local_path):
+            break
+        print(f"尝试 {attempt + 1}/3: 文件 {local_path} 尚不存在，等待...")
+        await asyncio.sleep(0.2 * (attempt + 1))
+    else:
+        return {"error": f"无法读取本地文件: {object_name} (尝试3次后失败)"}, 500
+
+    try:
+        if plan.use_segments:
+            # 各段在分段转录的线程池中执行，合并流在后台线程中读取
+            async def start_upstream():
+                return await asyncio.to_thread(plan.transcribe_segments)
+        elif should_stream_upload(os.path.getsize(local_path)):
+            async def start_upstream():
+                return await call_with_failover_async(model_name, lambda md: stream_audio_completion_async(
+                    md, local_path, plan.file_format, plan.audio_prompt, on_complete=plan.save_to_cache
+                ))
+        else:
+            def read_and_encode():
+                with open(local_path, 'rb') as f:
+                    return base64.b64encode(f.read()).decode('utf-8')
+
+            base64_audio = await asyncio.to_thread(read_and_encode)
+
+            async def start_upstream():
+                return await call_with_failover_async(model_name, lambda md: _process_audio_with_ai_async(
+                    md, base64_audio, plan.file_format, plan.audio_prompt, on_complete=plan.save_to_cache
+                ))
+
+        return await transcription_flight.stream_async(plan.flight_key, start_upstream)
     except Exception as e:
-        print(f"处理音频识别时发生未知错误 ({object_name}): {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": f"处理音频识别失败: {str(e)}"}), 500
+        return _transcription_error(e, object_name, model_name)
 
 
 # --- 举报信息分析逻辑 ---
 
-def analyze_report_info(script_dir, object_name, transcription_text):
-    """分析举报信息"""
+def run_report_analysis(script_dir, object_name, transcription_text, priority=PRIORITY_INTERACTIVE):
+    """分析举报信息，返回 (结果字典, 状态码[, 响应头])
+
+    priority: 上游调用准入优先级，后台任务可传入较低的优先级，不与交互请求争抢槽位
+    """
     if not object_name:
-        return jsonify({"error": "缺少 object_name 参数"}), 400
+        return {"error": "缺少 object_name 参数"}, 400
     if not transcription_text:
-        return jsonify({"error": "缺少 transcription_text 参数"}), 400
+        return {"error": "缺少 transcription_text 参数"}, 400
 
     # 选择默认模型 (可以考虑从配置读取)
     model_name = "gemini-2.5-flash-preview-04-17"
-    md = get_gemini_config(model_name)
-
-    if not md:
-        return jsonify({"error": f"模型配置未找到: {model_name}"}), 500
 
+    # 提示词模板常驻内存，文件修改后自动重新加载
+    report_prompt_path = os.path.join(script_dir, 'report_prompt.txt')
+    snapshot = get_prompt(report_prompt_path)
+    if snapshot is None:
+        print(f"错误: 举报提示文件 {report_prompt_path} 未找到。")
+        return {"error": "举报提示文件未找到"}, 500
+    prompt_template, template_fingerprint = snapshot.value, snapshot.version
     try:
-        # 从文件读取提示词模板
-        report_prompt_path = os.path.join(script_dir, 'report_prompt.txt')
-        with open(report_prompt_path, 'r', encoding='utf-8') as f:
-            prompt_template = f.read()
-
         # 格式化提示词
         prompt = prompt_template.format(
             transcription_text=transcription_text,
             object_name=object_name
         )
+    except Exception as e:
+        print(f"格式化举报提示词时出错: {e}")
+        return {"error": f"分析举报信息失败: {str(e)}"}, 500
 
-        client = openai.OpenAI(
-            api_key=md['api_key'],
-            base_url=md['base_url']
-        )
-        response = client.chat.completions.create(
-            model=md['model'],
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            stream=False # 分析接口不需要流式
+    # 相同模板 + 相同文本的分析结果直接复用 (模板版本即内容指纹)
+    cached_result = report_cache.get(model_name, prompt, template_fingerprint)
+    if cached_result is not None:
+        print(f"分析缓存命中: {object_name}")
+        return cached_result, 200
+
+    # 并发的相同分析请求只调用一次上游模型
+    flight_key = report_cache.make_key(model_name, prompt)
+    try:
+        result, status_code = report_flight.do(
+            flight_key,
+            lambda: _request_report_analysis(model_name, prompt, template_fingerprint, priority)
         )
+    except AdmissionRejected as e:
+        return {"error": str(e)}, 429, {"Retry-After": str(e.retry_after)}
+    return result, status_code
+
+def analyze_report_info(script_dir, object_name, transcription_text):
+    """分析举报信息"""
+    result = run_report_analysis(script_dir, object_name, transcription_text)
+    return (jsonify(result[0]),) + tuple(result[1:])
+
+def _request_report_analysis(model_name, prompt, template_fingerprint, priority=PRIORITY_INTERACTIVE):
+    """内部函数：调用模型分析举报信息，返回 (结果字典, 状态码)"""
+    def attempt(md):
+        with admit_model_call(md, priority): # 排队获取执行槽位，交互的分析请求优先于转录
+            acquire_upstream(md)
+            client = get_client(md['api_key'], md['base_url']).with_options(max_retries=0)
+            return client.chat.completions.create(
+                model=md['model'],
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+                stream=False # 分析接口不需要流式
+            )
+
+    try:
+        # 连接失败、429、5xx 时退避后换 key 或备用模型重试
+        response = call_with_failover(model_name, attempt)
 
         content = response.choices[0].message.content
 
@@ -250,64 +541,72 @@ def analyze_report_info(script_dir, object_name, transcription_text):
             result = json.loads(content)
         except json.JSONDecodeError:
             print(f"模型响应内容 (非JSON): {content}")
-            return jsonify({"error": "模型未返回有效JSON", "raw_response": content}), 500
+            return {"error": "模型未返回有效JSON", "raw_response": content}, 500
 
         # 确保所有字段存在
         for key in ["school", "method", "phone", "time"]:
             result.setdefault(key, "") # 使用 setdefault 更简洁
 
-        return jsonify(result) # 返回 JSON 响应
+        report_cache.put(model_name, prompt, template_fingerprint, result)
 
-    except FileNotFoundError:
-        print(f"错误: 举报提示文件 {report_prompt_path} 未找到。")
-        return jsonify({"error": "举报提示文件未找到"}), 500
+        return result, 200
+
+    except AdmissionRejected:
+        raise # 由 analyze_report_info 返回 429 和 Retry-After
+    except UpstreamRateLimitExceeded as e:
+        print(f"分析举报信息时等待上游令牌超时: {e}")
+        return {"error": str(e)}, 429
+    except openai.RateLimitError as e:
+        print(f"分析举报信息时 API 请求频率受限: {e}")
+        return {"error": "API 请求频率过高，请稍后重试"}, 429
+    except ConnectionError as e: # 所有候选端点都处于熔断中
+        print(f"分析举报信息时上游不可用: {e}")
+        return {"error": str(e)}, 503
     except openai.OpenAIError as e:
         print(f"分析举报信息时 OpenAI API 错误: {e}")
-        return jsonify({"error": "AI模型API调用失败"}), 500
+        return {"error": "AI模型API调用失败"}, 500
     except Exception as e:
         print(f"分析举报信息时出错: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({"error": f"分析举报信息失败: {str(e)}"}), 500
+        return {"error": f"分析举报信息失败: {str(e)}"}, 500
 
 def get_audio_file(audio_folder, object_name):
-    """获取音频文件内容
-    
+    """定位音频文件 (不读取内容，由调用方从磁盘流式发送)
+
     Args:
         audio_folder: 音频文件存储目录
         object_name: 音频文件名
-        
+
     Returns:
-        tuple: (audio_data, content_type, status_code) 或 (None, None, status_code) 如果失败
+        tuple: (local_path, content_type, status_code) 或 (None, None, status_code) 如果失败
     """
     if not object_name:
         print("错误: 缺少object_name参数")
         return None, None, 400
-        
-    local_path = os.path.join(audio_folder, object_name)
-    
+    local_path = get_audio_store(audio_folder).resolve(object_name)
+    if local_path is None:
+        print(f"错误: 非法的文件名 - {object_name}")
+        return None, None, 400
+
     try:
-        if not os.path.exists(local_path):
+        if not os.path.isfile(local_path):
             print(f"错误: 文件不存在 - {local_path}")
             return None, None, 404
-            
-        with open(local_path, 'rb') as f:
-            audio_data = f.read()
-            
-        extension = os.path.splitext(object_name)[1].lower()
+        if not os.access(local_path, os.R_OK):
+            print(f"权限错误: 无法读取 {local_path}")
+            return None, None, 403
+
+        extension = os.path.splitext(local_path)[1].lower() # 转码后为压缩版本的扩展名
         content_type = {
             '.mp3': 'audio/mpeg',
             '.wav': 'audio/wav',
             '.ogg': 'audio/ogg',
             '.aac': 'audio/aac'
         }.get(extension, 'application/octet-stream')
-        
-        print(f"成功获取音频文件: {object_name} (类型: {content_type})")
-        return audio_data, content_type, 200
-        
-    except PermissionError as e:
-        print(f"权限错误: {e}")
-        return None, None, 403
+
+        return local_path, content_type, 200
+
     except Exception as e:
         print(f"获取音频文件时出错: {e}")
-        return None, None, 500
\ No newline at end of file
+        return None, None, 500
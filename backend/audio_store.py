@@ -0,0 +1,414 @@
+# backend/audio_store.py
+"""按哈希前缀分目录存放的音频存储，带 SQLite 索引和容量上限
+
+目录结构: AUDIO_FOLDER/ab/cd/abcd....wav (object_name 即内容 MD5，取前 4 位分两级目录)。
+索引 (AUDIO_FOLDER/.audio_index.db) 记录每个文件的大小、修改时间、最近访问时间以及是否被举报引用。
+总大小超过 capacity_bytes 时分层淘汰：先清理过期的上传临时文件，再按最近访问时间淘汰
+没有举报引用的音频，直到降到 low_watermark；被引用的音频永不淘汰。
+
+迁移旧的平铺目录 (在仓库根目录执行):
+    python -m backend.audio_store migrate
+    python -m backend.audio_store stats
+    python -m backend.audio_store evict
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from backend.config import get_config # 从 config 模块导入
+from backend.database_service import find_referenced_object_names
+from backend.metrics import registry
+
+# ai.json 中用于音频存储配置的保留键
+AUDIO_STORE_CONFIG_KEY = 'audio_store'
+
+DEFAULT_AUDIO_STORE_CONFIG = {
+    "capacity_bytes": 0,              # 音频总大小上限，0 表示不限制
+    "low_watermark": 0.9,             # 淘汰到容量的多少比例为止
+    "protect_recent_seconds": 3600,   # 最近多久内写入或访问过的音频不淘汰 (刚上传、尚未提交举报)
+    "touch_interval_seconds": 60,     # 同一文件的最近访问时间最多多久写一次索引
+}
+
+INDEX_FILE_NAME = '.audio_index.db'
+SHARD_LEVELS = 2 # 分目录层数，每层取哈希的 2 位 (修改后已有文件需重新迁移)
+UPLOADS_DIR_NAME = '.uploads' # 分块上传的临时文件目录 (chunked_upload)
+
+def get_audio_store_config():
+    """返回合并默认值后的音频存储配置"""
+    store_config = dict(DEFAULT_AUDIO_STORE_CONFIG)
+    store_config.update(get_config().get(AUDIO_STORE_CONFIG_KEY) or {})
+    return store_config
+
+def is_valid_object_name(object_name):
+    """只允许单层文件名，且不能是存储内部使用的隐藏文件"""
+    return bool(object_name) and os.path.basename(object_name) == object_name and not object_name.startswith('.')
+
+def is_compact_path(path):
+    """是否为转码生成的压缩版本 (隐藏文件名)"""
+    return os.path.basename(path).startswith('.')
+
+# 进程内最多记住多少个文件的上次 touch 时间 (LRU，超出时丢弃最久未读的记录)
+TOUCH_CACHE_SIZE = 4096
+
+class AudioStore:
+    """一个音频根目录的分片存储与索引"""
+
+    def __init__(self, root):
+        self.root = root
+        self.db_path = os.path.join(root, INDEX_FILE_NAME)
+        self._local = threading.local()
+        self._touched = OrderedDict() # object_name -> 上次写入 last_access 的时间 (最多 TOUCH_CACHE_SIZE 条)
+        self._touched_lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._init_db()
+
+    # --- 索引 ---
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS audio_objects (
+                object_name TEXT PRIMARY KEY,
+                rel_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                last_access REAL NOT NULL,
+                referenced INTEGER NOT NULL DEFAULT 0,
+                original_rel_path TEXT,
+                original_expires REAL
+            )
+        ''')
+        # rel_path 为读取时使用的文件 (转码后为压缩版本)，original_rel_path 为保留的原始文件，
+        # original_expires 不为空时原始文件只是暂时保留，到期后由 purge_replaced_originals 删除
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(audio_objects)')}
+        if 'original_rel_path' not in columns:
+            conn.execute('ALTER TABLE audio_objects ADD COLUMN original_rel_path TEXT')
+        if 'original_expires' not in columns:
+            conn.execute('ALTER TABLE audio_objects ADD COLUMN original_expires REAL')
+        # 淘汰时按最近访问时间扫描未被引用的音频
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_audio_objects_lru ON audio_objects (referenced, last_access)')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_audio_objects_original_expires ON audio_objects (original_expires)
+            WHERE original_expires IS NOT NULL
+        ''')
+        conn.commit()
+
+    def _index(self, object_name, path, referenced=None):
+        stat = os.stat(path)
+        conn = self._conn()
+        conn.execute('''
+            INSERT INTO audio_objects (object_name, rel_path, size, mtime, last_access, referenced)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(object_name) DO UPDATE SET
+                rel_path = excluded.rel_path, size = excluded.size, mtime = excluded.mtime,
+                original_rel_path = NULL, original_expires = NULL,
+                last_access = excluded.last_access, referenced = MAX(referenced, excluded.referenced)
+        ''', (object_name, os.path.relpath(path, self.root), stat.st_size, stat.st_mtime, time.time(), int(bool(referenced))))
+        conn.commit()
+
+    def _lookup(self, object_name):
+        row = self._conn().execute('SELECT rel_path FROM audio_objects WHERE object_name = ?', (object_name,)).fetchone()
+        return os.path.join(self.root, row[0]) if row else None
+
+    def _stored_paths(self, object_name):
+        """索引中该音频占用的全部文件 (读取用文件和保留的原始文件)"""
+        row = self._conn().execute(
+            'SELECT rel_path, original_rel_path FROM audio_objects WHERE object_name = ?', (object_name,)
+        ).fetchone()
+        return [os.path.join(self.root, rel) for rel in (row or ()) if rel]
+
+    def _forget(self, object_name):
+        conn = self._conn()
+        conn.execute('DELETE FROM audio_objects WHERE object_name = ?', (object_name,))
+        conn.commit()
+
+    # --- 路径 ---
+
+    def shard_path(self, object_name):
+        """object_name 在分片目录中的路径 (不检查是否存在)"""
+        stem = os.path.splitext(object_name)[0].lower()
+        if len(stem) < 4 or any(c not in '0123456789abcdef' for c in stem[:4]):
+            stem = hashlib.md5(object_name.encode('utf-8')).hexdigest() # 非哈希命名的文件按名称哈希分片
+        return os.path.join(self.root, *[stem[i * 2:i * 2 + 2] for i in range(SHARD_LEVELS)], object_name)
+
+    def resolve(self, object_name):
+        """返回音频文件路径；非法名称返回 None
+
+        依次查找索引、分片目录、旧的平铺目录 (尚未迁移的文件)；都不存在时返回分片路径，
+        调用方用 os.path.exists 判断 (上传可能仍在进行)。找到时更新最近访问时间。
+        """
+        if not is_valid_object_name(object_name):
+            return None
+        path = self._lookup(object_name)
+        if path is not None:
+            if os.path.exists(path):
+                self.touch(object_name)
+                return path
+            self._forget(object_name) # 文件被手动删除，索引过期
+        sharded = self.shard_path(object_name)
+        for candidate in (sharded, os.path.join(self.root, object_name)):
+            if os.path.isfile(candidate):
+                self._index(object_name, candidate)
+                return candidate
+        return sharded
+
+    def exists(self, object_name):
+        path = self.resolve(object_name)
+        return path is not None and os.path.isfile(path)
+
+    def touch(self, object_name):
+        """更新最近访问时间 (按 touch_interval_seconds 节流，避免每次读取都写索引)"""
+        now = time.time()
+        with self._touched_lock:
+            last = self._touched.get(object_name)
+            if last is not None:
+                self._touched.move_to_end(object_name) # 经常读取的文件留在缓存中
+                if now - last < get_audio_store_config()['touch_interval_seconds']:
+                    return
+            self._touched[object_name] = now
+            if len(self._touched) > TOUCH_CACHE_SIZE:
+                self._touched.popitem(last=False) # 被丢弃的文件下次读取时多写一次索引
+        conn = self._conn()
+        conn.execute('UPDATE audio_objects SET last_access = ? WHERE object_name = ?', (now, object_name))
+        conn.commit()
+
+    def put(self, source_path, object_name):
+        """把已写完的临时文件原子地移动到分片目录并写入索引，返回最终路径
+
+        source_path 必须与存储根目录在同一文件系统 (如 AUDIO_FOLDER/.uploads)，os.replace 才是原子操作。
+        """
+        if not is_valid_object_name(object_name):
+            raise ValueError(f"非法的 object_name: {object_name}")
+        path = self.shard_path(object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stale_paths = self._stored_paths(object_name) + [os.path.join(self.root, object_name)]
+        os.replace(source_path, path)
+        for stale_path in stale_paths: # 同名的旧平铺文件、旧的压缩版本已被新文件取代
+            if stale_path != path and os.path.isfile(stale_path):
+                os.remove(stale_path)
+        self._index(object_name, path)
+        self.purge_replaced_originals()
+        self.enforce_capacity()
+        return path
+
+    def attach_compact(self, object_name, source_path, extension, keep_original=False, delete_original_after=0):
+        """登记转码后的压缩版本，之后 resolve 返回压缩文件；返回压缩文件路径
+
+        压缩文件以隐藏文件名 (.<object_name><extension>) 与原文件放在同一分片目录，不会被当作独立音频。
+        keep_original 为 False 时原文件在 delete_original_after 秒后才删除：转码完成前已经解析到原文件
+        路径的转录 (分段转录逐段重新打开文件，流式上传在发送时才打开) 在此期间仍可读取。
+        转码期间原文件被淘汰或替换时放弃本次结果并返回 None。
+        """
+        original = self._lookup(object_name)
+        if original is None or not os.path.isfile(original) or is_compact_path(original):
+            os.remove(source_path)
+            return None
+        compact_path = os.path.join(os.path.dirname(original), f".{object_name}{extension}")
+        os.replace(source_path, compact_path)
+        size = os.path.getsize(compact_path)
+        size += os.path.getsize(original) # 原文件删除前仍计入占用
+        original_expires = None if keep_original else time.time() + delete_original_after
+        conn = self._conn()
+        conn.execute('''
+            UPDATE audio_objects SET rel_path = ?, original_rel_path = ?, original_expires = ?, size = ?, mtime = ?
+            WHERE object_name = ?
+        ''', (os.path.relpath(compact_path, self.root), os.path.relpath(original, self.root), original_expires,
+              size, time.time(), object_name))
+        conn.commit()
+        if not keep_original and delete_original_after <= 0:
+            self.purge_replaced_originals()
+        return compact_path
+
+    def purge_replaced_originals(self):
+        """删除保留期已过、已被压缩版本取代的原文件，返回删除数"""
+        conn = self._conn()
+        rows = conn.execute('''
+            SELECT object_name, rel_path, original_rel_path FROM audio_objects
+            WHERE original_expires IS NOT NULL AND original_expires <= ?
+        ''', (time.time(),)).fetchall()
+        for object_name, rel_path, original_rel_path in rows:
+            try:
+                os.remove(os.path.join(self.root, original_rel_path))
+            except FileNotFoundError:
+                pass
+            compact_path = os.path.join(self.root, rel_path)
+            size = os.path.getsize(compact_path) if os.path.isfile(compact_path) else 0
+            conn.execute('''
+                UPDATE audio_objects SET original_rel_path = NULL, original_expires = NULL, size = ?
+                WHERE object_name = ? AND original_expires IS NOT NULL
+            ''', (size, object_name))
+        conn.commit()
+        return len(rows)
+
+    def mark_referenced(self, object_name):
+        """举报提交后标记音频被引用，被引用的音频不会被淘汰"""
+        if not is_valid_object_name(object_name):
+            return
+        conn = self._conn()
+        updated = conn.execute('UPDATE audio_objects SET referenced = 1 WHERE object_name = ?', (object_name,)).rowcount
+        conn.commit()
+        if not updated:
+            path = self.resolve(object_name)
+            if path and os.path.isfile(path):
+                self._index(object_name, path, referenced=True)
+
+    # --- 容量与淘汰 ---
+
+    def total_bytes(self):
+        return self._conn().execute('SELECT COALESCE(SUM(size), 0) FROM audio_objects').fetchone()[0]
+
+    def enforce_capacity(self, store_config=None):
+        """超过容量时淘汰，返回 {"removed": 文件数, "freed_bytes": 字节数}"""
+        store_config = store_config or get_audio_store_config()
+        capacity = store_config['capacity_bytes']
+        if not capacity or self.total_bytes() <= capacity:
+            return {"removed": 0, "freed_bytes": 0}
+        if not self._evict_lock.acquire(blocking=False):
+            return {"removed": 0, "freed_bytes": 0} # 其他线程正在淘汰
+        try:
+            return self._evict(store_config, int(capacity * store_config['low_watermark']))
+        finally:
+            self._evict_lock.release()
+
+    def _evict(self, store_config, target_bytes):
+        cutoff = time.time() - store_config['protect_recent_seconds']
+
+        # 第一层：过期的上传临时文件 (未计入索引，但同样占用磁盘)，按上传会话有效期判断；
+        # 以及保留期已过的转码前原文件
+        from backend.chunked_upload import cleanup_stale_uploads, get_upload_config # 延迟导入，避免循环依赖
+        removed, freed = cleanup_stale_uploads(self.root, get_upload_config()['session_ttl_seconds'])
+        self.purge_replaced_originals()
+
+        # 第二层：未被引用的音频，按最近访问时间从旧到新
+        total = self.total_bytes()
+        conn = self._conn()
+        while total > target_bytes:
+            candidates = conn.execute('''
+                SELECT object_name, rel_path, size, original_rel_path FROM audio_objects
+                WHERE referenced = 0 AND last_access < ?
+                ORDER BY last_access LIMIT 200
+            ''', (cutoff,)).fetchall()
+            if not candidates:
+                print(f"音频存储超过容量 ({total} 字节)，但没有可淘汰的未引用音频")
+                break
+            # 索引中的引用标记可能落后于举报库 (如功能上线前提交的举报)，以举报库为准
+            referenced = find_referenced_object_names([c[0] for c in candidates])
+            for object_name, rel_path, size, original_rel_path in candidates:
+                if object_name in referenced:
+                    conn.execute('UPDATE audio_objects SET referenced = 1 WHERE object_name = ?', (object_name,))
+                    continue
+                if total <= target_bytes:
+                    break
+                for path in filter(None, (rel_path, original_rel_path)):
+                    try:
+                        os.remove(os.path.join(self.root, path))
+                    except FileNotFoundError:
+                        pass
+                conn.execute('DELETE FROM audio_objects WHERE object_name = ?', (object_name,))
+                with self._touched_lock:
+                    self._touched.pop(object_name, None)
+                total -= size
+                freed += size
+                removed += 1
+            conn.commit()
+        if removed:
+            print(f"音频存储淘汰 {removed} 个文件，释放 {freed} 字节")
+        return {"removed": removed, "freed_bytes": freed}
+
+    def stats(self):
+        row = self._conn().execute('''
+            SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(referenced), 0),
+                   COALESCE(SUM(CASE WHEN referenced THEN size ELSE 0 END), 0)
+            FROM audio_objects
+        ''').fetchone()
+        return {
+            "objects": row[0],
+            "total_bytes": row[1],
+            "referenced_objects": row[2],
+            "referenced_bytes": row[3],
+            "capacity_bytes": get_audio_store_config()['capacity_bytes'],
+        }
+
+    # --- 迁移 ---
+
+    def migrate_flat(self, dry_run=False):
+        """把根目录下平铺的音频移动到分片目录并建立索引，同时按举报库标记引用"""
+        names = [n for n in os.listdir(self.root) if is_valid_object_name(n) and os.path.isfile(os.path.join(self.root, n))]
+        referenced = set()
+        for i in range(0, len(names), 500):
+            referenced |= find_referenced_object_names(names[i:i + 500])
+        moved = 0
+        for object_name in names:
+            if dry_run:
+                continue
+            source = os.path.join(self.root, object_name)
+            target = self.shard_path(object_name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+            self._index(object_name, target, referenced=object_name in referenced)
+            moved += 1
+        return {"found": len(names), "moved": moved, "referenced": len(referenced), "dry_run": dry_run}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_audio_store(audio_folder):
+    """返回音频根目录对应的进程级 AudioStore"""
+    root = os.path.abspath(audio_folder)
+    store = _stores.get(root)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(root)
+            if store is None:
+                store = _stores[root] = AudioStore(root)
+    return store
+
+@registry.register_collector
+def _collect_audio_store_metrics():
+    """导出各音频根目录的文件数和总大小 (/metrics)"""
+    samples_objects, samples_bytes = [], []
+    for root, store in list(_stores.items()):
+        stats = store.stats()
+        samples_objects.append(({"root": root}, stats['objects']))
+        samples_bytes.append(({"root": root}, stats['total_bytes']))
+    return [
+        ("audio_store_objects", "gauge", "音频存储中的文件数", samples_objects),
+        ("audio_store_bytes", "gauge", "音频存储的总大小 (字节)", samples_bytes),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['migrate', 'stats', 'evict'])
+    parser.add_argument('--audio-folder', default=None, help='音频根目录，默认 backend/audio_files')
+    parser.add_argument('--dry-run', action='store_true', help='migrate 时只统计不移动')
+    args = parser.parse_args()
+
+    audio_folder = args.audio_folder
+    if audio_folder is None:
+        from backend.app_setup import AUDIO_FOLDER
+        audio_folder = AUDIO_FOLDER
+    store = get_audio_store(audio_folder)
+    if args.command == 'migrate':
+        result = store.migrate_flat(dry_run=args.dry_run)
+    elif args.command == 'evict':
+        result = store.enforce_capacity()
+    else:
+        result = store.stats()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+# backend/audio_upload.py
+import os
+import json
+import base64
+import httpx
+from backend.config import get_config, report_rate_limited # 从 config 模块导入
+from backend.client_pool import get_http_client, get_async_http_client # 复用共享 httpx 连接池
+from backend.rate_limit import acquire_upstream, acquire_upstream_async # 多进程共享的上游令牌桶
+from backend.resilience import UpstreamStatusError, UpstreamRateLimited
+from backend.stream_log import StreamLog # 采样、非阻塞的流式日志与首 token 指标
+from backend.admission import admitted, primed, aprimed, PRIORITY_TRANSCRIPTION # 上游调用准入控制
+
+# ai.json 中用于流式上传配置的保留键
+AUDIO_UPLOAD_CONFIG_KEY = 'audio_upload'
+
+DEFAULT_AUDIO_UPLOAD_CONFIG = {
+    "stream_threshold_bytes": 8 * 1024 * 1024, # 超过该大小的音频走流式编码上传
+    "read_chunk_bytes": 3 * 64 * 1024,         # 每次读取的原始字节数 (必须是 3 的倍数)
+}
+
+_AUDIO_PLACEHOLDER = "__AUDIO_BASE64__"
+
+def get_audio_upload_config():
+    """返回合并默认值后的流式上传配置"""
+    upload_config = dict(DEFAULT_AUDIO_UPLOAD_CONFIG)
+    upload_config.update(get_config().get(AUDIO_UPLOAD_CONFIG_KEY) or {})
+    # base64 每 3 字节输出 4 字符，分块大小必须是 3 的倍数才能逐块拼接
+    upload_config['read_chunk_bytes'] -= upload_config['read_chunk_bytes'] % 3
+    return upload_config
+
+def should_stream_upload(file_size):
+    """判断该大小的音频是否应该走流式上传"""
+    return file_size >= get_audio_upload_config()['stream_threshold_bytes']
+
+def base64_length(size):
+    """原始字节数对应的 base64 编码长度"""
+    return 4 * ((size + 2) // 3)
+
+def iter_base64_file(local_path, chunk_size=None):
+    """逐块读取文件并输出 base64 编码后的字节，内存占用与文件大小无关"""
+    chunk_size = chunk_size or get_audio_upload_config()['read_chunk_bytes']
+    with open(local_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
+
+def build_audio_request_body(model, audio_format, audio_prompt_text, local_path):
+    """构造流式请求体
+
+    Returns:
+        tuple: (body_iterator, content_length)，请求体与 SDK 发送的 JSON 结构一致，
+               音频的 base64 数据在发送时才逐块生成
+    """
+    payload = {
+        "model": model,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "input_audio",
+                        "input_audio": {
+                            "data": _AUDIO_PLACEHOLDER,
+                            "format": audio_format
+                        }
+                    },
+                    {"type": "text", "text": audio_prompt_text}
+                ]
+            }
+        ],
+        "modalities": ["text"],
+        "stream": True
+    }
+    # base64 字符不需要 JSON 转义，因此可以直接把编码结果拼接在前后缀之间
+    prefix, suffix = json.dumps(payload, ensure_ascii=False).split(_AUDIO_PLACEHOLDER)
+    prefix, suffix = prefix.encode('utf-8'), suffix.encode('utf-8')
+    content_length = len(prefix) + base64_length(os.path.getsize(local_path)) + len(suffix)
+
+    def body():
+        yield prefix
+        yield from iter_base64_file(local_path)
+        yield suffix
+
+    return body(), content_length
+
+def _parse_sse_line(line):
+    """解析一行 SSE 数据，返回 (是否结束, 增量文本)"""
+    if not line.startswith('data:'):
+        return False, None
+    data = line[len('data:'):].strip()
+    if data == '[DONE]':
+        return True, None
+    chunk = json.loads(data)
+    choices = chunk.get('choices') or []
+    return False, (choices[0].get('delta', {}).get('content') if choices else None)
+
+def _build_headers(model_config, content_length):
+    return {
+        "Authorization": f"Bearer {model_config['api_key']}",
+        "Content-Type": "application/json",
+        "Content-Length": str(content_length),
+        "Accept": "text/event-stream"
+    }
+
+def _raise_for_status(model_config, status_code, headers, detail):
+    """按 _process_audio_with_ai 的约定把错误状态转换为异常"""
+    model_name = model_config.get('model', '未知模型')
+    if status_code == 429:
+        print(f"API 请求频率受限 ({model_name}): {detail}")
+        report_rate_limited(model_config, headers.get('retry-after'))
+        raise UpstreamRateLimited(f"API 请求频率过高: {detail}")
+    print(f"API 返回错误状态 ({model_name}): {status_code} - {detail}")
+    raise UpstreamStatusError(f"API 返回错误: {status_code} {detail}", status_code)
+
+@admitted(PRIORITY_TRANSCRIPTION) # 排队获取执行槽位，流结束后释放
+def stream_audio_completion(model_config, local_path, audio_format, audio_prompt_text, on_complete=None):
+    """直接从磁盘流式上传音频并返回转录文本生成器
+
+    与 _process_audio_with_ai 的约定一致：连接失败抛出 ConnectionError，
+    429 抛出 ValueError，其他错误状态抛出 RuntimeError；on_complete 仅在流完整结束时调用。
+    """
+    model_name = model_config.get('model', '未知模型')
+    acquire_upstream(model_config) # 共享令牌桶，等待超时抛出 UpstreamRateLimitExceeded (ValueError)
+    stream_log = StreamLog('transcription', model_name, upload='stream')
+    body, content_length = build_audio_request_body(
+        model_config['model'], audio_format, audio_prompt_text, local_path
+    )
+    url = model_config['base_url'].rstrip('/') + '/chat/completions'
+    client = get_http_client(model_config['base_url'])
+    request = client.build_request(
+        'POST', url,
+        content=body,
+        headers=_build_headers(model_config, content_length)
+    )
+
+    try:
+        response = client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        print(f"无法连接到 API ({model_name}): {e}")
+        raise ConnectionError(f"无法连接到 API: {e}")
+
+    if response.status_code >= 400:
+        try:
+            detail = response.read().decode('utf-8', errors='replace')[:500]
+        finally:
+            response.close()
+        _raise_for_status(model_config, response.status_code, response.headers, detail)
+    print(f"转录 API 调用完成 (流式上传 {content_length} 字节)。")
+
+    def generate():
+        parts = []
+        try:
+            yield # 由 primed() 消费：之后即使从未迭代，关闭流时也会关闭上游响应
+            for line in response.iter_lines():
+                done, delta = _parse_sse_line(line)
+                if done:
+                    break
+                if delta:
+                    parts.append(delta)
+                    yield delta
+                    stream_log.chunk(delta) # 采样输出到日志，不逐 token 打印
+            stream_log.finish()
+            if on_complete:
+                on_complete(''.join(parts))
+        except Exception as e:
+            stream_log.finish(error=e)
+            yield f"Error in stream: {e}" # 在流中返回错误信息
+        finally:
+            response.close()
+
+    return primed(generate())
+
+@admitted(PRIORITY_TRANSCRIPTION)
+async def stream_audio_completion_async(model_config, local_path, audio_format, audio_prompt_text, on_complete=None):
+    """stream_audio_completion 的异步版本 (ASGI 模式)，返回异步生成器"""
+    model_name = model_config.get('model', '未知模型')
+    await acquire_upstream_async(model_config)
+    stream_log = StreamLog('transcription', model_name, upload='stream')
+    body, content_length = build_audio_request_body(
+        model_config['model'], audio_format, audio_prompt_text, local_path
+    )
+
+    async def async_body():
+        # 每块只读取 read_chunk_bytes 字节，阻塞时间很短
+        for chunk in body:
+            yield chunk
+
+    url = model_config['base_url'].rstrip('/') + '/chat/completions'
+    client = get_async_http_client(model_config['base_url'])
+    request = client.build_request(
+        'POST', url,
+        content=async_body(),
+        headers=_build_headers(model_config, content_length)
+    )
+
+    try:
+        response = await client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        print(f"无法连接到 API ({model_name}): {e}")
+        raise ConnectionError(f"无法连接到 API: {e}")
+
+    if response.status_code >= 400:
+        try:
+            detail = (await response.aread()).decode('utf-8', errors='replace')[:500]
+        finally:
+            await response.aclose()
+        _raise_for_status(model_config, response.status_code, response.headers, detail)
+
+    async def generate():
+        parts = []
+        try:
+            yield # 由 aprimed() 消费
+            async for line in response.aiter_lines():
+                done, delta = _parse_sse_line(line)
+                if done:
+                    break
+                if delta:
+                    parts.append(delta)
+                    yield delta
+                    stream_log.chunk(delta)
+            stream_log.finish()
+            if on_complete:
+                on_complete(''.join(parts))
+        except Exception as e:
+            stream_log.finish(error=e)
+            yield f"Error in stream: {e}"
+        finally:
+            await response.aclose()
+
+    return await aprimed(generate())
\ No newline at end of file
@@ -0,0 +1,365 @@
+# backend/batch_ingest.py
+"""批量导入历史录音：去重、转录、分析并批量写入举报数据库
+
+对每个音频依次执行：计算内容 MD5 → 已在 AUDIO_FOLDER 中的不再复制 → 已有举报记录的跳过 (--reprocess 时重新处理)
+→ 转录 → 举报信息分析 → 写入缓冲区；缓冲区每满 batch_size 条在一个事务中写入数据库。
+concurrency 个音频同时处理，不同音频的转录和分析交错进行；分析使用批量优先级，不与交互请求争抢上游槽位。
+
+命令行 (在仓库根目录执行，目录会递归扫描):
+    python -m backend.batch_ingest /data/recordings --model gemini-2.5-flash
+    python -m backend.batch_ingest --file-list files.txt --model gemini-2.5-flash --concurrency 8
+
+也可以通过 POST /api/jobs 提交 kind=ingest 的后台任务 (对已上传的 object_names，或 allowed_roots 下的服务器目录)。
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from backend.config import get_config, get_model_list # 从 config 模块导入
+from backend.audio_service import open_transcription, run_report_analysis
+from backend.audio_store import get_audio_store, is_valid_object_name
+from backend.chunked_upload import save_stream_atomically
+from backend.transcode import schedule_transcode
+from backend.database_service import save_reports_bulk, find_referenced_object_names
+from backend.admission import PRIORITY_BATCH
+from backend.job_queue import job_kind, STREAM_ERROR_PREFIX
+from backend.metrics import registry, Counter
+
+# ai.json 中用于批量导入配置的保留键
+BATCH_INGEST_CONFIG_KEY = 'batch_ingest'
+
+DEFAULT_BATCH_INGEST_CONFIG = {
+    "concurrency": 4,                 # 同时处理的音频数
+    "batch_size": 50,                 # 每个数据库事务写入的举报数
+    "extensions": [".wav", ".mp3", ".ogg", ".aac", ".m4a", ".flac"], # 扫描目录时导入的格式
+    "allowed_roots": [],              # 后台任务允许读取的服务器目录，为空时只接受已上传的 object_names
+    "progress_interval_seconds": 2,   # 进度最多多久报告一次
+    "max_failures_reported": 100,     # 结果中最多列出的失败条目数
+}
+
+_HASH_BLOCK_BYTES = 1024 * 1024
+
+ingest_files = registry.register(Counter(
+    'batch_ingest_files_total', '批量导入处理的音频数', ('result',)
+))
+
+def get_batch_ingest_config():
+    """返回合并默认值后的批量导入配置"""
+    ingest_config = dict(DEFAULT_BATCH_INGEST_CONFIG)
+    ingest_config.update(get_config().get(BATCH_INGEST_CONFIG_KEY) or {})
+    return ingest_config
+
+def iter_audio_files(paths, extensions):
+    """展开文件和目录 (递归，跳过隐藏目录)，按路径顺序逐个产出，不一次性列出整个目录树"""
+    extensions = {extension.lower() for extension in extensions}
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in extensions:
+                    yield os.path.join(root, name)
+
+def file_md5(path):
+    hasher = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_BYTES), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+class IngestFailed(Exception):
+    """单个音频处理失败 (不影响其他音频)"""
+
+class BatchIngest:
+    """一次批量导入：有界并发地处理音频，结果按批写入数据库
+
+    run() 接受本地文件路径 (kind='path') 或已在存储中的 object_name (kind='object')。
+    on_progress(stats) 按 progress_interval_seconds 节流调用，结束时再调用一次。
+    """
+
+    def __init__(self, audio_folder, script_dir, model_name, concurrency=None, batch_size=None,
+                 reprocess=False, dry_run=False, on_progress=None, ingest_config=None):
+        self.ingest_config = ingest_config or get_batch_ingest_config()
+        self.audio_folder = audio_folder
+        self.script_dir = script_dir
+        self.model_name = model_name
+        self.concurrency = max(int(concurrency or self.ingest_config['concurrency']), 1)
+        self.batch_size = max(int(batch_size or self.ingest_config['batch_size']), 1)
+        self.reprocess = reprocess
+        self.dry_run = dry_run
+        self.on_progress = on_progress
+        self.store = get_audio_store(audio_folder)
+
+        self.counts = {
+            "queued": 0, "done": 0, "imported": 0, "would_import": 0, "duplicate_audio": 0, "duplicate_in_batch": 0, "already_reported": 0,
+            "transcribed": 0, "analyzed": 0, "saved": 0, "failed": 0,
+        }
+        self.bytes_imported = 0
+        self.failures = []
+        self._seen = set()       # 本次已处理的 object_name (同一内容的多个文件只处理一次)
+        self._pending = []       # 待写入数据库的举报
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._started = None
+        self._last_progress = 0.0
+
+    # --- 统计 ---
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.counts[key] += amount
+
+    def _fail(self, source, object_name, error):
+        ingest_files.inc(result='failed')
+        with self._lock:
+            self.counts['failed'] += 1
+            if len(self.failures) < self.ingest_config['max_failures_reported']:
+                self.failures.append({"source": source, "object_name": object_name, "error": str(error)})
+        print(f"批量导入失败 ({source}): {error}")
+
+    def stats(self):
+        """当前进度与吞吐量"""
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        with self._lock:
+            counts = dict(self.counts)
+            bytes_imported = self.bytes_imported
+        return dict(counts,
+            bytes_imported=bytes_imported,
+            elapsed_seconds=round(elapsed, 1),
+            files_per_minute=round(counts['done'] / elapsed * 60, 1) if elapsed else 0.0,
+            saved_per_minute=round(counts['saved'] / elapsed * 60, 1) if elapsed else 0.0,
+        )
+
+    def _report_progress(self, force=False):
+        if self.on_progress is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_progress < self.ingest_config['progress_interval_seconds']:
+                return
+            self._last_progress = now
+        self.on_progress(self.stats())
+
+    # --- 单个音频的流水线 ---
+
+    def _locate(self, source, kind):
+        """返回 (存储中的 object_name, 是否新导入)；本地文件按内容 MD5 去重，不在存储中时导入
+
+        dry_run 时不复制文件，"是否新导入" 表示实际运行时是否会导入。
+        """
+        if kind == 'object': # 已上传的音频
+            if not is_valid_object_name(source) or not self.store.exists(source):
+                raise IngestFailed(f"音频不存在: {source}")
+            return source, None
+
+        extension = os.path.splitext(source)[1].lower()
+        if extension not in self.ingest_config['extensions']:
+            raise IngestFailed(f"不支持的音频格式: {extension or '(无扩展名)'}")
+        object_name = file_md5(source) + extension
+        if self.store.exists(object_name):
+            return object_name, False
+        if not self.dry_run:
+            with open(source, 'rb') as f:
+                save_stream_atomically(self.audio_folder, f, object_name)
+        return object_name, True
+
+    def _transcribe(self, object_name):
+        stream = open_transcription(self.audio_folder, self.script_dir, object_name, self.model_name)
+        if isinstance(stream, tuple): # (错误字典, 状态码[, 响应头])
+            raise IngestFailed(f"转录失败 ({stream[1]}): {stream[0].get('error')}")
+        parts = []
+        for chunk in stream:
+            if chunk.startswith(STREAM_ERROR_PREFIX):
+                close = getattr(stream, 'close', None)
+                if close:
+                    close()
+                raise IngestFailed(f"转录失败: {chunk[len(STREAM_ERROR_PREFIX):].strip()}")
+            parts.append(chunk)
+        text = ''.join(parts)
+        if not text.strip():
+            raise IngestFailed("转录结果为空")
+        return text
+
+    def _process(self, source, kind):
+        object_name, imported = None, False
+        try:
+            object_name, imported = self._locate(source, kind)
+            with self._lock:
+                if object_name in self._seen:
+                    self.counts['duplicate_in_batch'] += 1
+                    ingest_files.inc(result='duplicate')
+                    imported = False # 由处理该内容的另一个线程在其转录结束后转码
+                    return
+                self._seen.add(object_name)
+                if imported and self.dry_run:
+                    self.counts['would_import'] += 1 # dry_run 没有复制文件，不计入 imported
+                elif imported is not None:
+                    self.counts['imported' if imported else 'duplicate_audio'] += 1
+                if imported and not self.dry_run:
+                    self.bytes_imported += os.path.getsize(source)
+            if not self.reprocess and find_referenced_object_names([object_name]):
+                self._count('already_reported')
+                ingest_files.inc(result='already_reported')
+                return
+            if self.dry_run:
+                return
+
+            transcription_text = self._transcribe(object_name)
+            self._count('transcribed')
+            result = run_report_analysis(self.script_dir, object_name, transcription_text, priority=PRIORITY_BATCH)
+            if result[1] >= 400:
+                raise IngestFailed(f"分析失败 ({result[1]}): {result[0].get('error')}")
+            self._count('analyzed')
+            report = {key: result[0].get(key, "") for key in ("school", "method", "phone", "time")}
+            report.update(object_name=object_name, transcription_text=transcription_text)
+            self._add_report(source, report)
+        except (IngestFailed, ValueError, OSError) as e:
+            self._fail(source, object_name, e)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self._fail(source, object_name, f"未知错误: {e}")
+        finally:
+            if imported and not self.dry_run:
+                # 转录结束后才转码：转码会替换原文件，转录过程中可能还要重新打开原文件
+                schedule_transcode(self.audio_folder, object_name)
+            self._count('done')
+            self._report_progress()
+
+    # --- 批量写入 ---
+
+    def _add_report(self, source, report):
+        with self._lock:
+            self._pending.append((source, report))
+            if len(self._pending) < self.batch_size:
+                return
+            batch, self._pending = self._pending, []
+        self._write(batch)
+
+    def _write(self, batch):
+        """在一个事务中写入一批举报，并标记音频被引用 (不再被存储淘汰)"""
+        if not batch:
+            return
+        with self._write_lock: # 批次依次提交，避免多个写事务互相等待锁
+            success, message = save_reports_bulk([report for _, report in batch])
+        if not success:
+            for source, report in batch:
+                self._fail(source, report['object_name'], message)
+            return
+        for _, report in batch:
+            self.store.mark_referenced(report['object_name'])
+        ingest_files.inc(len(batch), result='saved')
+        self._count('saved', len(batch))
+
+    def run(self, sources, kind='path'):
+        """处理全部音频，返回统计结果 (含失败列表)"""
+        if self._started is None:
+            self._started = time.monotonic()
+        slots = threading.BoundedSemaphore(self.concurrency * 2) # 限制已提交但未完成的任务数，目录很大时不会一次性排队
+
+        def process(source):
+            try:
+                self._process(source, kind)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='ingest') as executor:
+            for source in sources:
+                slots.acquire()
+                self._count('queued')
+                executor.submit(process, source)
+        with self._lock:
+            batch, self._pending = self._pending, []
+        self._write(batch)
+        self._report_progress(force=True)
+        return dict(self.stats(), failures=list(self.failures))
+
+# --- 后台任务 ---
+
+def _is_allowed_path(path, allowed_roots):
+    real_path = os.path.realpath(path)
+    for root in allowed_roots:
+        root = os.path.realpath(root)
+        if real_path == root or real_path.startswith(root + os.sep):
+            return True
+    return False
+
+def _validate_ingest(payload):
+    if payload.get('model') not in get_model_list():
+        return f"不支持的模型: {payload.get('model')}"
+    object_names, paths = payload.get('object_names'), payload.get('paths')
+    if not object_names and not paths:
+        return "需要 object_names (已上传的音频) 或 paths (服务器目录或文件)"
+    if object_names and (not isinstance(object_names, list) or not all(is_valid_object_name(n) for n in object_names)):
+        return "object_names 必须为合法文件名的列表"
+    if paths:
+        allowed_roots = get_batch_ingest_config()['allowed_roots']
+        if not isinstance(paths, list) or not all(isinstance(p, str) and _is_allowed_path(p, allowed_roots) for p in paths):
+            return "paths 必须位于配置的 batch_ingest.allowed_roots 之下"
+    return None
+
+@job_kind('ingest', PRIORITY_BATCH, ('object_names', 'paths', 'model', 'reprocess'), _validate_ingest)
+def run_ingest_job(job):
+    """批量导入任务；进度为 BatchIngest.stats()，中断后重新执行时已写入的举报会被跳过"""
+    payload = job.payload
+    ingest = BatchIngest(job.audio_folder, job.script_dir, payload['model'],
+                         reprocess=bool(payload.get('reprocess')),
+                         on_progress=lambda stats: job.progress(stats, force=True))
+    summary = ingest.run(payload.get('object_names') or [], kind='object')
+    if payload.get('paths'):
+        extensions = ingest.ingest_config['extensions']
+        summary = ingest.run(iter_audio_files(payload['paths'], extensions), kind='path')
+    return summary, 200
+
+# --- 命令行 ---
+
+def _print_progress(stats):
+    print(
+        f"[{stats['elapsed_seconds']:>7.1f}s] 已完成 {stats['done']}/{stats['queued']}  "
+        f"保存 {stats['saved']}  已有举报 {stats['already_reported']}  失败 {stats['failed']}  "
+        f"新导入 {stats['imported']} ({stats['bytes_imported'] / 1024 / 1024:.1f} MB)  "
+        + (f"将导入(dry-run) {stats['would_import']}  " if stats['would_import'] else "")
+        + f"{stats['files_per_minute']:.1f} 个/分钟",
+        file=sys.stderr, flush=True
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', help='音频文件或目录 (目录递归扫描)')
+    parser.add_argument('--file-list', default=None, help='每行一个文件路径的列表文件，- 表示标准输入')
+    parser.add_argument('--model', required=True, help='转录使用的模型名称')
+    parser.add_argument('--audio-folder', default=None, help='音频根目录，默认 backend/audio_files')
+    parser.add_argument('--concurrency', type=int, default=None, help='同时处理的音频数，默认使用配置')
+    parser.add_argument('--batch-size', type=int, default=None, help='每个数据库事务写入的举报数，默认使用配置')
+    parser.add_argument('--reprocess', action='store_true', help='已有举报记录的音频也重新转录和分析')
+    parser.add_argument('--dry-run', action='store_true', help='只计算哈希并统计去重结果，不导入、不调用模型')
+    args = parser.parse_args()
+
+    if args.model not in get_model_list():
+        parser.error(f"不支持的模型: {args.model}")
+    paths = list(args.paths)
+    if args.file_list:
+        with (sys.stdin if args.file_list == '-' else open(args.file_list, encoding='utf-8')) as f:
+            paths.extend(line.strip() for line in f if line.strip())
+    if not paths:
+        parser.error("需要至少一个文件或目录 (或 --file-list)")
+
+    audio_folder = args.audio_folder
+    if audio_folder is None:
+        from backend.app_setup import AUDIO_FOLDER, script_dir
+        audio_folder = AUDIO_FOLDER
+    else:
+        from backend.app_setup import script_dir
+    ingest = BatchIngest(audio_folder, script_dir, args.model, args.concurrency, args.batch_size,
+                         reprocess=args.reprocess, dry_run=args.dry_run, on_progress=_print_progress)
+    summary = ingest.run(iter_audio_files(paths, ingest.ingest_config['extensions']))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# backend/bench/base64_memory.py
+"""对比整块 base64 编码与流式编码上传请求体时的峰值内存 (RSS)
+
+用法 (在仓库根目录执行):
+    python -m backend.bench.base64_memory --sizes 16 64 256
+
+每个 (模式, 文件大小) 组合在独立子进程中运行，避免相互影响峰值 RSS；
+结果以 JSON 输出，便于在不同提交之间比较。
+"""
+import os
+import sys
+import json
+import base64
+import argparse
+import resource
+import tempfile
+import subprocess
+
+def _peak_rss_mb():
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _run_buffered(path):
+    """旧路径：整文件读入 -> base64 -> JSON 请求体"""
+    with open(path, 'rb') as f:
+        content = f.read()
+    data = base64.b64encode(content).decode('utf-8')
+    body = json.dumps({
+        "model": "bench",
+        "messages": [{"role": "user", "content": [
+            {"type": "input_audio", "input_audio": {"data": data, "format": "wav"}},
+            {"type": "text", "text": "bench"}
+        ]}],
+        "stream": True
+    }).encode('utf-8')
+    return len(body)
+
+def _run_streaming(path):
+    """新路径：逐块编码，模拟发送时逐块消费请求体"""
+    from backend.audio_upload import build_audio_request_body
+    body, content_length = build_audio_request_body("bench", "wav", "bench", path)
+    sent = sum(len(chunk) for chunk in body)
+    assert sent == content_length, (sent, content_length)
+    return sent
+
+def _child(mode, path):
+    baseline = _peak_rss_mb()
+    body_bytes = _run_streaming(path) if mode == 'streaming' else _run_buffered(path)
+    print(json.dumps({
+        "mode": mode,
+        "file_mb": round(os.path.getsize(path) / (1024 * 1024), 1),
+        "body_bytes": body_bytes,
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1)
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 64, 256], help='测试文件大小 (MB)')
+    parser.add_argument('--modes', nargs='+', default=['buffered', 'streaming'], choices=['buffered', 'streaming'])
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(*args.child)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size_mb in args.sizes:
+            path = os.path.join(tmp_dir, f'bench_{size_mb}mb.wav')
+            with open(path, 'wb') as f:
+                for _ in range(size_mb):
+                    f.write(os.urandom(1024 * 1024))
+            for mode in args.modes:
+                output = subprocess.run(
+                    [sys.executable, '-m', 'backend.bench.base64_memory', '--child', mode, path],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                # 子进程导入 backend 模块时可能打印配置提示，只取最后一行 JSON
+                result = json.loads(output.strip().splitlines()[-1])
+                results.append(result)
+                print(f"{mode:>9}  {result['file_mb']:>7} MB  峰值 RSS {result['peak_rss_mb']:>8} MB", file=sys.stderr)
+            os.remove(path)
+
+    print(json.dumps({"benchmark": "base64_memory", "results": results}, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
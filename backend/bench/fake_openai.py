@@ -0,0 +1,174 @@
+# backend/bench/fake_openai.py
+"""本地 OpenAI 兼容的假上游，供压测使用 (不访问真实模型，结果可复现)
+
+用法 (在仓库根目录执行):
+    python -m backend.bench.fake_openai --port 8001 --latency-ms 300 --tokens 200 --token-interval-ms 10
+
+- POST .../chat/completions：stream=true 时按固定间隔逐 token 输出 SSE，
+  否则等待 latency + tokens * interval 后一次性返回举报分析格式的 JSON 内容
+- GET .../models：返回单个假模型
+- --error-rate 按比例返回 503，用于观察重试与熔断的开销
+
+启动后在 stdout 输出一行 JSON {"event": "listening", "port": ...}，--port 0 时由系统分配端口。
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_MODEL = "bench-model"
+
+# 非流式响应的内容：满足 /api/analyze-report 期望的字段
+ANALYSIS_CONTENT = json.dumps({"school": "压测学校", "method": "电话", "phone": "00000000000", "time": "2024-01-01 00:00"}, ensure_ascii=False)
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    # HTTP/1.0：流式响应不需要 chunked 编码，写完后关闭连接即结束
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, format, *args):
+        pass # 压测时逐请求输出访问日志会成为瓶颈
+
+    def _read_body(self):
+        """读取请求体 (支持 Content-Length 与 chunked)，音频上传体只计数不保留"""
+        length = self.headers.get('Content-Length')
+        if length is not None:
+            remaining = int(length)
+            chunks = []
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                chunks.append(chunk)
+            return b''.join(chunks)
+        if 'chunked' in (self.headers.get('Transfer-Encoding') or '').lower():
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        return b''
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {"object": "list", "data": [{"id": FAKE_MODEL, "object": "model", "owned_by": "bench"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        options = self.server.options
+        raw = self._read_body()
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        try:
+            request = json.loads(raw or b'{}')
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+        self.server.count_request()
+
+        if options.error_rate and self.server.random() < options.error_rate:
+            time.sleep(options.latency_ms / 1000)
+            self._send_json(503, {"error": {"message": "fake upstream overloaded", "type": "server_error"}})
+            return
+
+        model = request.get('model') or FAKE_MODEL
+        time.sleep(options.latency_ms / 1000)
+        if request.get('stream'):
+            self._stream(model, options)
+        else:
+            time.sleep(options.tokens * options.token_interval_ms / 1000)
+            self._send_json(200, {
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": ANALYSIS_CONTENT}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(raw) // 4, "completion_tokens": options.tokens, "total_tokens": len(raw) // 4 + options.tokens}
+            })
+
+    def _stream(self, model, options):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        created = int(time.time())
+
+        def frame(delta, finish_reason=None):
+            chunk = {
+                "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8')
+
+        try:
+            self.wfile.write(frame({"role": "assistant", "content": ""}))
+            for i in range(options.tokens):
+                if i and options.token_interval_ms:
+                    time.sleep(options.token_interval_ms / 1000)
+                self.wfile.write(frame({"content": options.token_text}))
+                self.wfile.flush()
+            self.wfile.write(frame({}, "stop"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # 客户端提前断开
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, options):
+        super().__init__(address, FakeOpenAIHandler)
+        self.options = options
+        self.requests_served = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(options.seed)
+
+    def count_request(self):
+        with self._lock:
+            self.requests_served += 1
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='监听端口，0 表示自动分配')
+    parser.add_argument('--latency-ms', type=float, default=200, help='收到请求到输出第一个 token 的延迟')
+    parser.add_argument('--tokens', type=int, default=100, help='每次响应输出的 token 数')
+    parser.add_argument('--token-interval-ms', type=float, default=10, help='相邻 token 的间隔')
+    parser.add_argument('--token-text', default='测试 ', help='每个 token 的文本')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 503 的比例 (0-1)')
+    parser.add_argument('--seed', type=int, default=0, help='错误注入的随机种子')
+    return parser
+
+def main():
+    options = build_parser().parse_args()
+    server = FakeOpenAIServer((options.host, options.port), options)
+    print(json.dumps({"event": "listening", "host": options.host, "port": server.server_address[1]}), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"假上游共处理 {server.requests_served} 个请求", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+# backend/bench/load_test.py
+"""后端接口压测：在隔离的临时目录中启动应用，上游指向本地假模型服务，按固定并发发送请求
+
+用法 (在仓库根目录执行):
+    python -m backend.bench.load_test --concurrency 1 8 32 --requests 200
+    python -m backend.bench.load_test --endpoints query_stream transcribe --server asgi --tokens 400
+
+- 把 backend 目录 (不含数据库、音频、api.txt 等运行数据) 复制到临时目录，写入指向假上游的
+  ai.json 和 api.txt，因此压测不会读写仓库中的数据，也不会命中上一次运行留下的缓存
+- 转录和分析请求默认每次使用不同的音频/文本，测的是未命中缓存的完整路径；--warm-cache 时复用同一份输入
+- 应用的 Flask-Limiter 按 IP 的限流在压测进程中关闭，上游令牌桶、准入控制等其余配置保持默认
+- 每个 (接口, 并发数) 组合输出请求数、错误数、延迟 p50/p95/p99、首字节时间 (流式接口即首 token 时间)、
+  吞吐量和应用进程在该组合期间的峰值 RSS，结果以 JSON 输出到 stdout，便于在不同提交之间比较
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import struct
+import random
+import socket
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+ENDPOINTS = ['query_stream', 'transcribe', 'analyze_report', 'reports', 'audio_file']
+
+BENCH_MODEL = 'bench-model'
+# 转录和分析走 api.txt 的 key 池 (get_gemini_config)，模型名只用于准入控制和日志
+ANALYSIS_MODEL = 'gemini-2.5-flash-preview-04-17'
+
+# 不复制到临时目录的运行数据
+_IGNORED_FILES = shutil.ignore_patterns(
+    '__pycache__', 'audio_files', '*.db', '*.db-wal', '*.db-shm', 'api.txt', 'key_usage.json', 'ai.json'
+)
+
+def _peak_rss_mb():
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _proc_status_mb(pid, field):
+    """读取 /proc/<pid>/status 中的 VmRSS / VmHWM (MB)，非 Linux 时返回 None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def _reset_peak_rss(pid):
+    """清零子进程的 VmHWM，使每个压测组合单独统计峰值 (Linux 4.0+)"""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _percentile(sorted_values, p):
+    """最近秩百分位数"""
+    if not sorted_values:
+        return None
+    index = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+def _summarize(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "p50": round(_percentile(values, 50) * 1000, 1),
+        "p95": round(_percentile(values, 95) * 1000, 1),
+        "p99": round(_percentile(values, 99) * 1000, 1),
+        "mean": round(sum(values) / len(values) * 1000, 1),
+        "max": round(values[-1] * 1000, 1),
+    }
+
+def _write_wav(path, seconds, seed):
+    """写入 16kHz 单声道 16bit 的噪声 WAV，不同 seed 内容不同 (避免命中转录缓存)"""
+    rng = random.Random(seed)
+    frames = 16000 * seconds
+    data = rng.randbytes(frames * 2)
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', 36 + len(data)) + b'WAVE')
+        f.write(b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, 16000, 32000, 2, 16))
+        f.write(b'data' + struct.pack('<I', len(data)) + data)
+
+# --- 子进程：假上游与被测应用 ---
+
+def _wait_for_line(process, name, timeout=30):
+    """读取子进程 stdout 的第一行 JSON (启动完成通知)"""
+    result = {}
+
+    def read():
+        for line in process.stdout:
+            line = line.strip()
+            if line.startswith('{'):
+                result.update(json.loads(line))
+                return
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    reader.join(timeout)
+    if not result:
+        process.kill()
+        raise RuntimeError(f"{name} 未能在 {timeout} 秒内启动")
+    return result
+
+def _start_fake_upstream(args):
+    command = [
+        sys.executable, '-m', 'backend.bench.fake_openai', '--port', '0',
+        '--latency-ms', str(args.latency_ms), '--tokens', str(args.tokens),
+        '--token-interval-ms', str(args.token_interval_ms), '--error-rate', str(args.error_rate)
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=os.getcwd())
+    info = _wait_for_line(process, '假上游')
+    return process, f"http://127.0.0.1:{info['port']}/v1/"
+
+def _prepare_workdir(work_dir, upstream_url):
+    """在临时目录中准备一份独立的 backend：代码、提示词、指向假上游的 ai.json 和 api.txt"""
+    source = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    backend_dir = os.path.join(work_dir, 'backend')
+    shutil.copytree(source, backend_dir, ignore=_IGNORED_FILES)
+    with open(os.path.join(backend_dir, 'ai.json'), 'w', encoding='utf-8') as f:
+        json.dump({BENCH_MODEL: {"api_key": "bench-key", "base_url": upstream_url, "model": BENCH_MODEL}}, f, indent=2)
+    with open(os.path.join(backend_dir, 'api.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(f'bench-key-{i}' for i in range(4)) + '\n')
+    os.makedirs(os.path.join(backend_dir, 'audio_files'), exist_ok=True)
+    return backend_dir
+
+def _serve(port, upstream_url, server):
+    """在临时目录中运行被测应用 (由 --serve 调用)"""
+    import backend.config
+    backend.config.GEMINI_BASE_URL = upstream_url # 转录与分析的上游也指向假服务
+    from backend.app import app
+    app.limiter.enabled = False # 按 IP 的限流会让单机压测很快全部变成 429
+    print(json.dumps({"event": "listening", "port": port, "pid": os.getpid()}), flush=True)
+    if server == 'asgi':
+        import uvicorn
+        from backend.asgi_app import app as asgi_app
+        uvicorn.run(asgi_app, host='127.0.0.1', port=port, log_level='warning')
+    else:
+        app.run(host='127.0.0.1', port=port, threaded=True, debug=False)
+
+def _start_app(work_dir, upstream_url, server, log_file):
+    port = _free_port()
+    command = [sys.executable, '-u', '-m', 'backend.bench.load_test', '--serve', str(port), upstream_url, server]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=log_file, text=True, cwd=work_dir)
+    _wait_for_line(process, '被测应用')
+    # 启动通知之后的输出 (请求日志) 转存到日志文件，避免管道写满阻塞应用
+    threading.Thread(target=lambda: shutil.copyfileobj(process.stdout, log_file), daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{base_url}/fetchModels", timeout=2)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("被测应用未能在 30 秒内开始监听")
+
+def _stop(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+# --- 请求场景 ---
+
+class Scenario:
+    """一个被压测的接口：build(index) 返回第 index 个请求的 requests 关键字参数 (json/params/headers)"""
+
+    def __init__(self, name, method, path, build=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.build = build or (lambda index: {})
+
+def _build_scenarios(args, audio_objects):
+    def pick_object(index):
+        return audio_objects[0] if args.warm_cache else audio_objects[index % len(audio_objects)]
+
+    query_headers = {"Accept": "text/event-stream"} if args.sse else {}
+    return {
+        'query_stream': Scenario('query_stream', 'POST', '/query_stream', lambda i: {
+            "json": {"model": BENCH_MODEL, "prompt": "你是压测助手", "msg": f"第 {i} 次压测请求"},
+            "headers": query_headers
+        }),
+        'transcribe': Scenario('transcribe', 'POST', '/api/transcribe-audio', lambda i: {
+            "json": {"object_name": pick_object(i), "model": ANALYSIS_MODEL}
+        }),
+        'analyze_report': Scenario('analyze_report', 'POST', '/api/analyze-report', lambda i: {
+            "json": {
+                "object_name": f"bench-{0 if args.warm_cache else i}.wav",
+                "transcription_text": f"压测转录文本 {0 if args.warm_cache else i}：学校名称，电话号码，时间。"
+            }
+        }),
+        'reports': Scenario('reports', 'GET', '/api/reports', lambda i: {
+            "params": {"limit": args.page_size}
+        }),
+        'audio_file': Scenario('audio_file', 'GET', '/api/get-audio-file', lambda i: {
+            "params": {"object_name": pick_object(i)}
+        }),
+    }
+
+def _request_once(session, base_url, scenario, index):
+    """发送一次请求并完整读取响应体，返回 (状态码或异常名, 总耗时, 首字节耗时, 响应字节数)"""
+    start = time.perf_counter()
+    first_byte = None
+    size = 0
+    try:
+        with session.request(scenario.method, base_url + scenario.path, stream=True, timeout=300,
+                             **scenario.build(index)) as response:
+            for chunk in response.iter_content(chunk_size=None):
+                if chunk and first_byte is None:
+                    first_byte = time.perf_counter() - start
+                size += len(chunk)
+            status = response.status_code
+    except requests.RequestException as e:
+        status = type(e).__name__
+    return status, time.perf_counter() - start, first_byte, size
+
+def _run_scenario(base_url, scenario, concurrency, total, offset, app_pid):
+    local = threading.local()
+
+    def worker(index):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        return _request_once(session, base_url, scenario, offset + index)
+
+    peak_is_scoped = _reset_peak_rss(app_pid)
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(worker, range(total)))
+    wall = time.perf_counter() - wall_start
+
+    statuses = {}
+    for status, _, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [s for s in samples if isinstance(s[0], int) and s[0] < 400]
+    return {
+        "endpoint": scenario.name,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(ok),
+        "errors": total - len(ok),
+        "status_counts": statuses,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 2) if wall > 0 else None,
+        "response_mb_per_second": round(sum(s[3] for s in ok) / wall / (1024 * 1024), 2) if wall > 0 else None,
+        "latency_ms": _summarize([s[1] for s in ok]),
+        "ttfb_ms": _summarize([s[2] for s in ok if s[2] is not None]),
+        "app_rss_mb": _proc_status_mb(app_pid, 'VmRSS'),
+        # 清零失败 (非 Linux 或无权限) 时为应用启动以来的峰值
+        "app_peak_rss_mb": _proc_status_mb(app_pid, 'VmHWM'),
+        "app_peak_rss_scope": "scenario" if peak_is_scoped else "process",
+    }
+
+def _seed_reports(base_url, count):
+    """通过提交接口写入举报记录，供 /api/reports 分页查询"""
+    session = requests.Session()
+    for i in range(count):
+        session.post(f"{base_url}/api/submit-final-report", json={
+            "object_name": f"seed-{i}.wav", "school": f"学校{i % 50}", "method": "电话",
+            "phone": f"1380000{i:04d}", "time": "2024-01-01 00:00", "transcription_text": f"压测种子记录 {i}"
+        }, timeout=30).raise_for_status()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints', nargs='+', default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help='并发数 (可多个)')
+    parser.add_argument('--requests', type=int, default=100, help='每个 (接口, 并发数) 组合的请求数')
+    parser.add_argument('--server', default='wsgi', choices=['wsgi', 'asgi'], help='wsgi: Flask threaded；asgi: uvicorn + asgi_app')
+    parser.add_argument('--sse', action='store_true', help='/query_stream 请求 SSE 格式')
+    parser.add_argument('--warm-cache', action='store_true', help='转录/分析复用同一份输入 (测缓存命中路径)')
+    parser.add_argument('--audio-seconds', type=int, default=5, help='生成的 WAV 时长')
+    parser.add_argument('--audio-files', type=int, default=None, help='生成的 WAV 数量，默认与最大请求数相同')
+    parser.add_argument('--seed-reports', type=int, default=500, help='压测 /api/reports 前写入的记录数')
+    parser.add_argument('--page-size', type=int, default=50, help='/api/reports 每页条数')
+    # 假上游参数
+    parser.add_argument('--latency-ms', type=float, default=200, help='假上游首 token 延迟')
+    parser.add_argument('--tokens', type=int, default=100, help='假上游每次输出的 token 数')
+    parser.add_argument('--token-interval-ms', type=float, default=10, help='假上游 token 间隔')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='假上游返回 503 的比例')
+    parser.add_argument('--keep-workdir', action='store_true', help='保留临时目录 (含应用日志) 便于排查')
+    parser.add_argument('--serve', nargs=3, metavar=('PORT', 'UPSTREAM', 'SERVER'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        _serve(int(args.serve[0]), args.serve[1], args.serve[2])
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='backend-bench-')
+    upstream, app_process, log_file = None, None, None
+    results = []
+    try:
+        upstream, upstream_url = _start_fake_upstream(args)
+        backend_dir = _prepare_workdir(work_dir, upstream_url)
+
+        # 每个请求使用不同的音频文件，保证转录不命中缓存 (文件名即缓存键)
+        audio_count = 1 if args.warm_cache else (args.audio_files or args.requests * len(args.concurrency))
+        audio_objects = [f"bench-{i:05d}.wav" for i in range(audio_count)]
+        for i, object_name in enumerate(audio_objects):
+            _write_wav(os.path.join(backend_dir, 'audio_files', object_name), args.audio_seconds, i)
+
+        log_file = open(os.path.join(work_dir, 'app.log'), 'w', encoding='utf-8')
+        app_process, base_url = _start_app(work_dir, upstream_url, args.server, log_file)
+        app_pid = app_process.pid
+        startup_rss = _proc_status_mb(app_pid, 'VmRSS')
+        if 'reports' in args.endpoints and args.seed_reports:
+            _seed_reports(base_url, args.seed_reports)
+
+        scenarios = _build_scenarios(args, audio_objects)
+        for name in args.endpoints:
+            offset = 0
+            for concurrency in args.concurrency:
+                result = _run_scenario(base_url, scenarios[name], concurrency, args.requests, offset, app_pid)
+                offset += args.requests
+                results.append(result)
+                latency = result['latency_ms'] or {}
+                ttfb = result['ttfb_ms'] or {}
+                print(
+                    f"{name:>14}  c={concurrency:<4} ok={result['ok']:<5} err={result['errors']:<4} "
+                    f"{result['throughput_rps']} req/s  p50={latency.get('p50')}ms p95={latency.get('p95')}ms "
+                    f"p99={latency.get('p99')}ms  ttfb p50={ttfb.get('p50')}ms  峰值 RSS {result['app_peak_rss_mb']} MB",
+                    file=sys.stderr
+                )
+        # 各组合的峰值 RSS 分别统计，整体峰值取其中最大值
+        app_peak_rss = max([r['app_peak_rss_mb'] for r in results if r['app_peak_rss_mb'] is not None], default=None)
+    finally:
+        for process in (app_process, upstream):
+            if process is not None:
+                _stop(process)
+        if log_file is not None:
+            log_file.close()
+        if args.keep_workdir:
+            print(f"临时目录已保留: {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps({
+        "benchmark": "load_test",
+        "server": args.server,
+        "upstream": {
+            "latency_ms": args.latency_ms, "tokens": args.tokens,
+            "token_interval_ms": args.token_interval_ms, "error_rate": args.error_rate
+        },
+        "warm_cache": args.warm_cache,
+        "app_startup_rss_mb": startup_rss,
+        "app_peak_rss_mb": app_peak_rss,
+        "driver_peak_rss_mb": round(_peak_rss_mb(), 1),
+        "results": results
+    }, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
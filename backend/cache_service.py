@@ -0,0 +1,316 @@
+# backend/cache_service.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from backend.config import get_config, get_script_dir # 从 config 模块导入
+from backend.metrics import registry
+
+CACHE_DATABASE_FILE = os.path.join(get_script_dir(), 'cache.db')
+
+# ai.json 中用于缓存配置的保留键
+CACHE_CONFIG_KEY = 'cache'
+
+DEFAULT_CACHE_CONFIG = {
+    "transcription_max_bytes": 256 * 1024 * 1024, # 转录缓存总大小上限
+    "replay_chunk_size": 4096,                    # 命中时按多少字符一块回放
+    "report_memory_entries": 512,                 # 分析结果内存 LRU 条目上限
+    "report_ttl_seconds": 7 * 24 * 3600,          # 分析结果有效期 (秒)
+}
+
+def get_cache_config():
+    """返回合并默认值后的缓存配置"""
+    cache_config = dict(DEFAULT_CACHE_CONFIG)
+    cache_config.update(get_config().get(CACHE_CONFIG_KEY) or {})
+    return cache_config
+
+def text_fingerprint(text):
+    """返回文本内容的 sha256 指纹"""
+    return hashlib.sha256((text or "").encode('utf-8')).hexdigest()
+
+_local = threading.local()
+
+def _get_connection():
+    """获取当前线程的缓存数据库连接"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_DATABASE_FILE, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+    return conn
+
+def init_cache_db():
+    """初始化缓存数据库，创建表（如果不存在）"""
+    conn = _get_connection()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transcription_cache (
+            cache_key TEXT PRIMARY KEY,
+            object_name TEXT,
+            model TEXT,
+            prompt_hash TEXT,
+            transcript TEXT,
+            size INTEGER,
+            created_at REAL,
+            last_access REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transcription_cache_access ON transcription_cache (last_access)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS report_cache (
+            cache_key TEXT PRIMARY KEY,
+            template_fingerprint TEXT,
+            model TEXT,
+            result TEXT,
+            created_at REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_report_cache_created ON report_cache (created_at)')
+    conn.commit()
+
+class TranscriptionCache:
+    """按 (音频内容哈希文件名, 模型, 提示词哈希) 缓存转录结果
+
+    object_name 本身就是音频内容的哈希，因此同一段音频在同一模型和提示词下
+    只需调用一次上游模型，之后直接从 SQLite 回放。
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(object_name, model_name, prompt_hash):
+        return hashlib.sha256(f"{object_name}\0{model_name}\0{prompt_hash}".encode('utf-8')).hexdigest()
+
+    def get(self, object_name, model_name, prompt_hash):
+        """查询缓存，命中返回转录文本，否则返回 None"""
+        cache_key = self.make_key(object_name, model_name, prompt_hash)
+        try:
+            conn = _get_connection()
+            row = conn.execute(
+                'SELECT transcript FROM transcription_cache WHERE cache_key = ?', (cache_key,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    'UPDATE transcription_cache SET last_access = ? WHERE cache_key = ?',
+                    (time.time(), cache_key)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"读取转录缓存失败: {e}")
+            row = None
+
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row[0] if row is not None else None
+
+    def put(self, object_name, model_name, prompt_hash, transcript):
+        """写入转录结果，并按 LRU 淘汰超出容量的条目"""
+        if not transcript:
+            return
+        cache_key = self.make_key(object_name, model_name, prompt_hash)
+        now = time.time()
+        try:
+            conn = _get_connection()
+            conn.execute('''
+                INSERT OR REPLACE INTO transcription_cache
+                    (cache_key, object_name, model, prompt_hash, transcript, size, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (cache_key, object_name, model_name, prompt_hash, transcript,
+                  len(transcript.encode('utf-8')), now, now))
+            conn.commit()
+            self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"写入转录缓存失败: {e}")
+
+    def _evict(self, conn):
+        """按最近访问时间淘汰，直到总大小不超过上限"""
+        max_bytes = get_cache_config()['transcription_max_bytes']
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM transcription_cache').fetchone()[0]
+        if total <= max_bytes:
+            return
+        removed = 0
+        for cache_key, size in conn.execute(
+                'SELECT cache_key, size FROM transcription_cache ORDER BY last_access ASC').fetchall():
+            if total <= max_bytes:
+                break
+            conn.execute('DELETE FROM transcription_cache WHERE cache_key = ?', (cache_key,))
+            total -= size
+            removed += 1
+        conn.commit()
+        print(f"转录缓存超出容量，已淘汰 {removed} 条")
+
+    def replay(self, transcript):
+        """以流的形式回放缓存的转录文本"""
+        chunk_size = get_cache_config()['replay_chunk_size']
+        for i in range(0, len(transcript), chunk_size):
+            yield transcript[i:i + chunk_size]
+
+    def stats(self):
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        try:
+            entries, size = _get_connection().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM transcription_cache'
+            ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "entries": entries,
+            "size_bytes": size
+        }
+
+class ReportCache:
+    """举报信息分析结果缓存：内存 LRU + SQLite 持久层，按 TTL 过期
+
+    键为 (模型, 格式化后提示词) 的哈希；每条记录同时保存提示词模板的指纹，
+    report_prompt.txt 变化后旧指纹的条目会被整体清除。
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict() # cache_key -> (created_at, result)
+        self._lock = threading.Lock()
+        self._template_fingerprint = None
+
+    @staticmethod
+    def make_key(model_name, prompt):
+        return hashlib.sha256(f"{model_name}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def _check_template(self, template_fingerprint):
+        """模板指纹变化时清除所有旧模板生成的条目"""
+        with self._lock:
+            if template_fingerprint == self._template_fingerprint:
+                return
+            self._memory.clear()
+            self._template_fingerprint = template_fingerprint
+        try:
+            conn = _get_connection()
+            removed = conn.execute(
+                'DELETE FROM report_cache WHERE template_fingerprint != ?', (template_fingerprint,)
+            ).rowcount
+            conn.commit()
+            if removed:
+                print(f"举报提示模板已变化，清除 {removed} 条分析缓存")
+        except sqlite3.Error as e:
+            print(f"清理分析缓存失败: {e}")
+
+    def _remember(self, cache_key, created_at, result):
+        """写入内存 LRU (调用方需持有 _lock)"""
+        self._memory[cache_key] = (created_at, result)
+        self._memory.move_to_end(cache_key)
+        max_entries = get_cache_config()['report_memory_entries']
+        while len(self._memory) > max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, model_name, prompt, template_fingerprint):
+        """查询缓存，命中返回分析结果字典的副本，否则返回 None"""
+        self._check_template(template_fingerprint)
+        cache_key = self.make_key(model_name, prompt)
+        expire_before = time.time() - get_cache_config()['report_ttl_seconds']
+        result = None
+
+        with self._lock:
+            entry = self._memory.get(cache_key)
+            if entry is not None:
+                if entry[0] >= expire_before:
+                    self._memory.move_to_end(cache_key)
+                    result = entry[1]
+                else:
+                    del self._memory[cache_key]
+
+        if result is None:
+            try:
+                row = _get_connection().execute(
+                    'SELECT created_at, result FROM report_cache WHERE cache_key = ? AND created_at >= ?',
+                    (cache_key, expire_before)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"读取分析缓存失败: {e}")
+                row = None
+            if row is not None:
+                result = json.loads(row[1])
+                with self._lock:
+                    self._remember(cache_key, row[0], result)
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return dict(result) if result is not None else None
+
+    def put(self, model_name, prompt, template_fingerprint, result):
+        """写入分析结果，并清除已过期的持久化条目"""
+        cache_key = self.make_key(model_name, prompt)
+        now = time.time()
+        with self._lock:
+            self._remember(cache_key, now, dict(result))
+        try:
+            conn = _get_connection()
+            conn.execute('''
+                INSERT OR REPLACE INTO report_cache (cache_key, template_fingerprint, model, result, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (cache_key, template_fingerprint, model_name, json.dumps(result, ensure_ascii=False), now))
+            conn.execute(
+                'DELETE FROM report_cache WHERE created_at < ?',
+                (now - get_cache_config()['report_ttl_seconds'],)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"写入分析缓存失败: {e}")
+
+    def stats(self):
+        with self._lock:
+            hits, misses, memory_entries = self.hits, self.misses, len(self._memory)
+        try:
+            entries = _get_connection().execute('SELECT COUNT(*) FROM report_cache').fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "memory_entries": memory_entries,
+            "entries": entries
+        }
+
+transcription_cache = TranscriptionCache()
+report_cache = ReportCache()
+
+def get_cache_stats():
+    """返回各缓存的命中统计"""
+    return {
+        "transcription": transcription_cache.stats(),
+        "report": report_cache.stats()
+    }
+
+@registry.register_collector
+def _collect_cache_metrics():
+    """导出缓存命中指标 (/metrics)"""
+    caches = [("transcription", transcription_cache), ("report", report_cache)]
+    counts = [(name, cache.hits, cache.misses) for name, cache in caches]
+    return [
+        ("cache_hits_total", "counter", "缓存命中次数", [({"cache": name}, hits) for name, hits, _ in counts]),
+        ("cache_misses_total", "counter", "缓存未命中次数", [({"cache": name}, misses) for name, _, misses in counts]),
+        ("cache_hit_ratio", "gauge", "缓存命中率", [
+            ({"cache": name}, round(hits / (hits + misses), 4) if hits + misses else 0.0) for name, hits, misses in counts
+        ]),
+    ]
+
+# 应用启动时初始化缓存数据库
+init_cache_db()
@@ -0,0 +1,317 @@
+# backend/chunked_upload.py
+"""可断点续传的分块音频上传
+
+协议:
+    POST /api/uploads                       初始化 {file_hash, size, content_type}，返回 upload_id 和已接收字节数
+    PUT  /api/uploads/<upload_id>?offset=N  请求体为原始字节，offset 必须等于已接收字节数
+    GET  /api/uploads/<upload_id>           查询已接收字节数 (网络中断后据此续传)
+    POST /api/uploads/<upload_id>/complete  服务端校验大小和哈希后原子地移入音频存储 (audio_store)
+
+分块按固定大小的块从请求流写入临时文件并增量计算 MD5，内存占用与文件大小无关。
+临时文件放在 AUDIO_FOLDER/.uploads 下 (与音频存储同一文件系统，移入分片目录为原子操作)，
+会话状态写在同名 .json 中，服务重启后仍可续传；进程内的增量哈希丢失时从临时文件补算。
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import secrets
+import threading
+from backend.config import get_config # 从 config 模块导入
+from backend.audio_store import get_audio_store, UPLOADS_DIR_NAME # 完成的文件移入分片存储
+from backend.transcode import schedule_transcode # 完成后按配置在后台转码
+
+# ai.json 中用于分块上传配置的保留键
+UPLOAD_CONFIG_KEY = 'upload'
+
+DEFAULT_UPLOAD_CONFIG = {
+    "chunk_bytes": 4 * 1024 * 1024,         # 建议客户端使用的分块大小
+    "max_chunk_bytes": 16 * 1024 * 1024,    # 单个分块请求体上限
+    "max_file_bytes": 1024 * 1024 * 1024,   # 单个文件上限
+    "read_block_bytes": 64 * 1024,          # 从请求流读取的块大小
+    "session_ttl_seconds": 24 * 3600,       # 未完成的上传会话保留时长
+}
+
+# 与 check_audio_file_status 一致：content_type -> 扩展名
+_EXTENSIONS = {'wav': '.wav', 'ogg': '.ogg', 'aac': '.aac'}
+_MD5_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+_UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}(-\d+)?$')
+
+def get_upload_config():
+    """返回合并默认值后的分块上传配置"""
+    upload_config = dict(DEFAULT_UPLOAD_CONFIG)
+    upload_config.update(get_config().get(UPLOAD_CONFIG_KEY) or {})
+    return upload_config
+
+def audio_extension(content_type):
+    """根据 content_type 推断音频文件扩展名，默认 .mp3"""
+    if content_type and '/' in content_type:
+        return _EXTENSIONS.get(content_type.split('/')[-1].lower(), '.mp3')
+    return '.mp3'
+
+def is_content_hash(value):
+    """是否为 32 位小写十六进制的 MD5 (上传文件以内容哈希命名)"""
+    return bool(value) and bool(_MD5_PATTERN.match(value))
+
+def _uploads_dir(audio_folder):
+    path = os.path.join(audio_folder, UPLOADS_DIR_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def copy_stream(stream, target, hasher, limit, block_bytes):
+    """从 stream 按块读取写入 target 并更新 hasher，返回写入字节数；超过 limit 时抛出 ValueError"""
+    written = 0
+    while True:
+        block = stream.read(block_bytes)
+        if not block:
+            return written
+        written += len(block)
+        if written > limit:
+            raise ValueError(f"上传内容超过 {limit} 字节上限")
+        target.write(block)
+        hasher.update(block)
+
+# --- 上传会话 ---
+
+class _HashState:
+    """进程内的增量哈希：hashed_bytes 之前的内容已计入 hasher"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hasher = hashlib.md5()
+        self.hashed_bytes = 0
+
+_hash_states = {}
+_hash_states_lock = threading.Lock()
+_last_cleanup = 0.0
+
+def _hash_state(upload_id):
+    with _hash_states_lock:
+        state = _hash_states.get(upload_id)
+        if state is None:
+            state = _hash_states[upload_id] = _HashState()
+        return state
+
+def _drop_hash_state(upload_id):
+    with _hash_states_lock:
+        _hash_states.pop(upload_id, None)
+
+def _catch_up(state, part_path, received, block_bytes):
+    """把 hashed_bytes 之后已写入磁盘的内容补算进哈希 (重启或其他进程写入后)"""
+    if state.hashed_bytes > received: # 临时文件被重置过
+        state.hasher = hashlib.md5()
+        state.hashed_bytes = 0
+    if state.hashed_bytes == received:
+        return
+    with open(part_path, 'rb') as f:
+        f.seek(state.hashed_bytes)
+        remaining = received - state.hashed_bytes
+        while remaining > 0:
+            block = f.read(min(block_bytes, remaining))
+            if not block:
+                break
+            state.hasher.update(block)
+            remaining -= len(block)
+    state.hashed_bytes = received
+
+def _paths(audio_folder, upload_id):
+    uploads_dir = _uploads_dir(audio_folder)
+    return os.path.join(uploads_dir, f"{upload_id}.json"), os.path.join(uploads_dir, f"{upload_id}.part")
+
+def _load_session(audio_folder, upload_id):
+    """读取会话；upload_id 非法或会话不存在时返回 None"""
+    if not upload_id or not _UPLOAD_ID_PATTERN.match(upload_id):
+        return None
+    meta_path, part_path = _paths(audio_folder, upload_id)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return None
+    session['received'] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    return session
+
+def _save_session(audio_folder, session):
+    meta_path, _ = _paths(audio_folder, session['upload_id'])
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({k: v for k, v in session.items() if k != 'received'}, f)
+    os.replace(tmp_path, meta_path)
+
+def _discard_session(audio_folder, upload_id):
+    for path in _paths(audio_folder, upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    _drop_hash_state(upload_id)
+
+def _status(session, upload_config):
+    return {
+        "upload_id": session['upload_id'],
+        "offset": session['received'],
+        "size": session['size'],
+        "chunk_bytes": upload_config['chunk_bytes'],
+        "max_chunk_bytes": upload_config['max_chunk_bytes'],
+    }
+
+def cleanup_stale_uploads(audio_folder, ttl_seconds):
+    """删除超过 ttl_seconds 未更新的上传会话，返回 (删除文件数, 释放字节数)"""
+    uploads_dir = _uploads_dir(audio_folder)
+    cutoff = time.time() - ttl_seconds
+    removed, freed = 0, 0
+    for name in os.listdir(uploads_dir):
+        path = os.path.join(uploads_dir, name)
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime < cutoff:
+                os.remove(path)
+                removed += 1
+                freed += stat.st_size
+        except OSError:
+            continue
+    if removed:
+        print(f"已清理 {removed} 个过期的上传临时文件")
+    return removed, freed
+
+def _maybe_cleanup(audio_folder, upload_config):
+    global _last_cleanup
+    now = time.monotonic()
+    if now - _last_cleanup < 600:
+        return
+    _last_cleanup = now
+    cleanup_stale_uploads(audio_folder, upload_config['session_ttl_seconds'])
+
+def init_upload(audio_folder, file_hash, size, content_type, keep_original=None):
+    """初始化 (或恢复) 上传会话
+
+    提供 file_hash 时会话 ID 由哈希和大小决定，客户端刷新页面后再次初始化即可拿到已接收的字节数；
+    目标文件已存在时直接返回 status=exists。keep_original 指定后台转码后是否保留原文件。
+    """
+    upload_config = get_upload_config()
+    if file_hash is not None:
+        file_hash = str(file_hash).lower()
+        if not is_content_hash(file_hash):
+            return {"error": "file_hash 必须为 32 位十六进制 MD5"}, 400
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        return {"error": "size 参数必须为整数"}, 400
+    if size <= 0:
+        return {"error": "size 必须大于 0"}, 400
+    if size > upload_config['max_file_bytes']:
+        return {"error": f"文件超过 {upload_config['max_file_bytes']} 字节上限"}, 413
+
+    extension = audio_extension(content_type)
+    if file_hash and get_audio_store(audio_folder).exists(f"{file_hash}{extension}"):
+        return {"status": "exists", "object_name": f"{file_hash}{extension}"}, 200
+
+    _maybe_cleanup(audio_folder, upload_config)
+    upload_id = f"{file_hash}-{size}" if file_hash else secrets.token_hex(16)
+    session = _load_session(audio_folder, upload_id)
+    if session is None or session.get('extension') != extension:
+        session = {
+            "upload_id": upload_id,
+            "file_hash": file_hash,
+            "size": size,
+            "extension": extension,
+            "created_at": time.time(),
+            "keep_original": keep_original,
+            "received": 0,
+        }
+        _save_session(audio_folder, session)
+        _, part_path = _paths(audio_folder, upload_id)
+        open(part_path, 'wb').close()
+        _drop_hash_state(upload_id)
+    elif session['received']:
+        print(f"恢复上传会话 {upload_id}: 已接收 {session['received']}/{session['size']} 字节")
+    return {"status": "new", **_status(session, upload_config)}, 200
+
+def get_upload_status(audio_folder, upload_id):
+    """返回上传会话的已接收字节数"""
+    session = _load_session(audio_folder, upload_id)
+    if session is None:
+        return {"error": "上传会话不存在或已过期"}, 404
+    return _status(session, get_upload_config()), 200
+
+def write_chunk(audio_folder, upload_id, offset, stream, content_length):
+    """把请求流追加到临时文件
+
+    offset 必须等于已接收字节数，否则返回 409 和当前 offset，客户端从该位置继续；
+    写入中断 (客户端断开) 时截断回写入前的长度，保证临时文件内容与 offset 一致。
+    """
+    upload_config = get_upload_config()
+    session = _load_session(audio_folder, upload_id)
+    if session is None:
+        return {"error": "上传会话不存在或已过期"}, 404
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        return {"error": "offset 参数必须为整数"}, 400
+    if content_length is not None and content_length > upload_config['max_chunk_bytes']:
+        return {"error": f"分块超过 {upload_config['max_chunk_bytes']} 字节上限"}, 413
+
+    state = _hash_state(upload_id)
+    _, part_path = _paths(audio_folder, upload_id)
+    with state.lock:
+        received = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset != received:
+            return {"error": "offset 与已接收字节数不一致", **_status({**session, "received": received}, upload_config)}, 409
+        _catch_up(state, part_path, received, upload_config['read_block_bytes'])
+        limit = min(upload_config['max_chunk_bytes'], session['size'] - received)
+        hasher = state.hasher.copy() # 写入成功后才替换，失败时哈希状态保持不变
+        try:
+            with open(part_path, 'ab') as f:
+                written = copy_stream(stream, f, hasher, limit, upload_config['read_block_bytes'])
+        except Exception as e:
+            with open(part_path, 'ab') as f:
+                f.truncate(received)
+            if isinstance(e, ValueError):
+                return {"error": str(e)}, 413
+            print(f"写入上传分块时出错 ({upload_id}): {e}")
+            return {"error": f"写入分块失败: {str(e)}"}, 500
+        state.hasher = hasher
+        state.hashed_bytes = received + written
+    return _status({**session, "received": received + written}, upload_config), 200
+
+def complete_upload(audio_folder, upload_id):
+    """校验大小和 MD5，原子地移入音频存储，以服务端计算的哈希命名"""
+    upload_config = get_upload_config()
+    session = _load_session(audio_folder, upload_id)
+    if session is None:
+        return {"error": "上传会话不存在或已过期"}, 404
+    if session['received'] != session['size']:
+        return {"error": "文件尚未上传完整", **_status(session, upload_config)}, 409
+
+    state = _hash_state(upload_id)
+    _, part_path = _paths(audio_folder, upload_id)
+    with state.lock:
+        _catch_up(state, part_path, session['received'], upload_config['read_block_bytes'])
+        file_hash = state.hasher.hexdigest()
+        if session.get('file_hash') and session['file_hash'] != file_hash:
+            print(f"上传校验失败 ({upload_id}): 期望 {session['file_hash']}，实际 {file_hash}")
+            _discard_session(audio_folder, upload_id)
+            return {"error": "文件校验失败，内容与声明的哈希不一致，请重新上传"}, 400
+        object_name = f"{file_hash}{session['extension']}"
+        get_audio_store(audio_folder).put(part_path, object_name)
+        _discard_session(audio_folder, upload_id)
+    print(f"分块上传完成: {object_name} ({session['size']} 字节)")
+    schedule_transcode(audio_folder, object_name, session.get('keep_original'))
+    return {"message": "文件上传成功", "object_name": object_name}, 200
+
+def save_stream_atomically(audio_folder, stream, object_name):
+    """整文件上传：流式写入临时文件后原子移动；object_name 以 MD5 命名时校验内容"""
+    upload_config = get_upload_config()
+    tmp_path = os.path.join(_uploads_dir(audio_folder), f"{secrets.token_hex(16)}.part")
+    hasher = hashlib.md5()
+    try:
+        with open(tmp_path, 'wb') as f:
+            copy_stream(stream, f, hasher, upload_config['max_file_bytes'], upload_config['read_block_bytes'])
+        stem = os.path.splitext(object_name)[0].lower()
+        if is_content_hash(stem) and stem != hasher.hexdigest():
+            raise ValueError("文件校验失败，内容与文件名中的哈希不一致")
+        get_audio_store(audio_folder).put(tmp_path, object_name)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
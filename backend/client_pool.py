@@ -0,0 +1,150 @@
+# backend/client_pool.py
+import time
+import threading
+import httpx
+import openai
+from backend.config import get_config # 从 config 模块导入配置
+
+# ai.json 中用于连接池配置的保留键 (没有 api_key/base_url，不会出现在模型列表中)
+HTTP_CLIENT_CONFIG_KEY = 'http_client'
+
+# 默认连接池参数，可在 ai.json 的 "http_client" 节点中覆盖
+DEFAULT_POOL_CONFIG = {
+    "max_connections": 100,          # 每个客户端的最大连接数
+    "max_keepalive_connections": 20, # 每个客户端保持的空闲长连接数
+    "keepalive_expiry": 60.0,        # 空闲长连接的存活时间 (秒)
+    "timeout": 600.0,                # 读写总超时 (秒)，长音频转录需要较长时间
+    "connect_timeout": 10.0,         # 建立连接超时 (秒)
+    "idle_evict_seconds": 1800.0,    # 客户端多久未被获取后从注册表中移除并关闭 (秒)，应大于最长请求耗时
+}
+
+_clients = {} # (base_url, api_key) -> [client, last_used]；api_key 为 None 时是原始 httpx 客户端
+_lock = threading.Lock()
+_last_evict = 0.0
+
+def get_pool_config():
+    """返回合并默认值后的连接池配置"""
+    pool_config = dict(DEFAULT_POOL_CONFIG)
+    user_config = get_config().get(HTTP_CLIENT_CONFIG_KEY) or {}
+    pool_config.update({k: v for k, v in user_config.items() if k in DEFAULT_POOL_CONFIG})
+    return pool_config
+
+def _build_http_client(pool_config):
+    """创建带长连接池的 httpx 客户端"""
+    return openai.DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=pool_config['max_connections'],
+            max_keepalive_connections=pool_config['max_keepalive_connections'],
+            keepalive_expiry=pool_config['keepalive_expiry']
+        ),
+        timeout=openai.Timeout(pool_config['timeout'], connect=pool_config['connect_timeout'])
+    )
+
+def _build_client(api_key, base_url, pool_config):
+    """创建带共享长连接池的 OpenAI 客户端"""
+    return openai.OpenAI(api_key=api_key, base_url=base_url, http_client=_build_http_client(pool_config))
+
+def _evict_idle_clients(now, idle_seconds):
+    """移除长时间未使用的客户端 (调用方需持有 _lock)，返回待关闭的客户端列表"""
+    expired = [k for k, (_, last_used) in _clients.items() if now - last_used > idle_seconds]
+    return [_clients.pop(k)[0] for k in expired]
+
+def _get_or_create(key, factory):
+    """从注册表获取客户端，不存在时用 factory(pool_config) 创建"""
+    global _last_evict
+    pool_config = get_pool_config()
+    idle_seconds = pool_config['idle_evict_seconds']
+    now = time.monotonic()
+    expired = []
+
+    with _lock:
+        # 顺带清理空闲客户端，最多每 idle_seconds/4 执行一次
+        if now - _last_evict > idle_seconds / 4:
+            expired = _evict_idle_clients(now, idle_seconds)
+            _last_evict = now
+        entry = _clients.get(key)
+        if entry is None:
+            entry = [factory(pool_config), now]
+            _clients[key] = entry
+        else:
+            entry[1] = now
+        client = entry[0]
+
+    # 在锁外关闭被淘汰的客户端，避免阻塞其他请求
+    for old_client in expired:
+        try:
+            old_client.close()
+        except Exception as e:
+            print(f"关闭空闲 OpenAI 客户端时出错: {e}")
+    if expired:
+        print(f"已回收 {len(expired)} 个空闲 OpenAI 客户端")
+
+    return client
+
+def get_client(api_key, base_url):
+    """获取 (base_url, api_key) 对应的进程级共享 OpenAI 客户端"""
+    return _get_or_create((base_url, api_key), lambda pool_config: _build_client(api_key, base_url, pool_config))
+
+def get_http_client(base_url):
+    """获取 base_url 对应的共享 httpx 客户端，用于 SDK 无法覆盖的原始请求 (API key 由调用方放在请求头中)"""
+    return _get_or_create((base_url, None), _build_http_client)
+
+# --- 异步客户端 (ASGI 模式) ---
+# 异步客户端绑定到创建它的事件循环，且关闭需要 await，因此单独存放、不做空闲回收；
+# 空闲连接由 httpx 的 keepalive_expiry 自行断开。
+_async_clients = {}
+
+def _build_async_http_client(pool_config):
+    """创建带长连接池的 httpx 异步客户端"""
+    return openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=pool_config['max_connections'],
+            max_keepalive_connections=pool_config['max_keepalive_connections'],
+            keepalive_expiry=pool_config['keepalive_expiry']
+        ),
+        timeout=openai.Timeout(pool_config['timeout'], connect=pool_config['connect_timeout'])
+    )
+
+def get_async_client(api_key, base_url):
+    """获取 (base_url, api_key) 对应的共享 AsyncOpenAI 客户端"""
+    key = (base_url, api_key)
+    client = _async_clients.get(key)
+    if client is None:
+        client = openai.AsyncOpenAI(
+            api_key=api_key, base_url=base_url,
+            http_client=_build_async_http_client(get_pool_config())
+        )
+        client = _async_clients.setdefault(key, client)
+    return client
+
+def get_async_http_client(base_url):
+    """获取 base_url 对应的共享 httpx 异步客户端"""
+    key = (base_url, None)
+    client = _async_clients.get(key)
+    if client is None:
+        client = _async_clients.setdefault(key, _build_async_http_client(get_pool_config()))
+    return client
+
+async def aclose_all_clients():
+    """关闭并清空所有异步客户端 (在 ASGI 应用关闭时调用)"""
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        try:
+            if isinstance(client, openai.AsyncOpenAI):
+                await client.close()
+            else:
+                await client.aclose()
+        except Exception as e:
+            print(f"关闭异步客户端时出错: {e}")
+
+def close_all_clients():
+    """关闭并清空所有已缓存的客户端"""
+    with _lock:
+        clients = [entry[0] for entry in _clients.values()]
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:
+            print(f"关闭 OpenAI 客户端时出错: {e}")
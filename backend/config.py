@@ -1,59 +1,88 @@
 # backend/config.py
 import os
 import json
+from backend.key_pool import get_key_pool
+from backend.watched_file import get_watched_file
 
 # 获取当前脚本文件所在的目录
 script_dir = os.path.dirname(os.path.abspath(__file__))
 config_path = os.path.join(script_dir, 'ai.json')
 
-cg = {}
-model_list = []
+# 配置文件和提示词文件的检查间隔 (秒)，文件变化后最迟在该时间后生效
+RELOAD_INTERVAL = float(os.environ.get('CONFIG_RELOAD_INTERVAL', 2))
 
-try:
-    with open(config_path, 'r', encoding='utf-8') as file:
-        cg = json.load(file)
+_EMPTY_CONFIG = ({}, [])
+
+def _load_ai_config(text):
+    """解析 ai.json，返回 (配置字典, 可用模型列表)"""
+    cg = json.loads(text)
     # 将模型列表转换为列表形式 (过滤掉没有 api_key 或 base_url 的配置)
-    model_list = [k for k, v in cg.items() if v.get('api_key') and v.get('base_url')]
+    model_list = [k for k, v in cg.items() if isinstance(v, dict) and v.get('api_key') and v.get('base_url')]
     print(f"加载的可用模型: {model_list}")
-except FileNotFoundError:
-    print(f"警告: 配置文件 {config_path} 未找到。")
-except json.JSONDecodeError:
-    print(f"警告: 配置文件 {config_path} 格式错误。")
-except Exception as e:
-    print(f"加载配置文件时发生未知错误: {e}")
+    return cg, model_list
+
+_config_file = get_watched_file(config_path, loader=_load_ai_config, reload_interval=RELOAD_INTERVAL)
+if _config_file.snapshot() is None:
+    print(f"警告: 配置文件 {config_path} 未找到或格式错误。")
+
+def _current_config():
+    snapshot = _config_file.snapshot()
+    return snapshot.value if snapshot else _EMPTY_CONFIG
 
 def get_config():
-    """返回加载的配置字典"""
-    return cg
+    """返回当前配置字典 (ai.json 修改后自动重新加载)"""
+    return _current_config()[0]
 
 def get_model_list():
     """返回可用的模型列表"""
-    return model_list
+    return _current_config()[1]
 
 def get_model_config(model_name):
     """根据模型名称获取配置"""
-    return cg.get(model_name)
+    return get_config().get(model_name)
+
+def get_config_version():
+    """返回当前 ai.json 的版本 (内容 sha256)，未加载时返回 None"""
+    snapshot = _config_file.snapshot()
+    return snapshot.version if snapshot else None
+
+def get_prompt(prompt_path):
+    """返回提示词文件的快照 (value 为文本，version 为内容 sha256)，文件不存在时返回 None
+
+    提示词常驻内存，文件修改后自动重新加载，version 可直接用作下游缓存键的一部分。
+    """
+    return get_watched_file(prompt_path, reload_interval=RELOAD_INTERVAL).snapshot()
 
 def get_script_dir():
     """返回脚本所在目录"""
     return script_dir
 
+# ai.json 中用于 key 轮换池配置的保留键
+KEY_POOL_CONFIG_KEY = 'key_pool'
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
+
+def get_api_key_pool():
+    """返回 api.txt 对应的进程级 key 轮换池；ai.json 中 key_pool 的选项修改后在下次调用时生效，无需重启"""
+    pool_config = get_config().get(KEY_POOL_CONFIG_KEY) or {}
+    return get_key_pool(
+        os.path.join(script_dir, 'api.txt'),
+        stats_path=os.path.join(script_dir, 'key_usage.json'),
+        strategy=pool_config.get('strategy', 'round_robin'),
+        cooldown_seconds=pool_config.get('cooldown_seconds', 60),
+        reload_interval=pool_config.get('reload_interval', 2),
+        flush_every=pool_config.get('flush_every', 0)
+    )
+
 def get_gemini_config(model_name):
-    model_cnt_path = os.path.join(script_dir, f'{model_name}_cnt.txt')
-    api_path = os.path.join(script_dir, f'api.txt')
-
-    if not os.path.exists(model_cnt_path):
-        cnt = 0
-    else:
-        with open(model_cnt_path, 'rb') as f:
-            cnt = int(f.read())
-    with open(model_cnt_path, 'wb') as f:
-        f.write(str(cnt + 1).encode())
-    with open(api_path, 'r') as f:
-        api_list = f.read().split('\n')
+    """从 key 轮换池中为模型选择一个 API key，返回模型配置"""
     return {
         "model": model_name,
-        "api_key": api_list[cnt % len(api_list)],
-        "base_url": "https://generativelanguage.googleapis.com/v1beta/openai/"
+        "api_key": get_api_key_pool().get_key(model_name),
+        "base_url": GEMINI_BASE_URL
     }
-    pass
\ No newline at end of file
+
+def report_rate_limited(model_config, retry_after=None):
+    """上游返回 429 时调用，将该配置使用的 key 放入冷却期"""
+    if model_config.get('base_url') != GEMINI_BASE_URL:
+        return
+    get_api_key_pool().report_rate_limited(model_config['model'], model_config['api_key'], retry_after)
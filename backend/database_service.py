@@ -1,15 +1,124 @@
 # backend/database_service.py
 import sqlite3
 import os
+import json
+import base64
+import html
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from backend.metrics import timed_db, db_query_duration
 
 # 获取当前脚本文件所在的目录
 script_dir = os.path.dirname(os.path.abspath(__file__))
 DATABASE_FILE = os.path.join(script_dir, 'report_database.db')
 
+# 连接池大小与 SQLite 调优参数
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5)) # 连接全部借出时最多等待的秒数
+ITER_PAGE_SIZE = 500 # iter_reports 每次借用连接读取的行数
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # 读写互不阻塞
+    "PRAGMA synchronous=NORMAL",    # WAL 模式下足够安全，显著减少 fsync
+    "PRAGMA cache_size=-16000",     # 约 16MB 页缓存
+    "PRAGMA mmap_size=268435456",   # 256MB 内存映射读取
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+STATEMENT_CACHE_SIZE = 128 # 每个连接缓存的预编译语句数量
+
+class PoolTimeout(ConnectionError):
+    """连接池中的连接全部被占用且等待超时 (路由层返回 503)"""
+
+    def __init__(self, timeout):
+        self.retry_after = max(int(timeout + 0.5), 1)
+        super().__init__(f"数据库繁忙，等待连接超过 {timeout:g} 秒，请稍后重试")
+
+class ConnectionPool:
+    """线程安全的 SQLite 连接池
+
+    连接在首次需要时创建，用完归还到队列中复用；每个连接开启 WAL 并缓存预编译语句。
+    """
+
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=5,
+            check_same_thread=False, # 连接会在不同线程间复用，但同一时刻只被一个线程持有
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        """借出一个连接；连接数已达上限且 timeout 秒内没有连接归还时抛出 PoolTimeout"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self._created -= 1
+                raise
+        # 连接数已达上限，等待其他线程归还
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            print(f"数据库连接池已耗尽 ({self.size} 个连接)，等待 {self.timeout:g} 秒后放弃")
+            raise PoolTimeout(self.timeout) from None
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+_pool = ConnectionPool(DATABASE_FILE)
+
+@contextmanager
+def get_connection():
+    """从连接池借出一个连接，退出时归还 (异常时回滚未提交的事务)；等待超时抛出 PoolTimeout"""
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
 def init_db():
     """初始化数据库，创建表（如果不存在）"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    with get_connection() as conn:
+        _create_tables(conn)
+
+def _create_tables(conn):
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS reports (
@@ -23,9 +132,184 @@ def init_db():
             PRIMARY KEY (object_name, submission_timestamp)
         )
     ''')
+    _create_latest_projection(conn)
+    _create_search_index(conn)
     conn.commit()
-    conn.close()
 
+# reports_latest 的列，与 reports 相同
+REPORT_COLUMNS = "object_name, school, method, phone, time, transcription_text, submission_timestamp"
+
+def _create_latest_projection(conn):
+    """创建 reports_latest 投影表：每个 object_name 只保留最新版本，由触发器维护"""
+    cursor = conn.cursor()
+    existed = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reports_latest'"
+    ).fetchone() is not None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reports_latest (
+            object_name TEXT PRIMARY KEY,
+            school TEXT,
+            method TEXT,
+            phone TEXT,
+            time TEXT,
+            transcription_text TEXT,
+            submission_timestamp TEXT
+        )
+    ''')
+    # (submission_timestamp, object_name) 复合索引同时服务于列表排序和游标分页
+    cursor.execute('DROP INDEX IF EXISTS idx_reports_latest_timestamp')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_reports_latest_cursor ON reports_latest (submission_timestamp, object_name)'
+    )
+
+    # 新版本写入时，只有比当前最新版本更新才替换投影
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reports_latest_after_insert AFTER INSERT ON reports
+        WHEN NOT EXISTS (
+            SELECT 1 FROM reports_latest
+            WHERE object_name = NEW.object_name AND submission_timestamp > NEW.submission_timestamp
+        )
+        BEGIN
+            INSERT OR REPLACE INTO reports_latest ({REPORT_COLUMNS})
+            VALUES (NEW.object_name, NEW.school, NEW.method, NEW.phone, NEW.time,
+                    NEW.transcription_text, NEW.submission_timestamp);
+        END
+    ''')
+    # 删除或修改记录时，重新计算受影响 object_name 的最新版本
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reports_latest_after_delete AFTER DELETE ON reports
+        BEGIN
+            DELETE FROM reports_latest WHERE object_name = OLD.object_name;
+            INSERT INTO reports_latest ({REPORT_COLUMNS})
+            SELECT {REPORT_COLUMNS} FROM reports
+            WHERE object_name = OLD.object_name
+            ORDER BY submission_timestamp DESC LIMIT 1;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reports_latest_after_update AFTER UPDATE ON reports
+        BEGIN
+            DELETE FROM reports_latest WHERE object_name IN (OLD.object_name, NEW.object_name);
+            INSERT OR REPLACE INTO reports_latest ({REPORT_COLUMNS})
+            SELECT {REPORT_COLUMNS} FROM reports
+            WHERE object_name = OLD.object_name
+            ORDER BY submission_timestamp DESC LIMIT 1;
+            INSERT OR REPLACE INTO reports_latest ({REPORT_COLUMNS})
+            SELECT {REPORT_COLUMNS} FROM reports
+            WHERE object_name = NEW.object_name
+            ORDER BY submission_timestamp DESC LIMIT 1;
+        END
+    ''')
+
+    if not existed:
+        # 首次创建时，从已有数据回填投影表
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO reports_latest ({REPORT_COLUMNS})
+            SELECT r.object_name, r.school, r.method, r.phone, r.time, r.transcription_text, r.submission_timestamp
+            FROM reports r
+            INNER JOIN (
+                SELECT object_name, MAX(submission_timestamp) as max_timestamp
+                FROM reports
+                GROUP BY object_name
+            ) latest ON r.object_name = latest.object_name AND r.submission_timestamp = latest.max_timestamp
+        ''')
+        if cursor.rowcount > 0:
+            print(f"已回填 reports_latest: {cursor.rowcount} 条")
+
+# 全文检索使用的分词器；trigram 支持中文子串匹配，SQLite 3.34 以下回退到 unicode61
+_fts_tokenizer = None
+SEARCH_MIN_QUERY_CHARS = 3 # trigram 分词器可索引的最短查询长度
+# highlight()/snippet() 先用控制字符标记命中位置，HTML 转义后再替换为 mark_start/mark_end
+_MARK_START, _MARK_END = '\x02', '\x03'
+_HIGHLIGHTED_FIELDS = ('school', 'method', 'snippet')
+
+def _escape_highlighted(row, mark_start, mark_end):
+    """转义检索结果中的用户文本，只保留命中标记为 HTML"""
+    result = dict(row)
+    for field in _HIGHLIGHTED_FIELDS:
+        value = result.get(field)
+        if value is not None:
+            result[field] = html.escape(value).replace(_MARK_START, mark_start).replace(_MARK_END, mark_end)
+    return result
+
+def _create_search_index(conn):
+    """创建 reports_fts 全文索引，镜像 reports_latest 的学校、途径和转录文本
+
+    FTS5 的 rowid 来自 report_search_ids 中为每个 object_name 分配的稳定整数 id，
+    reports_latest 上的触发器据此按 rowid 精确替换或删除索引行。
+    """
+    global _fts_tokenizer
+    cursor = conn.cursor()
+    existed = cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'reports_fts'"
+    ).fetchone()
+
+    if existed:
+        _fts_tokenizer = 'trigram' if 'trigram' in existed[0] else 'unicode61'
+    else:
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                cursor.execute(f'''
+                    CREATE VIRTUAL TABLE reports_fts USING fts5(
+                        object_name UNINDEXED,
+                        submission_timestamp UNINDEXED,
+                        school,
+                        method,
+                        transcription_text,
+                        tokenize = '{tokenizer}'
+                    )
+                ''')
+                _fts_tokenizer = tokenizer
+                break
+            except sqlite3.OperationalError as e:
+                print(f"创建全文索引 (tokenize={tokenizer}) 失败: {e}")
+        if _fts_tokenizer is None:
+            return
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS report_search_ids (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            object_name TEXT UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS reports_fts_after_insert AFTER INSERT ON reports_latest
+        BEGIN
+            -- 外层 INSERT OR REPLACE 的冲突策略会覆盖触发器内的策略，因此用 NOT EXISTS 保证 id 稳定
+            INSERT INTO report_search_ids (object_name)
+            SELECT NEW.object_name
+            WHERE NOT EXISTS (SELECT 1 FROM report_search_ids WHERE object_name = NEW.object_name);
+            DELETE FROM reports_fts
+            WHERE rowid = (SELECT id FROM report_search_ids WHERE object_name = NEW.object_name);
+            INSERT INTO reports_fts (rowid, object_name, submission_timestamp, school, method, transcription_text)
+            VALUES ((SELECT id FROM report_search_ids WHERE object_name = NEW.object_name),
+                    NEW.object_name, NEW.submission_timestamp, NEW.school, NEW.method, NEW.transcription_text);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS reports_fts_after_delete AFTER DELETE ON reports_latest
+        BEGIN
+            DELETE FROM reports_fts
+            WHERE rowid = (SELECT id FROM report_search_ids WHERE object_name = OLD.object_name);
+        END
+    ''')
+
+    if not existed:
+        # 首次创建时，从 reports_latest 回填索引
+        cursor.execute('''
+            INSERT OR IGNORE INTO report_search_ids (object_name) SELECT object_name FROM reports_latest
+        ''')
+        cursor.execute('''
+            INSERT INTO reports_fts (rowid, object_name, submission_timestamp, school, method, transcription_text)
+            SELECT ids.id, l.object_name, l.submission_timestamp, l.school, l.method, l.transcription_text
+            FROM reports_latest l
+            INNER JOIN report_search_ids ids ON ids.object_name = l.object_name
+        ''')
+        if cursor.rowcount > 0:
+            print(f"已回填全文索引 reports_fts: {cursor.rowcount} 条")
+
+@timed_db('save_report_data')
 def save_report_data(report_data):
     """
     将举报数据保存到 SQLite 数据库中，以 object_name 和 submission_timestamp 为复合主键。
@@ -48,49 +332,255 @@ def save_report_data(report_data):
     submission_timestamp = datetime.now().isoformat() # 添加提交时间戳
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        # 使用 INSERT OR REPLACE 来插入或更新记录
-        cursor.execute('''
-            INSERT OR REPLACE INTO reports (object_name, school, method, phone, time, transcription_text, submission_timestamp)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (object_name, school, method, phone, time, transcription_text, submission_timestamp))
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            # 使用 INSERT OR REPLACE 来插入或更新记录
+            conn.execute('''
+                INSERT OR REPLACE INTO reports (object_name, school, method, phone, time, transcription_text, submission_timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (object_name, school, method, phone, time, transcription_text, submission_timestamp))
+            conn.commit()
         return True, f"数据已成功保存或更新，复合主键为: {object_name}, {submission_timestamp}"
     except sqlite3.Error as e:
         print(f"数据库错误: {e}")
         return False, f"数据库操作失败: {e}"
 
+@timed_db('save_reports_bulk')
+def save_reports_bulk(reports):
+    """
+    批量保存举报数据 (批量导入使用)，所有记录在同一个事务中写入，任一条失败则整批回滚。
+
+    Args:
+        reports (list): 举报数据字典列表，每个字典必须包含 'object_name'。
+
+    Returns:
+        tuple: (bool, str) 表示操作是否成功和相应的消息。
+    """
+    submission_timestamp = datetime.now().isoformat() # 同一批使用相同的提交时间戳
+    rows = []
+    for report_data in reports:
+        if not report_data.get('object_name'):
+            return False, "缺少 'object_name' 字段"
+        rows.append((
+            report_data['object_name'],
+            report_data.get("school"),
+            report_data.get("method"),
+            report_data.get("phone"),
+            report_data.get("time"),
+            report_data.get("transcription_text"),
+            submission_timestamp
+        ))
+    if not rows:
+        return True, "没有需要保存的数据"
+
+    try:
+        with get_connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO reports (object_name, school, method, phone, time, transcription_text, submission_timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+        return True, f"已批量保存 {len(rows)} 条数据"
+    except sqlite3.Error as e:
+        print(f"数据库错误 (批量保存): {e}")
+        return False, f"数据库操作失败: {e}"
+
+@timed_db('find_referenced_object_names')
+def find_referenced_object_names(object_names):
+    """返回 object_names 中被至少一条举报引用的名称集合 (音频存储淘汰前检查)"""
+    object_names = list(object_names)
+    if not object_names:
+        return set()
+    with get_connection() as conn:
+        placeholders = ','.join('?' * len(object_names))
+        rows = conn.execute(
+            f'SELECT object_name FROM reports_latest WHERE object_name IN ({placeholders})', object_names
+        ).fetchall()
+        return {row[0] for row in rows}
+
+@timed_db('get_all_reports')
 def get_all_reports():
     """获取所有举报数据
     
     Returns:
         list: 举报数据列表，每个元素是一个字典
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row  # 使返回字典格式
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('''
-            SELECT r.object_name, r.school, r.method, r.phone, r.time, r.transcription_text, r.submission_timestamp
-            FROM reports r
-            INNER JOIN (
-                SELECT object_name, MAX(submission_timestamp) as max_timestamp
-                FROM reports
-                GROUP BY object_name
-            ) latest ON r.object_name = latest.object_name AND r.submission_timestamp = latest.max_timestamp
-            ORDER BY r.submission_timestamp DESC
-        ''')
-        reports = [dict(row) for row in cursor.fetchall()]
-        return reports
+        with get_connection() as conn: # 连接池中的连接已设置 row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            # reports_latest 由触发器维护，按 submission_timestamp 索引倒序扫描即可
+            cursor.execute(f'''
+                SELECT {REPORT_COLUMNS}
+                FROM reports_latest
+                ORDER BY submission_timestamp DESC
+            ''')
+            reports = [dict(row) for row in cursor.fetchall()]
+            return reports
     except sqlite3.Error as e:
         print(f"数据库查询错误: {e}")
         return []
-    finally:
-        conn.close()
 
+def encode_cursor(report):
+    """将一条报告的排序键编码为不透明的分页游标"""
+    raw = json.dumps([report['submission_timestamp'], report['object_name']], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor_token):
+    """解析分页游标，返回 (submission_timestamp, object_name)；格式错误时抛出 ValueError"""
+    try:
+        submission_timestamp, object_name = json.loads(base64.urlsafe_b64decode(cursor_token.encode('ascii')))
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor_token}") from e
+    return submission_timestamp, object_name
+
+def _build_report_filters(cursor_token=None, school=None, method=None, since=None, until=None):
+    """构造 reports_latest 的 WHERE 子句和参数"""
+    conditions = []
+    params = []
+    if cursor_token:
+        # 键集分页：只取排在游标之后 (更早) 的记录
+        conditions.append('(submission_timestamp, object_name) < (?, ?)')
+        params.extend(decode_cursor(cursor_token))
+    if school:
+        conditions.append('instr(school, ?) > 0')
+        params.append(school)
+    if method:
+        conditions.append('instr(method, ?) > 0')
+        params.append(method)
+    if since:
+        conditions.append('submission_timestamp >= ?')
+        params.append(since)
+    if until:
+        conditions.append('submission_timestamp <= ?')
+        params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return where, params
+
+@timed_db('query_reports')
+def query_reports(limit=50, cursor_token=None, school=None, method=None, since=None, until=None):
+    """分页获取各 object_name 的最新举报数据
+
+    Args:
+        limit (int): 每页条数
+        cursor_token (str, optional): 上一页返回的 next_cursor
+        school / method (str, optional): 按学校、途径包含匹配过滤
+        since / until (str, optional): 提交时间范围 (ISO 格式)
+
+    Returns:
+        tuple: (reports, next_cursor)，没有下一页时 next_cursor 为 None
+
+    Raises:
+        ValueError: 分页游标格式错误
+    """
+    where, params = _build_report_filters(cursor_token, school, method, since, until)
+    try:
+        with get_connection() as conn:
+            # 多取一条用于判断是否还有下一页
+            rows = conn.execute(f'''
+                SELECT {REPORT_COLUMNS}
+                FROM reports_latest
+                {where}
+                ORDER BY submission_timestamp DESC, object_name DESC
+                LIMIT ?
+            ''', (*params, limit + 1)).fetchall()
+            reports = [dict(row) for row in rows[:limit]]
+            next_cursor = encode_cursor(reports[-1]) if len(rows) > limit else None
+            return reports, next_cursor
+    except sqlite3.Error as e:
+        print(f"数据库查询错误 (query_reports): {e}")
+        return [], None
+
+def iter_reports(cursor_token=None, school=None, method=None, since=None, until=None):
+    """逐行迭代各 object_name 的最新举报数据，不一次性载入内存
+
+    按键集分页每次读取 ITER_PAGE_SIZE 行，只在读取每页时借用连接，
+    慢速客户端消费流的期间不会占住连接池中的连接。
+
+    Raises:
+        ValueError: 分页游标格式错误 (在创建生成器时立即抛出)
+    """
+    _build_report_filters(cursor_token, school, method, since, until) # 提前校验游标
+
+    def generate():
+        page_token = cursor_token
+        while True:
+            where, params = _build_report_filters(page_token, school, method, since, until)
+            try:
+                with db_query_duration.time(query='iter_reports'), get_connection() as conn:
+                    rows = conn.execute(f'''
+                        SELECT {REPORT_COLUMNS}
+                        FROM reports_latest
+                        {where}
+                        ORDER BY submission_timestamp DESC, object_name DESC
+                        LIMIT ?
+                    ''', (*params, ITER_PAGE_SIZE)).fetchall()
+            except (sqlite3.Error, PoolTimeout) as e:
+                print(f"数据库查询错误 (iter_reports): {e}")
+                return
+            reports = [dict(row) for row in rows]
+            yield from reports
+            if len(reports) < ITER_PAGE_SIZE:
+                return
+            page_token = encode_cursor(reports[-1])
+
+    return generate()
+
+@timed_db('search_reports')
+def search_reports(query, limit=20, offset=0, mark_start='<mark>', mark_end='</mark>'):
+    """在各 object_name 最新版本的转录文本、学校和途径中全文检索
+
+    Args:
+        query (str): 检索词，按短语匹配
+        limit (int): 每页条数
+        offset (int): 跳过的条数
+        mark_start / mark_end (str): 包裹命中片段的标记 (原样输出，不经转义)
+
+    Returns:
+        tuple: (results, has_more)，results 按相关度排序，包含高亮后的字段和转录摘要；
+        school/method/snippet 已做 HTML 转义，除命中标记外不含任何标签
+    """
+    if _fts_tokenizer is None:
+        print("全文索引不可用 (当前 SQLite 不支持 FTS5)")
+        return [], False
+
+    query = query.strip()
+    if not query:
+        return [], False
+
+    try:
+        with get_connection() as conn:
+            if _fts_tokenizer == 'trigram' and len(query) < SEARCH_MIN_QUERY_CHARS:
+                # trigram 无法为过短的查询建立索引，退化为子串扫描 (无相关度排序)
+                pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                rows = conn.execute('''
+                    SELECT object_name, submission_timestamp, school, method,
+                           substr(transcription_text, 1, 120) AS snippet, 0 AS rank
+                    FROM reports_fts
+                    WHERE transcription_text LIKE ? ESCAPE '\\' OR school LIKE ? ESCAPE '\\' OR method LIKE ? ESCAPE '\\'
+                    ORDER BY submission_timestamp DESC
+                    LIMIT ? OFFSET ?
+                ''', (pattern, pattern, pattern, limit + 1, offset)).fetchall()
+            else:
+                # 将用户输入作为一个短语，避免 FTS5 查询语法注入
+                match = '"' + query.replace('"', '""') + '"'
+                rows = conn.execute('''
+                    SELECT object_name, submission_timestamp,
+                           highlight(reports_fts, 2, ?, ?) AS school,
+                           highlight(reports_fts, 3, ?, ?) AS method,
+                           snippet(reports_fts, 4, ?, ?, '…', 24) AS snippet,
+                           bm25(reports_fts) AS rank
+                    FROM reports_fts
+                    WHERE reports_fts MATCH ?
+                    ORDER BY rank
+                    LIMIT ? OFFSET ?
+                ''', (_MARK_START, _MARK_END, _MARK_START, _MARK_END, _MARK_START, _MARK_END,
+                      match, limit + 1, offset)).fetchall()
+            results = [_escape_highlighted(row, mark_start, mark_end) for row in rows[:limit]]
+            return results, len(rows) > limit
+    except sqlite3.Error as e:
+        print(f"全文检索错误 (search_reports): {e}")
+        return [], False
+
+@timed_db('get_submission_timestamps')
 def get_submission_timestamps(object_name):
     """获取指定 object_name 的所有 submission_timestamp
     
@@ -100,23 +590,22 @@ def get_submission_timestamps(object_name):
     Returns:
         list: 时间戳字符串列表，按降序排列
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-            SELECT submission_timestamp
-            FROM reports
-            WHERE object_name = ?
-            ORDER BY submission_timestamp DESC
-        ''', (object_name,))
-        timestamps = [row[0] for row in cursor.fetchall()]
-        return timestamps
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT submission_timestamp
+                FROM reports
+                WHERE object_name = ?
+                ORDER BY submission_timestamp DESC
+            ''', (object_name,))
+            timestamps = [row[0] for row in cursor.fetchall()]
+            return timestamps
     except sqlite3.Error as e:
         print(f"数据库查询错误 (get_submission_timestamps): {e}")
         return []
-    finally:
-        conn.close()
 
+@timed_db('get_report_by_timestamp')
 def get_report_by_timestamp(object_name, submission_timestamp=None):
     """根据 object_name 和 submission_timestamp 获取报告详情。
        如果 submission_timestamp 为空或未提供，则返回最新的报告。
@@ -128,34 +617,29 @@ def get_report_by_timestamp(object_name, submission_timestamp=None):
     Returns:
         dict: 包含报告详情的字典，如果未找到则返回 None
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
     try:
-        if submission_timestamp:
-            # 如果提供了时间戳，查询特定版本
-            cursor.execute('''
-                SELECT *
-                FROM reports
-                WHERE object_name = ? AND submission_timestamp = ?
-            ''', (object_name, submission_timestamp))
-        else:
-            # 如果未提供时间戳，查询最新版本
-            cursor.execute('''
-                SELECT *
-                FROM reports
-                WHERE object_name = ?
-                ORDER BY submission_timestamp DESC
-                LIMIT 1
-            ''', (object_name,))
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            if submission_timestamp:
+                # 如果提供了时间戳，查询特定版本
+                cursor.execute('''
+                    SELECT *
+                    FROM reports
+                    WHERE object_name = ? AND submission_timestamp = ?
+                ''', (object_name, submission_timestamp))
+            else:
+                # 如果未提供时间戳，从 reports_latest 直接按主键查询最新版本
+                cursor.execute('''
+                    SELECT *
+                    FROM reports_latest
+                    WHERE object_name = ?
+                ''', (object_name,))
 
-        report = cursor.fetchone()
-        return dict(report) if report else None
+            report = cursor.fetchone()
+            return dict(report) if report else None
     except sqlite3.Error as e:
         print(f"数据库查询错误 (get_report_by_timestamp): {e}")
         return None
-    finally:
-        conn.close()
 
 # 应用启动时初始化数据库
 init_db()
\ No newline at end of file
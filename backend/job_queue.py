@@ -0,0 +1,628 @@
+# backend/job_queue.py
+"""基于 SQLite 的持久化后台任务队列 (转录、举报分析)
+
+提交任务立即返回 job_id，由后台工作线程执行上游调用；客户端轮询 GET /api/jobs/<id>
+或订阅 GET /api/jobs/<id>/events (SSE) 获取进度，结果保存在 jobs.db 中，客户端断开后仍可取回。
+
+- 领取任务是一条 UPDATE ... RETURNING 语句，多个进程 (多 worker 部署或独立的任务进程) 可以共用同一个队列
+- 运行中的任务持有租约并定期续期；进程退出或崩溃后租约到期，任务重新排队 (同一主机上已退出的进程立即重新排队)
+- 上游限流、暂时不可用 (429/502/503/504) 或流中断时按退避重试，超过 max_attempts 后标记为失败
+
+独立运行任务进程 (在仓库根目录执行，此时可在 ai.json 中关闭 jobs.embedded_workers):
+    python -m backend.job_queue worker
+    python -m backend.job_queue stats
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+import secrets
+import argparse
+import threading
+from backend.config import get_config, get_script_dir, get_model_list # 从 config 模块导入
+from backend.audio_service import open_transcription, run_report_analysis
+from backend.audio_store import is_valid_object_name
+from backend.admission import PRIORITY_INTERACTIVE, PRIORITY_TRANSCRIPTION
+from backend.metrics import registry, Counter, Histogram
+from backend.sse import format_event, get_sse_config
+
+JOBS_DATABASE_FILE = os.path.join(get_script_dir(), 'jobs.db')
+
+# ai.json 中用于任务队列配置的保留键
+JOBS_CONFIG_KEY = 'jobs'
+
+DEFAULT_JOBS_CONFIG = {
+    "embedded_workers": True,         # 是否在 Web 进程内启动工作线程 (使用独立任务进程时关闭)
+    "workers": 4,                     # 每个进程同时执行的任务数
+    "lease_seconds": 60,              # 租约时长，进程失联超过该时长后任务重新排队
+    "max_attempts": 3,                # 每个任务最多执行次数
+    "retry_backoff_seconds": 5,       # 重试退避基数 (按次数翻倍)
+    "poll_interval_seconds": 0.5,     # 空闲时轮询队列、SSE 检查进度的间隔
+    "progress_interval_seconds": 0.5, # 进度最多多久写一次数据库
+    "events_max_connection_seconds": 300, # 进度 SSE 连接的最长保持时间，到期断开后客户端带 Last-Event-ID 重连
+    "result_ttl_seconds": 7 * 24 * 3600, # 已结束任务的保留时长
+}
+
+# 任务状态
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+# 这些状态码表示暂时性错误，任务会退避后重试
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+# 转录生成器在流中返回错误时使用的前缀
+STREAM_ERROR_PREFIX = "Error in stream: "
+
+# 转录进度中只保存最后这么多字符 (完整文本在任务结束时写入结果)
+PROGRESS_TAIL_CHARS = 4000
+
+jobs_finished = registry.register(Counter(
+    'jobs_finished_total', '后台任务执行结果 (每次执行计一次)', ('kind', 'result')
+))
+job_run_seconds = registry.register(Histogram(
+    'job_run_seconds', '后台任务单次执行耗时', ('kind',)
+))
+job_queue_wait_seconds = registry.register(Histogram(
+    'job_queue_wait_seconds', '任务从可执行到被领取的等待时间', ('kind',)
+))
+
+def get_jobs_config():
+    """返回合并默认值后的任务队列配置"""
+    jobs_config = dict(DEFAULT_JOBS_CONFIG)
+    jobs_config.update(get_config().get(JOBS_CONFIG_KEY) or {})
+    return jobs_config
+
+# --- 任务类型 ---
+
+class JobKind:
+    """一种任务：handler(job) 返回 (结果字典, 状态码[, 响应头])"""
+
+    def __init__(self, name, handler, priority, fields, validate=None):
+        self.name = name
+        self.handler = handler
+        self.priority = priority
+        self.fields = fields       # 提交时从请求体中取出的参数
+        self.validate = validate   # validate(payload) 返回错误信息或 None
+
+JOB_KINDS = {}
+
+def job_kind(name, priority, fields, validate=None):
+    """注册任务类型的装饰器"""
+    def decorator(handler):
+        JOB_KINDS[name] = JobKind(name, handler, priority, tuple(fields), validate)
+        return handler
+    return decorator
+
+# --- 数据库 ---
+
+_local = threading.local()
+
+def _get_connection():
+    """获取当前线程的任务数据库连接"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(JOBS_DATABASE_FILE, timeout=10, isolation_level=None) # 显式管理事务
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=10000')
+        _local.conn = conn
+    return conn
+
+def init_jobs_db():
+    """初始化任务数据库，创建表（如果不存在）"""
+    conn = _get_connection()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            dedupe_key TEXT,
+            status TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL,
+            worker TEXT,
+            lease_expires REAL,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    # 领取任务时按优先级和提交顺序扫描可执行的任务
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key, status)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)')
+
+_db_ready = False
+_db_lock = threading.Lock()
+
+def _ensure_db():
+    global _db_ready
+    if not _db_ready:
+        with _db_lock:
+            if not _db_ready:
+                init_jobs_db()
+                _db_ready = True
+
+def _dedupe_key(kind, payload):
+    canonical = json.dumps([kind, payload], ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def _loads(value):
+    return json.loads(value) if value else None
+
+# --- 提交与查询 ---
+
+_wake = threading.Event() # 本进程内提交任务时唤醒空闲的工作线程
+
+def submit_job(kind, data, priority=None, dedupe=True):
+    """提交任务
+
+    Args:
+        kind: 任务类型 (transcribe / analyze / 其他已注册类型)
+        data: 参数字典，只取该任务类型声明的字段
+        priority: 队列优先级 (数值越小越先执行)，默认使用任务类型的优先级
+        dedupe: 相同参数的任务仍在排队或运行时直接返回该任务
+
+    Returns:
+        (结果字典, 状态码)
+    """
+    job_type = JOB_KINDS.get(kind)
+    if job_type is None:
+        return {"error": f"不支持的任务类型: {kind}", "kinds": sorted(JOB_KINDS)}, 400
+    payload = {field: data.get(field) for field in job_type.fields if data.get(field) is not None}
+    if job_type.validate:
+        message = job_type.validate(payload)
+        if message:
+            return {"error": message}, 400
+
+    _ensure_db()
+    priority = job_type.priority if priority is None else int(priority)
+    dedupe_key = _dedupe_key(kind, payload) if dedupe else None
+    now = time.time()
+    conn = _get_connection()
+    conn.execute('BEGIN IMMEDIATE') # 查重与插入在同一写事务中，避免并发提交产生重复任务
+    try:
+        if dedupe_key:
+            row = conn.execute(
+                'SELECT id, status FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) LIMIT 1',
+                (dedupe_key,) + ACTIVE_STATUSES
+            ).fetchone()
+            if row:
+                conn.execute('COMMIT')
+                return {"job_id": row['id'], "status": row['status'], "deduplicated": True}, 202
+        job_id = secrets.token_hex(16)
+        conn.execute('''
+            INSERT INTO jobs (id, kind, payload, dedupe_key, status, priority, run_after, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (job_id, kind, json.dumps(payload, ensure_ascii=False), dedupe_key, STATUS_QUEUED, priority, now, now, now))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    _wake.set()
+    return {"job_id": job_id, "status": STATUS_QUEUED, "deduplicated": False}, 202
+
+def _job_view(row, include_result=True):
+    view = {
+        "job_id": row['id'],
+        "kind": row['kind'],
+        "status": row['status'],
+        "priority": row['priority'],
+        "attempts": row['attempts'],
+        "progress": _loads(row['progress']),
+        "error": row['error'],
+        "created_at": row['created_at'],
+        "started_at": row['started_at'],
+        "finished_at": row['finished_at'],
+    }
+    if include_result:
+        view["result"] = _loads(row['result'])
+    return view
+
+def _fetch_job(job_id):
+    _ensure_db()
+    return _get_connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+def get_job(job_id):
+    """查询任务状态、进度与结果，返回 (结果字典, 状态码)"""
+    row = _fetch_job(job_id)
+    if row is None:
+        return {"error": f"任务不存在: {job_id}"}, 404
+    return _job_view(row), 200
+
+def _parse_event_id(event_id):
+    """解析 Last-Event-ID ("执行次数:已发送字符数")，格式错误时返回 (None, 0)"""
+    try:
+        attempts, chars = (event_id or '').split(':')
+        return int(attempts), int(chars)
+    except ValueError:
+        return None, 0
+
+def iter_job_events(job_id, poll_interval=None, last_event_id=None):
+    """以 SSE 输出任务进度，任务结束时发送 done 事件
+
+    进度中的转录文本只发送新增部分 (delta)，事件 id 为 "执行次数:已发送字符数"；
+    连接保持 events_max_connection_seconds 后主动断开，浏览器带 Last-Event-ID 重连后从断点继续。
+    无法接续时 (首次连接、任务重试、落后超过 PROGRESS_TAIL_CHARS) 发送带 reset 标记的文本末尾，
+    落后过多时另带 truncated 标记，完整文本见 done 事件中的结果。
+    """
+    jobs_config = get_jobs_config()
+    poll_interval = poll_interval or jobs_config['poll_interval_seconds']
+    heartbeat_seconds = get_sse_config()['heartbeat_seconds']
+    close_at = time.monotonic() + jobs_config['events_max_connection_seconds']
+    sent_attempts, sent_chars = _parse_event_id(last_event_id)
+    last_version = None
+    last_sent = time.monotonic()
+    yield "retry: 1000\n\n" # 连接被主动断开后 1 秒重连
+    while True:
+        row = _fetch_job(job_id)
+        if row is None:
+            yield format_event({"error": f"任务不存在: {job_id}"}, event='error')
+            return
+        version = (row['status'], row['attempts'], row['updated_at'])
+        if version != last_version:
+            last_version = version
+            progress = _loads(row['progress']) or {}
+            event = {"status": row['status'], "attempts": row['attempts']}
+            tail = progress.pop('tail', None)
+            if tail is not None:
+                chars = progress['chars']
+                behind = chars - sent_chars
+                if sent_attempts == row['attempts'] and 0 <= behind <= len(tail):
+                    event['delta'] = tail[len(tail) - behind:]
+                else: # 客户端应替换而不是追加
+                    event['reset'], event['delta'] = True, tail
+                    if chars > len(tail):
+                        event['truncated'] = True
+                sent_attempts, sent_chars = row['attempts'], chars
+            if progress:
+                event['progress'] = progress
+            # 还没有发送过文本时不带 id (没有可以接续的位置)，浏览器保留上一次的 Last-Event-ID
+            event_id = f"{sent_attempts}:{sent_chars}" if sent_attempts is not None else None
+            yield format_event(event, event='progress', event_id=event_id)
+            last_sent = time.monotonic()
+        if row['status'] not in ACTIVE_STATUSES:
+            yield format_event(_job_view(row), event='done')
+            return
+        if time.monotonic() >= close_at:
+            return
+        if time.monotonic() - last_sent >= heartbeat_seconds:
+            yield ": ping\n\n" # 注释行，客户端会忽略
+            last_sent = time.monotonic()
+        time.sleep(poll_interval)
+
+def get_queue_stats():
+    """各状态的任务数"""
+    _ensure_db()
+    rows = _get_connection().execute('SELECT kind, status, COUNT(*) AS n FROM jobs GROUP BY kind, status').fetchall()
+    return [{"kind": row['kind'], "status": row['status'], "count": row['n']} for row in rows]
+
+@registry.register_collector
+def _collect_job_metrics():
+    """导出各类型、各状态的任务数 (/metrics)"""
+    if not _db_ready:
+        return []
+    samples = [({"kind": s['kind'], "status": s['status']}, s['count']) for s in get_queue_stats()]
+    return [("jobs", "gauge", "任务队列中各状态的任务数", samples)]
+
+# --- 执行 ---
+
+def _worker_alive(worker):
+    """worker 为 "主机名:pid:..."；同一主机上的进程已退出时返回 False，无法判断时返回 True"""
+    host, _, rest = (worker or '').partition(':')
+    pid = rest.partition(':')[0]
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def requeue_expired(jobs_config=None, include_dead_local=False):
+    """租约已过期 (或所属本机进程已退出) 的运行中任务重新排队，次数用尽的标记为失败；返回处理的任务数"""
+    jobs_config = jobs_config or get_jobs_config()
+    _ensure_db()
+    now = time.time()
+    conn = _get_connection()
+    rows = conn.execute(
+        'SELECT id, attempts, worker, lease_expires FROM jobs WHERE status = ?', (STATUS_RUNNING,)
+    ).fetchall()
+    handled = 0
+    for row in rows:
+        expired = (row['lease_expires'] or 0) < now
+        if not expired and not (include_dead_local and not _worker_alive(row['worker'])):
+            continue
+        if row['attempts'] >= jobs_config['max_attempts']:
+            cursor = conn.execute('''
+                UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_expires = NULL, finished_at = ?, updated_at = ?
+                WHERE id = ? AND status = ? AND worker IS ?
+            ''', (STATUS_FAILED, "执行进程中断，且已达到最大重试次数", now, now, row['id'], STATUS_RUNNING, row['worker']))
+        else:
+            cursor = conn.execute('''
+                UPDATE jobs SET status = ?, worker = NULL, lease_expires = NULL, run_after = ?, updated_at = ?
+                WHERE id = ? AND status = ? AND worker IS ?
+            ''', (STATUS_QUEUED, now, now, row['id'], STATUS_RUNNING, row['worker']))
+        handled += cursor.rowcount
+    if handled:
+        print(f"任务队列: {handled} 个中断的任务已重新排队或标记失败")
+    return handled
+
+def purge_finished(jobs_config=None):
+    """删除超过保留期的已结束任务，返回删除数"""
+    jobs_config = jobs_config or get_jobs_config()
+    _ensure_db()
+    cutoff = time.time() - jobs_config['result_ttl_seconds']
+    cursor = _get_connection().execute(
+        'DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?', (STATUS_SUCCEEDED, STATUS_FAILED, cutoff)
+    )
+    return cursor.rowcount
+
+class Job:
+    """正在执行的任务，传给任务处理函数"""
+
+    def __init__(self, row, pool):
+        self.id = row['id']
+        self.kind = row['kind']
+        self.payload = json.loads(row['payload'])
+        self.priority = row['priority']
+        self.attempts = row['attempts']
+        self.audio_folder = pool.audio_folder
+        self.script_dir = pool.script_dir
+        self._pool = pool
+        self._last_progress = 0.0
+
+    def progress(self, progress, force=False):
+        """记录进度 (dict)；按 progress_interval_seconds 节流写入数据库"""
+        now = time.monotonic()
+        if not force and now - self._last_progress < self._pool.progress_interval:
+            return
+        self._last_progress = now
+        _get_connection().execute(
+            'UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = ?',
+            (json.dumps(progress, ensure_ascii=False), time.time(), self.id, self._pool.worker_id, STATUS_RUNNING)
+        )
+
+class JobWorkerPool:
+    """一组工作线程：领取任务、执行、写回结果，并为运行中的任务续租"""
+
+    def __init__(self, audio_folder, script_dir, workers=None, jobs_config=None):
+        self.jobs_config = jobs_config or get_jobs_config()
+        self.audio_folder = audio_folder
+        self.script_dir = script_dir
+        self.workers = int(workers or self.jobs_config['workers'])
+        self.progress_interval = self.jobs_config['progress_interval_seconds']
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self._running = set()   # 本进程正在执行的任务 id (需要续租)
+        self._running_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_maintenance = 0.0
+
+    def start(self):
+        _ensure_db()
+        requeue_expired(self.jobs_config, include_dead_local=True) # 重启后立即恢复上次未完成的任务
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work_loop, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._lease_loop, name='job-lease', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        print(f"任务队列: 已启动 {self.workers} 个工作线程 ({self.worker_id})")
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        _wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _claim(self):
+        now = time.time()
+        row = _get_connection().execute('''
+            UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, lease_expires = ?,
+                started_at = ?, updated_at = ?, progress = NULL, error = NULL
+            WHERE id = (
+                SELECT id FROM jobs WHERE status = ? AND run_after <= ?
+                ORDER BY priority, created_at LIMIT 1
+            )
+            RETURNING *
+        ''', (STATUS_RUNNING, self.worker_id, now + self.jobs_config['lease_seconds'], now, now, STATUS_QUEUED, now)).fetchone()
+        if row is not None:
+            job_queue_wait_seconds.observe(max(now - row['run_after'], 0), kind=row['kind'])
+        return row
+
+    def _maintenance(self):
+        """定期回收过期租约、清理过期结果 (多个工作线程中只有一个执行)"""
+        now = time.monotonic()
+        if now - self._last_maintenance < self.jobs_config['lease_seconds'] / 2:
+            return
+        self._last_maintenance = now
+        try:
+            requeue_expired(self.jobs_config)
+            purge_finished(self.jobs_config)
+        except sqlite3.Error as e:
+            print(f"任务队列维护失败: {e}")
+
+    def _work_loop(self):
+        while not self._stop.is_set():
+            try:
+                self._maintenance()
+                row = self._claim()
+                if row is not None:
+                    self._execute(Job(row, self))
+            except Exception as e:
+                # 领取或写回结果失败 (如数据库繁忙) 时线程继续运行；未能写回的任务在租约到期后重新排队
+                print(f"任务工作线程出错: {e}")
+                import traceback
+                traceback.print_exc()
+                row = None
+            if row is None:
+                _wake.wait(self.jobs_config['poll_interval_seconds'])
+                _wake.clear()
+
+    def _lease_loop(self):
+        interval = max(self.jobs_config['lease_seconds'] / 3, 1)
+        while not self._stop.wait(interval):
+            with self._running_lock:
+                job_ids = list(self._running)
+            if not job_ids:
+                continue
+            try:
+                placeholders = ','.join('?' * len(job_ids))
+                _get_connection().execute(
+                    f'UPDATE jobs SET lease_expires = ? WHERE worker = ? AND status = ? AND id IN ({placeholders})',
+                    (time.time() + self.jobs_config['lease_seconds'], self.worker_id, STATUS_RUNNING, *job_ids)
+                )
+            except sqlite3.Error as e:
+                print(f"任务续租失败: {e}")
+
+    def _execute(self, job):
+        job_type = JOB_KINDS.get(job.kind)
+        with self._running_lock:
+            self._running.add(job.id)
+        start = time.perf_counter()
+        try:
+            if job_type is None:
+                outcome = ({"error": f"不支持的任务类型: {job.kind}"}, 400)
+            else:
+                outcome = job_type.handler(job)
+        except Exception as e:
+            print(f"执行任务 {job.id} ({job.kind}) 时发生未知错误: {e}")
+            import traceback
+            traceback.print_exc()
+            outcome = ({"error": f"任务执行失败: {str(e)}"}, 503) # 未知异常按暂时性错误重试
+        finally:
+            with self._running_lock:
+                self._running.discard(job.id)
+        job_run_seconds.observe(time.perf_counter() - start, kind=job.kind)
+        self._finish(job, *outcome)
+
+    def _finish(self, job, result, status_code, headers=None):
+        now = time.time()
+        conn = _get_connection()
+        guard = (job.id, self.worker_id, STATUS_RUNNING) # 租约已被回收 (任务已被其他进程领取) 时不覆盖
+        if status_code < 400:
+            conn.execute('''
+                UPDATE jobs SET status = ?, result = ?, worker = NULL, lease_expires = NULL, finished_at = ?, updated_at = ?
+                WHERE id = ? AND worker = ? AND status = ?
+            ''', (STATUS_SUCCEEDED, json.dumps(result, ensure_ascii=False), now, now) + guard)
+            jobs_finished.inc(kind=job.kind, result='succeeded')
+            return
+
+        error = (result or {}).get('error') or f"状态码 {status_code}"
+        if status_code in RETRYABLE_STATUSES and job.attempts < self.jobs_config['max_attempts']:
+            retry_after = (headers or {}).get('Retry-After')
+            delay = float(retry_after) if retry_after else \
+                self.jobs_config['retry_backoff_seconds'] * 2 ** (job.attempts - 1)
+            conn.execute('''
+                UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_expires = NULL, run_after = ?, updated_at = ?
+                WHERE id = ? AND worker = ? AND status = ?
+            ''', (STATUS_QUEUED, error, now + delay, now) + guard)
+            jobs_finished.inc(kind=job.kind, result='retry')
+            print(f"任务 {job.id} ({job.kind}) 第 {job.attempts} 次执行失败，{delay:.0f} 秒后重试: {error}")
+            return
+
+        conn.execute('''
+            UPDATE jobs SET status = ?, error = ?, result = ?, worker = NULL, lease_expires = NULL, finished_at = ?, updated_at = ?
+            WHERE id = ? AND worker = ? AND status = ?
+        ''', (STATUS_FAILED, error, json.dumps(result, ensure_ascii=False), now, now) + guard)
+        jobs_finished.inc(kind=job.kind, result='failed')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def start_job_workers(audio_folder, script_dir, workers=None):
+    """启动本进程的任务工作线程 (重复调用返回同一个线程池)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = JobWorkerPool(audio_folder, script_dir, workers).start()
+        return _pool
+
+# --- 内置任务类型 ---
+
+def _validate_transcribe(payload):
+    if not is_valid_object_name(payload.get('object_name')):
+        return "缺少或非法的 object_name 参数"
+    if payload.get('model') not in get_model_list():
+        return f"不支持的模型: {payload.get('model')}"
+    return None
+
+@job_kind('transcribe', PRIORITY_TRANSCRIPTION, ('object_name', 'model', 'segmented'), _validate_transcribe)
+def run_transcribe_job(job):
+    """转录音频；进度为已输出的字符数和文本末尾，结果为 {"transcription_text": ...}"""
+    payload = job.payload
+    stream = open_transcription(job.audio_folder, job.script_dir, payload['object_name'], payload['model'],
+                                segmented=payload.get('segmented'))
+    if isinstance(stream, tuple): # (错误字典, 状态码[, 响应头])
+        return stream
+    parts, chars, tail = [], 0, ''
+    for chunk in stream:
+        if chunk.startswith(STREAM_ERROR_PREFIX): # 上游在流中途失败，按暂时性错误重试 (已完成的转录会被缓存)
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+            return {"error": chunk[len(STREAM_ERROR_PREFIX):].strip()}, 503
+        parts.append(chunk)
+        chars += len(chunk)
+        tail = (tail + chunk)[-PROGRESS_TAIL_CHARS:]
+        job.progress({"chars": chars, "tail": tail})
+    job.progress({"chars": chars, "tail": tail}, force=True)
+    text = ''.join(parts)
+    return {"object_name": payload['object_name'], "transcription_text": text}, 200
+
+def _validate_analyze(payload):
+    if not payload.get('object_name'):
+        return "缺少 object_name 参数"
+    if not payload.get('transcription_text'):
+        return "缺少 transcription_text 参数"
+    return None
+
+@job_kind('analyze', PRIORITY_INTERACTIVE, ('object_name', 'transcription_text'), _validate_analyze)
+def run_analyze_job(job):
+    """举报信息分析；结果与 /api/analyze-report 的响应相同"""
+    payload = job.payload
+    return run_report_analysis(job.script_dir, payload['object_name'], payload['transcription_text'],
+                               priority=job.priority)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['worker', 'stats', 'purge'])
+    parser.add_argument('--audio-folder', default=None, help='音频根目录，默认 backend/audio_files')
+    parser.add_argument('--workers', type=int, default=None, help='工作线程数，默认使用配置')
+    args = parser.parse_args()
+    import backend.batch_ingest # 注册 ingest 任务类型 (该模块依赖本模块，不能在顶部导入)
+
+    if args.command == 'stats':
+        print(json.dumps(get_queue_stats(), ensure_ascii=False, indent=2))
+        return
+    if args.command == 'purge':
+        print(f"已删除 {purge_finished()} 个过期任务")
+        return
+
+    audio_folder = args.audio_folder or os.path.join(get_script_dir(), 'audio_files')
+    pool = start_job_workers(audio_folder, get_script_dir(), args.workers)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("正在停止任务进程...")
+        pool.stop(timeout=5)
+
+if __name__ == '__main__':
+    main()
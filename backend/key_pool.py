@@ -0,0 +1,187 @@
+# backend/key_pool.py
+import os
+import json
+import time
+import atexit
+import itertools
+import threading
+
+class KeyPool:
+    """内存中的 API key 轮换池
+
+    - key 列表只在 api.txt 的 mtime 变化时重新加载，以不可变元组整体替换
+    - 选择 key 时不加锁：轮询位置依赖 itertools.count 的原子自增
+    - 返回 429 的 key 按 (模型, key) 进入冷却期，冷却期内被跳过
+    - 每个 key 的使用次数只在内存中累加，可按批次刷写到磁盘
+    - 选项可通过 configure() 在运行中修改 (ai.json 中的 key_pool 配置修改后无需重启)
+    """
+
+    def __init__(self, api_path, stats_path=None, strategy='round_robin',
+                 cooldown_seconds=60.0, reload_interval=2.0, flush_every=0):
+        self.api_path = api_path
+        self.stats_path = stats_path
+        self.options = None      # get_key_pool 最近一次传入的选项
+        self._flush_at_exit = False
+        self._next_check = 0.0
+        self.configure(strategy, cooldown_seconds, reload_interval, flush_every)
+
+        self._keys = ()          # 当前 key 列表快照 (不可变，整体替换)
+        self._mtime = None
+        self._reload_lock = threading.Lock() # 仅用于重新加载文件，选择路径不加锁
+        self._flush_lock = threading.Lock()  # 同一进程内的 flush 依次写入
+        self._cursors = {}       # model_name -> itertools.count()
+        self._cooldown = {}      # (model_name, key) -> 冷却结束时间 (monotonic)
+        self._uses = {}          # (model_name, key) -> itertools.count(1)
+        self._use_counts = {}    # (model_name, key) -> 最近一次计数值
+        self._rate_limited = {}  # (model_name, key) -> 累计 429 次数
+        self._total = itertools.count(1)
+
+        self._reload(force=True)
+
+    def configure(self, strategy='round_robin', cooldown_seconds=60.0, reload_interval=2.0, flush_every=0):
+        """应用选项；已进入冷却期的 key 保持原来的冷却结束时间"""
+        self.strategy = strategy
+        self.cooldown_seconds = float(cooldown_seconds)
+        self.reload_interval = float(reload_interval)
+        self.flush_every = int(flush_every or 0)
+        # 检查间隔缩短时不必等到按旧间隔安排的下一次检查
+        self._next_check = min(self._next_check, time.monotonic() + self.reload_interval)
+        if self.flush_every and not self._flush_at_exit:
+            self._flush_at_exit = True
+            atexit.register(self.flush)
+
+    # --- key 列表加载 ---
+
+    def _reload(self, force=False):
+        """在 api.txt 变化时重新加载 key 列表"""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        with self._reload_lock:
+            if not force and now < self._next_check:
+                return
+            self._next_check = now + self.reload_interval
+            try:
+                mtime = os.stat(self.api_path).st_mtime_ns
+            except FileNotFoundError:
+                if self._keys:
+                    print(f"警告: {self.api_path} 不存在，继续使用已加载的 {len(self._keys)} 个 key")
+                return
+            if mtime == self._mtime:
+                return
+            with open(self.api_path, 'r', encoding='utf-8') as f:
+                keys = tuple(line.strip() for line in f if line.strip())
+            self._keys = keys
+            self._mtime = mtime
+            print(f"已加载 {len(keys)} 个 API key: {self.api_path}")
+
+    def keys(self):
+        """返回当前 key 列表快照"""
+        self._reload()
+        return self._keys
+
+    # --- key 选择 ---
+
+    def _cursor(self, model_name):
+        cursor = self._cursors.get(model_name)
+        if cursor is None:
+            # setdefault 是原子操作，并发首次访问时只会保留一个计数器
+            cursor = self._cursors.setdefault(model_name, itertools.count())
+        return cursor
+
+    def _use_count(self, model_name, key):
+        return self._use_counts.get((model_name, key), 0)
+
+    def get_key(self, model_name):
+        """为指定模型选择一个可用的 key"""
+        keys = self.keys()
+        if not keys:
+            raise RuntimeError(f"API key 列表为空: {self.api_path}")
+
+        now = time.monotonic()
+        available = [k for k in keys if self._cooldown.get((model_name, k), 0) <= now]
+        if not available:
+            # 全部处于冷却期时，选择最早解除冷却的 key
+            key = min(keys, key=lambda k: self._cooldown.get((model_name, k), 0))
+        elif self.strategy == 'least_used':
+            start = next(self._cursor(model_name))
+            # 从轮询位置开始找使用次数最少的 key，次数相同时依次轮换
+            ordered = [available[(start + i) % len(available)] for i in range(len(available))]
+            key = min(ordered, key=lambda k: self._use_count(model_name, k))
+        else:
+            key = available[next(self._cursor(model_name)) % len(available)]
+
+        self._record_use(model_name, key)
+        return key
+
+    # --- 使用统计与冷却 ---
+
+    def _record_use(self, model_name, key):
+        uses = self._uses.get((model_name, key))
+        if uses is None:
+            uses = self._uses.setdefault((model_name, key), itertools.count(1))
+        self._use_counts[(model_name, key)] = next(uses)
+        total = next(self._total)
+        if self.flush_every and total % self.flush_every == 0:
+            self.flush()
+
+    def report_rate_limited(self, model_name, key, retry_after=None):
+        """标记 key 在指定模型上返回了 429，进入冷却期"""
+        try:
+            seconds = float(retry_after) if retry_after is not None else self.cooldown_seconds
+        except (TypeError, ValueError):
+            seconds = self.cooldown_seconds
+        self._cooldown[(model_name, key)] = time.monotonic() + seconds
+        self._rate_limited[(model_name, key)] = self._rate_limited.get((model_name, key), 0) + 1
+        print(f"API key ...{key[-6:]} 在模型 {model_name} 上被限流，冷却 {seconds:.0f} 秒")
+
+    def stats(self):
+        """返回每个 key 的使用统计 (key 仅保留末尾 6 位)"""
+        now = time.monotonic()
+        result = {}
+        for (model_name, key), count in list(self._use_counts.items()):
+            result.setdefault(model_name, {})[f"...{key[-6:]}"] = {
+                "uses": count,
+                "rate_limited": self._rate_limited.get((model_name, key), 0),
+                "cooldown_remaining": max(0.0, round(self._cooldown.get((model_name, key), 0) - now, 1))
+            }
+        return result
+
+    def flush(self):
+        """将使用统计写入磁盘 (先写临时文件再原子替换)
+
+        临时文件名包含进程和线程号：多个工作进程写同一个 stats_path 时不会互相覆盖临时文件。
+        """
+        if not self.stats_path:
+            return
+        tmp_path = f"{self.stats_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._flush_lock:
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.stats(), f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.stats_path)
+            except OSError as e:
+                print(f"写入 key 使用统计失败: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_key_pool(api_path, **options):
+    """获取 api_path 对应的进程级 KeyPool (首次调用时创建)；options 与上次不同时应用到已有的池"""
+    pool = _pools.get(api_path)
+    if pool is None or pool.options != options:
+        with _pools_lock:
+            pool = _pools.get(api_path)
+            if pool is None:
+                pool = KeyPool(api_path, **options)
+                pool.options = options
+                _pools[api_path] = pool
+            elif pool.options != options:
+                print(f"key 轮换池选项已更新: {options}")
+                pool.configure(**{k: v for k, v in options.items() if k != 'stats_path'})
+                pool.options = options
+    return pool
@@ -2,8 +2,22 @@
 import openai
 import json
 from backend.config import get_model_config # 从 config 模块导入模型配置获取函数
+from backend.client_pool import get_client, get_async_client # 复用进程级 OpenAI 客户端
+from backend.rate_limit import acquire_upstream, acquire_upstream_async, UpstreamRateLimitExceeded # 多进程共享的上游令牌桶
+from backend.sse import compact_delta, coalesce_sse, coalesce_sse_async
+from backend.stream_log import StreamLog # 采样、非阻塞的流式日志与首 token 指标
+from backend.metrics import upstream_errors
 
-def query_llm(model_name, prompt, msg):
+def _delta_text(delta):
+    """delta 中的输出文本 (含推理内容)，用于统计 token 速率"""
+    return (delta.content or '') + (getattr(delta, 'reasoning_content', None) or '')
+
+def query_llm(model_name, prompt, msg, sse=False):
+    """流式查询 LLM
+
+    sse 为 False 时每个 delta 输出一行完整 JSON (NDJSON)；
+    为 True 时输出 SSE 事件流，只包含有值的字段并按窗口合并 token (见 backend/sse.py)。
+    """
     try:
         md = get_model_config(model_name)
         if not md:
@@ -16,10 +30,9 @@ def query_llm(model_name, prompt, msg):
         if md.get('json_format') is False:
             response_format = None
 
-        client = openai.OpenAI(
-            api_key=md['api_key'],
-            base_url=md['base_url']
-        )
+        acquire_upstream(md) # 共享令牌桶，等待超时抛出 UpstreamRateLimitExceeded
+        stream_log = StreamLog('query_llm', model_name)
+        client = get_client(md['api_key'], md['base_url'])
         response = client.chat.completions.create(
             model=md['model'],
             messages=[
@@ -30,27 +43,118 @@ def query_llm(model_name, prompt, msg):
             response_format=response_format
         )
 
+        if sse:
+            def frames():
+                try:
+                    for chunk in response:
+                        if chunk.choices and chunk.choices[0].delta:
+                            stream_log.chunk(_delta_text(chunk.choices[0].delta))
+                            yield compact_delta(chunk.choices[0].delta)
+                    stream_log.finish()
+                except Exception as e:
+                    stream_log.finish(error=e)
+                    raise
+                finally:
+                    response.close()
+            return coalesce_sse(frames())
+
         # 生成器函数，用于流式返回
         def generate():
             try:
                 for chunk in response:
                     delta = chunk.choices[0].delta
                     if delta: # 确保 delta 不为 None
+                        stream_log.chunk(_delta_text(delta))
                         # 将 delta 对象转换为 JSON 字符串并返回
                         yield json.dumps(delta.model_dump()) + '\n'
+                stream_log.finish()
             except Exception as e:
-                print(f"流式生成过程中出错: {e}")
+                stream_log.finish(error=e)
                 # 在流中产生错误信息
                 yield json.dumps({"error": "流式生成过程中出错"}) + '\n'
 
         return generate() # 返回生成器
 
+    except UpstreamRateLimitExceeded as e:
+        print(f"等待上游令牌超时: {e}")
+        return {"error": str(e)}, 429
     except openai.OpenAIError as e:
         print(f"OpenAI API 错误: {e}")
+        upstream_errors.inc(model=model_name, kind=type(e).__name__)
         return {"error": "AI模型API调用失败"}, 500 # 返回错误字典和状态码
     except KeyError as e:
         print(f"配置错误: 模型 '{model_name}' 配置中缺少键 {e}")
         return {"error": f"模型 '{model_name}' 配置不完整"}, 500 # 返回错误字典和状态码
     except Exception as e:
         print(f"查询 LLM 时发生未知错误: {e}")
-        return {"error": "查询 LLM 时发生未知错误"}, 500 # 返回错误字典和状态码
\ No newline at end of file
+        return {"error": "查询 LLM 时发生未知错误"}, 500 # 返回错误字典和状态码
+
+async def query_llm_async(model_name, prompt, msg, sse=False):
+    """query_llm 的异步版本 (ASGI 模式)，返回异步生成器或 (错误字典, 状态码)"""
+    try:
+        md = get_model_config(model_name)
+        if not md:
+            print(f"错误: 未找到模型 '{model_name}' 的配置。")
+            return {"error": f"模型配置未找到: {model_name}"}, 400
+
+        response_format = {'type': 'json_object'} if 'json' in prompt else None
+        if md.get('json_format') is False:
+            response_format = None
+
+        await acquire_upstream_async(md)
+        stream_log = StreamLog('query_llm', model_name)
+        client = get_async_client(md['api_key'], md['base_url'])
+        response = await client.chat.completions.create(
+            model=md['model'],
+            messages=[
+                {"role": "user", "content": prompt},
+                {"role": "user", "content": msg}
+            ],
+            stream=True,
+            response_format=response_format
+        )
+
+        if sse:
+            async def frames():
+                try:
+                    async for chunk in response:
+                        if chunk.choices and chunk.choices[0].delta:
+                            stream_log.chunk(_delta_text(chunk.choices[0].delta))
+                            yield compact_delta(chunk.choices[0].delta)
+                    stream_log.finish()
+                except Exception as e:
+                    stream_log.finish(error=e)
+                    raise
+                finally:
+                    await response.close()
+            return coalesce_sse_async(frames())
+
+        async def generate():
+            try:
+                async for chunk in response:
+                    delta = chunk.choices[0].delta
+                    if delta:
+                        stream_log.chunk(_delta_text(delta))
+                        yield json.dumps(delta.model_dump()) + '\n'
+                stream_log.finish()
+            except Exception as e:
+                stream_log.finish(error=e)
+                yield json.dumps({"error": "流式生成过程中出错"}) + '\n'
+            finally:
+                await response.close()
+
+        return generate()
+
+    except UpstreamRateLimitExceeded as e:
+        print(f"等待上游令牌超时: {e}")
+        return {"error": str(e)}, 429
+    except openai.OpenAIError as e:
+        print(f"OpenAI API 错误: {e}")
+        upstream_errors.inc(model=model_name, kind=type(e).__name__)
+        return {"error": "AI模型API调用失败"}, 500
+    except KeyError as e:
+        print(f"配置错误: 模型 '{model_name}' 配置中缺少键 {e}")
+        return {"error": f"模型 '{model_name}' 配置不完整"}, 500
+    except Exception as e:
+        print(f"查询 LLM 时发生未知错误: {e}")
+        return {"error": "查询 LLM 时发生未知错误"}, 500
\ No newline at end of file
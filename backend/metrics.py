@@ -0,0 +1,214 @@
+# backend/metrics.py
+"""进程内指标，按 Prometheus 文本格式 (0.0.4) 输出，由 /metrics 路由暴露
+
+不依赖 prometheus_client：指标数量很少，计数器和直方图都只是加锁的字典。
+多 worker 部署时每个进程各自输出，由抓取端按实例汇总。
+"""
+import time
+import bisect
+import functools
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 默认直方图桶 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """上下文管理器：记录代码块耗时"""
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            items = [(k, (list(counts), total, count)) for k, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """注册采集回调：collector() 返回 [(name, type, help, [(labels_dict, value), ...]), ...]，
+        用于导出已有模块自己维护的统计 (缓存命中、准入队列等)"""
+        self._collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"采集指标时出错 ({getattr(collector, '__name__', collector)}): {e}")
+                continue
+            for name, type_name, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# --- 指标定义 ---
+
+http_request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', '按路由统计的请求耗时 (流式响应统计到响应体发送完毕)',
+    ('route', 'method', 'status')
+))
+llm_time_to_first_token = registry.register(Histogram(
+    'llm_time_to_first_token_seconds', '发起上游调用到收到第一个 token 的时间', ('path', 'model')
+))
+llm_tokens_per_second = registry.register(Histogram(
+    'llm_tokens_per_second', '首个 token 之后的输出速率 (以流式分块计)', ('path', 'model'), buckets=RATE_BUCKETS
+))
+llm_stream_chunks = registry.register(Counter(
+    'llm_stream_chunks_total', '上游流式输出的分块数', ('path', 'model')
+))
+llm_stream_chars = registry.register(Counter(
+    'llm_stream_chars_total', '上游流式输出的字符数', ('path', 'model')
+))
+db_query_duration = registry.register(Histogram(
+    'db_query_duration_seconds', '报告数据库查询耗时', ('query',)
+))
+upstream_errors = registry.register(Counter(
+    'upstream_errors_total', '上游模型调用错误次数', ('model', 'kind')
+))
+upstream_retries = registry.register(Counter(
+    'upstream_retries_total', '上游模型调用重试次数', ('model',)
+))
+
+def timed_db(query_name):
+    """装饰数据库查询函数，记录耗时"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with db_query_duration.time(query=query_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class StreamTimer:
+    """统计一次流式调用的首 token 时间和输出速率
+
+    在发起上游调用前创建，每收到一块调用 chunk()，流结束时调用 finish()。
+    """
+
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        self.start = time.perf_counter()
+        self.first_at = None
+        self.chunks = 0
+        self.chars = 0
+
+    def chunk(self, text):
+        if self.first_at is None:
+            self.first_at = time.perf_counter()
+            llm_time_to_first_token.observe(self.first_at - self.start, path=self.path, model=self.model)
+        self.chunks += 1
+        self.chars += len(text or '')
+
+    def finish(self):
+        llm_stream_chunks.inc(self.chunks, path=self.path, model=self.model)
+        llm_stream_chars.inc(self.chars, path=self.path, model=self.model)
+        if self.first_at is not None and self.chunks > 1:
+            elapsed = time.perf_counter() - self.first_at
+            if elapsed > 0:
+                llm_tokens_per_second.observe((self.chunks - 1) / elapsed, path=self.path, model=self.model)
+        return time.perf_counter() - self.start
+
+def render_metrics():
+    """返回 Prometheus 文本格式的全部指标"""
+    return registry.render()
@@ -0,0 +1,221 @@
+# backend/rate_limit.py
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from limits.storage import Storage
+from backend.config import get_config, get_script_dir # 从 config 模块导入
+
+# ai.json 中用于限流配置的保留键
+RATE_LIMIT_CONFIG_KEY = 'rate_limit'
+
+DEFAULT_RATE_LIMIT_CONFIG = {
+    # Flask-Limiter 计数器存储：memory:// 为单进程；多进程/多 worker 部署时使用共享存储，
+    # 如 sqlite:///rate_limit.db (同一台机器) 或 redis://host:6379 (多台机器)
+    "storage_uri": "memory://",
+    "upstream": {
+        "rate_per_second": 0,      # 所有进程共享的上游调用速率 (令牌/秒)，0 表示不限制
+        "burst": 10,               # 令牌桶容量
+        "max_wait_seconds": 10,    # 取不到令牌时最多等待的时长，超时返回 429
+        "per_model": {},           # 按模型单独限制，如 {"gemini-2.5-flash": {"rate_per_second": 2, "burst": 5}}
+    },
+}
+
+RATE_LIMIT_DATABASE_FILE = os.path.join(get_script_dir(), 'rate_limit.db')
+
+def get_rate_limit_config():
+    """返回合并默认值后的限流配置"""
+    user_config = get_config().get(RATE_LIMIT_CONFIG_KEY) or {}
+    rate_limit_config = dict(DEFAULT_RATE_LIMIT_CONFIG)
+    rate_limit_config.update(user_config)
+    rate_limit_config['upstream'] = {**DEFAULT_RATE_LIMIT_CONFIG['upstream'], **(user_config.get('upstream') or {})}
+    return rate_limit_config
+
+def get_storage_uri():
+    """Flask-Limiter 使用的存储 URI，环境变量 RATELIMIT_STORAGE_URI 优先"""
+    return os.environ.get('RATELIMIT_STORAGE_URI') or get_rate_limit_config()['storage_uri']
+
+# --- 共享 SQLite 存储 ---
+
+_local = threading.local()
+
+def _get_connection(db_path):
+    """获取当前线程指定数据库文件的连接 (autocommit，事务由调用方显式开启)"""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS limiter_counters (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS token_buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        connections[db_path] = conn
+    return conn
+
+def _resolve_db_path(uri):
+    """sqlite:///rate_limit.db 相对于 backend 目录，sqlite:////abs/path.db 为绝对路径"""
+    path = uri.split('://', 1)[1]
+    path = path[1:] if path.startswith('/') else path
+    if not path:
+        return RATE_LIMIT_DATABASE_FILE
+    return path if os.path.isabs(path) else os.path.join(get_script_dir(), path)
+
+class SQLiteStorage(Storage):
+    """Flask-Limiter (limits) 的 SQLite 存储，同一台机器上的多个进程共享计数器
+
+    使用方式：storage_uri="sqlite:///rate_limit.db"。计数器使用墙钟时间过期，
+    每次自增是一条 UPSERT 语句，多进程并发时由 SQLite 的写锁保证原子性。
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.db_path = _resolve_db_path(uri or 'sqlite://')
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _conn(self):
+        return _get_connection(self.db_path)
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        row = self._conn().execute('''
+            INSERT INTO limiter_counters (key, value, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = CASE WHEN expires_at <= ? THEN excluded.value ELSE value + excluded.value END,
+                expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END
+            RETURNING value
+        ''', (key, amount, now + expiry, now, now)).fetchone()
+        return row[0]
+
+    def get(self, key):
+        row = self._conn().execute(
+            'SELECT value FROM limiter_counters WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._conn().execute(
+            'SELECT expires_at FROM limiter_counters WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self._conn().execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._conn().execute('DELETE FROM limiter_counters').rowcount
+
+    def clear(self, key):
+        self._conn().execute('DELETE FROM limiter_counters WHERE key = ?', (key,))
+
+# --- 上游调用令牌桶 ---
+
+class UpstreamRateLimitExceeded(ValueError):
+    """等待令牌超时；沿用 ValueError 表示 "请求频率过高" 的约定 (路由映射为 429)"""
+
+    def __init__(self, bucket_name, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"上游调用频率超出限制 ({bucket_name})，请在 {retry_after:.1f} 秒后重试")
+
+class TokenBucket:
+    """存放在 SQLite 中的令牌桶，同一台机器上的所有进程共享同一份预算"""
+
+    def __init__(self, name, rate_per_second, burst, db_path=RATE_LIMIT_DATABASE_FILE):
+        self.name = name
+        self.rate = float(rate_per_second)
+        self.burst = float(burst)
+        self.db_path = db_path
+
+    def try_acquire(self, tokens=1):
+        """尝试取出令牌，成功返回 0，否则返回需要等待的秒数"""
+        conn = _get_connection(self.db_path)
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE') # 读-改-写期间持有写锁，避免多个进程取到同一个令牌
+        try:
+            row = conn.execute('SELECT tokens, updated_at FROM token_buckets WHERE name = ?', (self.name,)).fetchone()
+            available = self.burst if row is None else min(self.burst, row[0] + max(now - row[1], 0) * self.rate)
+            if available >= tokens:
+                available -= tokens
+                wait = 0.0
+            else:
+                wait = (tokens - available) / self.rate
+            conn.execute(
+                'INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)',
+                (self.name, available, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def acquire(self, max_wait_seconds, tokens=1):
+        """等待并取出令牌，超过 max_wait_seconds 仍取不到时抛出 UpstreamRateLimitExceeded"""
+        deadline = time.monotonic() + max_wait_seconds
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise UpstreamRateLimitExceeded(self.name, wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, max_wait_seconds, tokens=1):
+        """acquire 的异步版本：只有短暂的 SQLite 读写放到线程中，等待令牌时挂起协程而不占用线程"""
+        deadline = time.monotonic() + max_wait_seconds
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, tokens)
+            if wait <= 0:
+                return
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise UpstreamRateLimitExceeded(self.name, wait)
+            await asyncio.sleep(wait)
+
+def _upstream_buckets(model_name):
+    upstream = get_rate_limit_config()['upstream']
+    buckets = []
+    model_limit = (upstream.get('per_model') or {}).get(model_name)
+    if model_limit and model_limit.get('rate_per_second'):
+        buckets.append(TokenBucket(
+            f"model:{model_name}", model_limit['rate_per_second'], model_limit.get('burst', upstream['burst'])
+        ))
+    if upstream['rate_per_second']:
+        buckets.append(TokenBucket("global", upstream['rate_per_second'], upstream['burst']))
+    return buckets, upstream['max_wait_seconds']
+
+def acquire_upstream(model_config):
+    """调用上游模型前取令牌；未配置上游限流时立即返回"""
+    buckets, max_wait_seconds = _upstream_buckets(model_config.get('model'))
+    for bucket in buckets:
+        bucket.acquire(max_wait_seconds)
+
+async def acquire_upstream_async(model_config):
+    """acquire_upstream 的异步版本"""
+    buckets, max_wait_seconds = _upstream_buckets(model_config.get('model'))
+    for bucket in buckets:
+        await bucket.acquire_async(max_wait_seconds)
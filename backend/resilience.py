@@ -0,0 +1,234 @@
+# backend/resilience.py
+import time
+import random
+import asyncio
+import threading
+import openai
+from backend.config import get_config, get_gemini_config, report_rate_limited # 从 config 模块导入
+from backend.rate_limit import UpstreamRateLimitExceeded
+from backend.admission import AdmissionRejected
+from backend.metrics import registry, upstream_errors, upstream_retries
+
+# ai.json 中用于重试与故障转移配置的保留键
+RESILIENCE_CONFIG_KEY = 'resilience'
+
+DEFAULT_RESILIENCE_CONFIG = {
+    "max_attempts": 4,                # 单次请求最多尝试的次数 (含故障转移)
+    "attempts_per_model": 2,          # 同一模型失败多少次后切换到备用模型
+    "base_delay_seconds": 0.5,        # 指数退避的基准时长
+    "max_delay_seconds": 8,           # 单次退避的上限
+    "breaker_failure_threshold": 5,   # 端点连续失败多少次后熔断
+    "breaker_reset_seconds": 30,      # 熔断多久后放行一次试探请求
+    "fallback_models": {},            # 备用模型，如 {"gemini-2.5-flash-preview-04-17": ["gemini-2.0-flash"]}
+}
+
+def get_resilience_config():
+    """返回合并默认值后的重试与故障转移配置"""
+    resilience_config = dict(DEFAULT_RESILIENCE_CONFIG)
+    resilience_config.update(get_config().get(RESILIENCE_CONFIG_KEY) or {})
+    return resilience_config
+
+class UpstreamStatusError(RuntimeError):
+    """上游返回错误状态码；沿用 RuntimeError 的约定 (路由映射为 500)，附带状态码供重试判断"""
+
+    def __init__(self, message, status_code):
+        self.status_code = status_code
+        super().__init__(message)
+
+class UpstreamRateLimited(ValueError):
+    """上游返回 429；沿用 ValueError 的约定 (路由映射为 429)，换 key 后可以重试"""
+
+def _is_server_error(status_code):
+    return status_code is not None and (status_code >= 500 or status_code == 408)
+
+def classify_error(error):
+    """返回 (是否可重试, 对端点熔断器的影响: 'failure' / 'success' / None)
+
+    连接失败和 5xx 说明端点本身有问题，计入熔断；429 和 4xx 说明端点可达，
+    其中 429 只与当前 key 有关，换 key 重试即可。
+    本地限流 (UpstreamRateLimitExceeded) 和准入拒绝没有到达上游，不重试也不影响熔断。
+    """
+    if isinstance(error, (UpstreamRateLimitExceeded, AdmissionRejected)):
+        return False, None
+    if isinstance(error, openai.RateLimitError):
+        return True, 'success'
+    if isinstance(error, openai.APIConnectionError): # 包含 APITimeoutError
+        return True, 'failure'
+    if isinstance(error, (openai.APIStatusError, UpstreamStatusError)):
+        if _is_server_error(error.status_code):
+            return True, 'failure'
+        return False, 'success'
+    if isinstance(error, ConnectionError):
+        return True, 'failure'
+    if isinstance(error, UpstreamRateLimited): # 上游 429 (其他 ValueError 是请求本身的问题，不重试)
+        return True, 'success'
+    return False, None
+
+class CircuitBreaker:
+    """单个端点 (base_url, 模型) 的熔断器
+
+    连续失败达到阈值后熔断 reset_seconds 秒，期间直接跳过该端点；
+    到期后放行一次试探请求，成功则恢复，失败则重新熔断。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def allow(self, reset_seconds):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < reset_seconds:
+                return False
+            self._probing = True # 半开：只放行一个试探请求
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f"熔断器恢复: {self.name}")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self, threshold):
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= threshold):
+                print(f"熔断器打开: {self.name} (连续失败 {self._failures} 次)")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """试探请求未到达上游时归还试探机会，不改变熔断状态"""
+        with self._lock:
+            self._probing = False
+
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._probing else "open"
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(model_config):
+    """获取模型配置对应端点的熔断器"""
+    name = f"{model_config.get('base_url')}#{model_config.get('model')}"
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+def get_breaker_states():
+    """返回所有端点的熔断状态"""
+    return {name: breaker.state() for name, breaker in list(_breakers.items())}
+
+_BREAKER_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+@registry.register_collector
+def _collect_breaker_metrics():
+    """导出熔断器状态 (/metrics)：0 关闭，1 半开，2 打开"""
+    return [("upstream_circuit_state", "gauge", "上游端点熔断状态 (0 关闭，1 半开，2 打开)", [
+        ({"endpoint": name}, _BREAKER_STATE_VALUES[state]) for name, state in get_breaker_states().items()
+    ])]
+
+class _Failover:
+    """一次请求的重试状态：决定每次尝试使用的模型配置以及失败后的等待时长"""
+
+    def __init__(self, model_name, resolve_config):
+        self.config = get_resilience_config()
+        self.candidates = [model_name] + list((self.config.get('fallback_models') or {}).get(model_name) or [])
+        self.resolve_config = resolve_config
+        self.attempt = 0
+        self.current = model_name
+        self.model_failures = {}  # 候选模型名称 -> 失败次数
+
+    def next_config(self, last_error=None):
+        """返回下一次尝试的模型配置 (每次都重新解析，从 key 池中取新的 key)"""
+        for candidate in self.candidates:
+            if self.model_failures.get(candidate, 0) >= self.config['attempts_per_model'] and candidate != self.candidates[-1]:
+                continue
+            model_config = self.resolve_config(candidate)
+            if not model_config:
+                continue
+            if get_breaker(model_config).allow(self.config['breaker_reset_seconds']):
+                self.attempt += 1
+                self.current = candidate
+                if candidate != self.candidates[0]:
+                    print(f"故障转移: {self.candidates[0]} -> {candidate}")
+                return model_config
+        if last_error is not None:
+            raise last_error
+        raise ConnectionError(f"上游服务暂时不可用 (熔断中): {', '.join(self.candidates)}")
+
+    def failed(self, model_config, error):
+        """记录失败，返回重试前应等待的秒数；不可重试或次数用尽时重新抛出 error"""
+        retryable, outcome = classify_error(error)
+        if outcome is not None: # 只统计到达上游的错误
+            upstream_errors.inc(model=model_config.get('model'), kind=getattr(error, 'status_code', None) or type(error).__name__)
+        breaker = get_breaker(model_config)
+        if outcome == 'failure':
+            breaker.record_failure(self.config['breaker_failure_threshold'])
+        elif outcome == 'success':
+            breaker.record_success() # 端点可达，只是当前 key 被限流或请求本身有误
+        else:
+            breaker.release_probe()
+        if isinstance(error, openai.RateLimitError):
+            report_rate_limited(model_config, error.response.headers.get('retry-after'))
+        if not retryable or self.attempt >= self.config['max_attempts']:
+            raise error
+        self.model_failures[self.current] = self.model_failures.get(self.current, 0) + 1
+        upstream_retries.inc(model=model_config.get('model'))
+        # 指数退避 + 全抖动，避免多个请求同时重试
+        delay = random.uniform(0, min(self.config['max_delay_seconds'], self.config['base_delay_seconds'] * 2 ** (self.attempt - 1)))
+        print(f"上游调用失败 (第 {self.attempt}/{self.config['max_attempts']} 次): {error}，{delay:.2f} 秒后重试")
+        return delay
+
+    def succeeded(self, model_config):
+        get_breaker(model_config).record_success()
+
+def call_with_failover(model_name, attempt_fn, resolve_config=get_gemini_config):
+    """带重试、key/模型故障转移和熔断的上游调用
+
+    Args:
+        model_name: 请求的模型名称
+        attempt_fn: 回调 (model_config) -> 结果；每次尝试都会传入新解析的模型配置
+        resolve_config: 模型名称 -> 模型配置，默认从 key 轮换池中取 key
+
+    Returns:
+        attempt_fn 第一次成功时的返回值
+    """
+    failover = _Failover(model_name, resolve_config)
+    last_error = None
+    while True:
+        model_config = failover.next_config(last_error)
+        try:
+            result = attempt_fn(model_config)
+        except Exception as e:
+            time.sleep(failover.failed(model_config, e))
+            last_error = e
+            continue
+        failover.succeeded(model_config)
+        return result
+
+async def call_with_failover_async(model_name, attempt_fn, resolve_config=get_gemini_config):
+    """call_with_failover 的异步版本，attempt_fn 返回 awaitable"""
+    failover = _Failover(model_name, resolve_config)
+    last_error = None
+    while True:
+        model_config = failover.next_config(last_error)
+        try:
+            result = await attempt_fn(model_config)
+        except Exception as e:
+            await asyncio.sleep(failover.failed(model_config, e))
+            last_error = e
+            continue
+        failover.succeeded(model_config)
+        return result
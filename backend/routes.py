@@ -1,10 +1,16 @@
 # backend/routes.py
-from flask import request, jsonify, Response, stream_with_context, current_app
+import json
+import os
+from flask import request, jsonify, Response, stream_with_context, current_app, send_file
 from backend.config import get_model_list as config_get_model_list # 重命名以避免冲突
+from backend.config import get_config_version, get_prompt
 from backend.llm_service import query_llm
 from backend.database_service import (
     save_report_data,
     get_all_reports,
+    query_reports,
+    iter_reports,
+    search_reports,
     get_submission_timestamps,
     get_report_by_timestamp
 )
@@ -15,6 +21,14 @@ from backend.audio_service import (
     transcribe_audio,
     analyze_report_info
 )
+from backend.chunked_upload import init_upload, get_upload_status, write_chunk, complete_upload
+from backend.audio_store import get_audio_store
+from backend.cache_service import get_cache_stats
+from backend.metrics import render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from backend.admission import admission_controller
+from backend.sse import wants_sse
+from backend.job_queue import submit_job, get_job, iter_job_events, get_queue_stats, get_jobs_config, start_job_workers
+import backend.batch_ingest # 注册批量导入 (ingest) 任务类型
 
 def register_routes(app):
     """在 Flask 应用实例上注册路由"""
@@ -23,6 +37,9 @@ def register_routes(app):
     AUDIO_FOLDER = app.config['AUDIO_FOLDER']
     SCRIPT_DIR = app.config['SCRIPT_DIR']
 
+    if get_jobs_config()['embedded_workers']:
+        start_job_workers(AUDIO_FOLDER, SCRIPT_DIR) # 后台任务在工作线程中执行，不占用请求线程
+
     @app.route('/fetchModels', methods=['GET'])
     def get_model_list_route():
         """获取可用模型列表的路由"""
@@ -43,11 +60,15 @@ def register_routes(app):
         if model_name not in available_models:
             return jsonify({'error': f'不支持的模型: {model_name}'}), 400
 
-        result = query_llm(model_name, prompt, msg)
+        sse = wants_sse(request.headers.get('Accept'), data)
+        result = query_llm(model_name, prompt, msg, sse=sse)
 
         if isinstance(result, tuple): # 如果返回的是错误元组
             error_msg, status_code = result
             return jsonify(error_msg), status_code
+        elif sse: # SSE 输出：禁止代理缓冲，保证合并帧和心跳及时送达
+            return Response(stream_with_context(result), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
         else: # 否则返回流式响应
             return Response(stream_with_context(result))
 
@@ -69,7 +90,43 @@ def register_routes(app):
         file = request.files['file']
         object_name = request.form.get('object_name')
 
-        result, status_code = save_uploaded_audio(AUDIO_FOLDER, file, object_name)
+        keep_original = request.form.get('keep_original') # 后台转码后是否保留原文件，未指定时按配置
+        if keep_original is not None:
+            keep_original = keep_original in ('1', 'true')
+        result, status_code = save_uploaded_audio(AUDIO_FOLDER, file, object_name, keep_original)
+        return jsonify(result), status_code
+
+    @app.route('/api/uploads', methods=['POST'])
+    @limiter.limit("120 per hour")
+    def init_upload_route():
+        """初始化 (或恢复) 分块上传会话"""
+        data = request.get_json(silent=True) or {}
+        result, status_code = init_upload(
+            AUDIO_FOLDER, data.get('file_hash'), data.get('size'), data.get('content_type'), data.get('keep_original')
+        )
+        return jsonify(result), status_code
+
+    @app.route('/api/uploads/<upload_id>', methods=['GET'])
+    @limiter.limit("3000 per hour")
+    def upload_status_route(upload_id):
+        """查询分块上传的已接收字节数，网络中断后据此续传"""
+        result, status_code = get_upload_status(AUDIO_FOLDER, upload_id)
+        return jsonify(result), status_code
+
+    @app.route('/api/uploads/<upload_id>', methods=['PUT'])
+    @limiter.limit("3000 per hour") # 大文件按分块计数，限额高于整文件上传
+    def upload_chunk_route(upload_id):
+        """追加一个分块：请求体为原始字节，offset 为该分块在文件中的起始位置"""
+        result, status_code = write_chunk(
+            AUDIO_FOLDER, upload_id, request.args.get('offset'), request.stream, request.content_length
+        )
+        return jsonify(result), status_code
+
+    @app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+    @limiter.limit("120 per hour")
+    def complete_upload_route(upload_id):
+        """校验哈希并完成分块上传，返回以内容哈希命名的 object_name"""
+        result, status_code = complete_upload(AUDIO_FOLDER, upload_id)
         return jsonify(result), status_code
 
     @app.route('/api/transcribe-audio', methods=['POST'])
@@ -79,9 +136,10 @@ def register_routes(app):
         data = request.get_json()
         object_name = data.get('object_name')
         model_name = data.get('model')
+        segmented = data.get('segmented') # 可选：显式指定是否分段并发转录
 
         # transcribe_audio 现在直接返回 Flask Response 或 (jsonify(...), status_code)
-        return transcribe_audio(AUDIO_FOLDER, SCRIPT_DIR, object_name, model_name)
+        return transcribe_audio(AUDIO_FOLDER, SCRIPT_DIR, object_name, model_name, segmented=segmented)
 
 
     @app.route('/api/analyze-report', methods=['POST'])
@@ -95,6 +153,37 @@ def register_routes(app):
         # analyze_report_info 现在直接返回 Flask Response (jsonify)
         return analyze_report_info(SCRIPT_DIR, object_name, transcription_text)
 
+    @app.route('/api/jobs', methods=['POST'])
+    @limiter.limit("300 per hour")
+    def submit_job_route():
+        """提交后台任务 (kind 为 transcribe、analyze 或 ingest，其余字段与对应的同步接口相同)，立即返回 job_id"""
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "请求体必须为JSON格式"}), 400
+        result, status_code = submit_job(data.get('kind'), data)
+        return jsonify(result), status_code
+
+    @app.route('/api/jobs/<job_id>', methods=['GET'])
+    @limiter.exempt # 客户端轮询
+    def get_job_route(job_id):
+        """查询任务状态、进度与结果"""
+        result, status_code = get_job(job_id)
+        return jsonify(result), status_code
+
+    @app.route('/api/jobs/<job_id>/events', methods=['GET'])
+    @limiter.exempt
+    def job_events_route(job_id):
+        """以 SSE 推送任务进度，任务结束时发送 done 事件；连接定期断开，浏览器带 Last-Event-ID 重连后继续"""
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        events = iter_job_events(job_id, last_event_id=last_event_id)
+        return Response(stream_with_context(events), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/api/job-stats', methods=['GET'])
+    def job_stats_route():
+        """各类型、各状态的任务数"""
+        return jsonify(get_queue_stats())
+
     @app.route('/api/submit-final-report', methods=['POST'])
     @limiter.limit("60 per hour")
     def submit_final_report_route():
@@ -105,15 +194,88 @@ def register_routes(app):
         
         success, message = save_report_data(data)
         if success:
+            get_audio_store(AUDIO_FOLDER).mark_referenced(data.get('object_name')) # 被举报引用的音频不再被淘汰
             return jsonify({"status": "success", "message": message})
         else:
             return jsonify({"error": message}), 400
 
     @app.route('/api/reports', methods=['GET'])
     def get_reports_route():
-        """获取所有举报数据的路由"""
-        reports = get_all_reports()
-        return jsonify(reports)
+        """获取举报数据的路由
+
+        不带参数时返回全部最新举报 (兼容旧前端)；
+        带 limit/cursor/school/method/since/until 时按游标分页，返回 {"items", "next_cursor"}；
+        format=ndjson 时逐行流式返回全部匹配记录。
+        """
+        filters = {
+            "cursor_token": request.args.get('cursor'),
+            "school": request.args.get('school'),
+            "method": request.args.get('method'),
+            "since": request.args.get('since'),
+            "until": request.args.get('until'),
+        }
+
+        try:
+            if request.args.get('format') == 'ndjson':
+                rows = iter_reports(**filters)
+                lines = (json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+                return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+            if 'limit' not in request.args and not any(filters.values()):
+                return jsonify(get_all_reports())
+
+            try:
+                limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+            except ValueError:
+                return jsonify({"error": "limit 参数必须为整数"}), 400
+            reports, next_cursor = query_reports(limit=limit, **filters)
+            return jsonify({"items": reports, "next_cursor": next_cursor})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route('/api/search', methods=['GET'])
+    def search_reports_route():
+        """全文检索举报内容的路由，按相关度排序并高亮命中片段
+
+        返回的 school、method、snippet 是安全的 HTML：用户文本已转义，只有命中片段包在 <mark> 中，
+        可以直接作为 HTML 渲染；其余字段为纯文本。
+        """
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({"error": "缺少 'q' 参数"}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+            offset = max(int(request.args.get('offset', 0)), 0)
+        except ValueError:
+            return jsonify({"error": "limit/offset 参数必须为整数"}), 400
+
+        results, has_more = search_reports(query, limit=limit, offset=offset)
+        return jsonify({"items": results, "has_more": has_more, "offset": offset, "limit": limit})
+
+    @app.route('/api/cache-stats', methods=['GET'])
+    def cache_stats_route():
+        """获取各结果缓存的命中统计"""
+        return jsonify(get_cache_stats())
+
+    @app.route('/metrics', methods=['GET'])
+    @limiter.exempt
+    def metrics_route():
+        """Prometheus 文本格式的指标"""
+        return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+    @app.route('/api/admission-stats', methods=['GET'])
+    def admission_stats_route():
+        """获取上游调用准入控制的队列深度与等待时间统计"""
+        return jsonify(admission_controller.stats())
+
+    @app.route('/api/config-version', methods=['GET'])
+    def config_version_route():
+        """获取当前配置和提示词的版本 (内容 sha256)，文件修改后自动变化"""
+        versions = {'ai.json': get_config_version()}
+        for prompt_file in ('audio_prompt.txt', 'report_prompt.txt'):
+            snapshot = get_prompt(os.path.join(SCRIPT_DIR, prompt_file))
+            versions[prompt_file] = snapshot.version if snapshot else None
+        return jsonify(versions)
 
     @app.route('/api/get-timestamps', methods=['GET'])
     def get_timestamps_route():
@@ -150,23 +312,26 @@ def register_routes(app):
         if not object_name:
             return jsonify({"error": "缺少 'object_name' 参数"}), 400
 
-        # 调用修改后的 get_audio_file 函数
-        audio_data, content_type, status_code = get_audio_file(AUDIO_FOLDER, object_name)
-        
-        if audio_data is None:
+        audio_path, content_type, status_code = get_audio_file(AUDIO_FOLDER, object_name)
+
+        if audio_path is None:
             if status_code == 404:
                 return jsonify({"error": f"音频文件未找到: {object_name}"}), 404
             elif status_code == 403:
                 return jsonify({"error": "没有权限访问该文件"}), 403
+            elif status_code == 400:
+                return jsonify({"error": f"非法的 object_name: {object_name}"}), 400
             else:
                 return jsonify({"error": "获取音频文件失败"}), status_code or 500
-            
-        return Response(
-            audio_data,
-            status=200,
+
+        # 文件名即内容哈希，直接作为 ETag (转码后的压缩版本文件名不同，ETag 随之变化)；
+        # conditional=True 时由 Werkzeug 处理 Range (206)、If-None-Match (304)，并通过 wsgi.file_wrapper 从磁盘流式发送
+        response = send_file(
+            audio_path,
             mimetype=content_type,
-            headers={
-                'Cache-Control': 'no-cache',
-                'Accept-Ranges': 'bytes'
-            }
-        )
\ No newline at end of file
+            conditional=True,
+            etag=os.path.splitext(os.path.basename(audio_path).lstrip('.'))[0]
+        )
+        # 浏览器仍需每次验证 ETag，但未变化时只会得到 304
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
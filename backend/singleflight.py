@@ -0,0 +1,263 @@
+# backend/singleflight.py
+import asyncio
+import threading
+
+class _Call:
+    """一次进行中的阻塞调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class _Broadcast:
+    """一次进行中的流式调用，所有订阅者共享同一份已产生的分块"""
+
+    def __init__(self):
+        self.started = threading.Event() # 上游调用已建立 (或建立失败)
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 1
+        self.listeners = [] # 异步订阅者的 (事件循环, asyncio.Event)
+
+    def wake(self):
+        """唤醒全部订阅者 (调用方持有 self.cond)；异步订阅者通过各自的事件循环唤醒"""
+        self.cond.notify_all()
+        for loop, event in self.listeners:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass # 事件循环已关闭
+
+    def set_started(self):
+        self.started.set()
+        with self.cond:
+            self.wake()
+
+    async def _wait(self, ready):
+        """在事件循环中等待 ready() (持有 self.cond 时调用) 为真，不占用线程"""
+        listener = (asyncio.get_running_loop(), asyncio.Event())
+        with self.cond:
+            if ready():
+                return
+            self.listeners.append(listener)
+        try:
+            while True:
+                with self.cond:
+                    if ready():
+                        return
+                    listener[1].clear() # 之后的状态变化都会重新 set
+                await listener[1].wait()
+        finally:
+            with self.cond:
+                self.listeners.remove(listener)
+
+    async def wait_started(self):
+        await self._wait(self.started.is_set)
+
+    def subscribe(self):
+        """从第一个分块开始迭代，后加入的订阅者也能拿到完整内容"""
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.finished:
+                    self.cond.wait()
+                pending = self.chunks[index:]
+                finished = self.finished
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                return
+
+    async def asubscribe(self):
+        """subscribe 的异步版本：在事件循环中等待新分块"""
+        index = 0
+        while True:
+            await self._wait(lambda: index < len(self.chunks) or self.finished)
+            with self.cond:
+                pending = self.chunks[index:]
+                finished = self.finished
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                return
+
+class SingleFlight:
+    """合并相同 key 的并发调用，只向上游发起一次请求
+
+    do(): 阻塞调用，等待者直接拿到领头请求的返回值 (或异常)
+    stream()/join(): 流式调用，上游分块在后台线程中读取并扇出给所有订阅者
+    stream_async()/join_async(): 异步版本，同一个 key 的同步与异步调用共享同一次上游请求
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._broadcasts = {}
+        self._tasks = set() # 读取异步上游生成器的任务 (保持引用，避免被回收)
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+
+        if not leader:
+            print(f"[{self.name}] 合并重复请求，等待进行中的调用")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def join(self, key):
+        """加入进行中的流式调用；没有可加入的调用时返回 None"""
+        with self._lock:
+            broadcast = self._broadcasts.get(key)
+            if broadcast is None:
+                return None
+            broadcast.subscribers += 1
+        broadcast.started.wait()
+        if broadcast.error is not None and not broadcast.chunks:
+            # 上游调用未能建立，由调用方自行重新发起
+            return None
+        print(f"[{self.name}] 合并重复请求，订阅进行中的流 (订阅者 {broadcast.subscribers})")
+        return broadcast.subscribe()
+
+    def stream(self, key, start_fn):
+        """发起 (或加入) 流式调用
+
+        start_fn 在当前线程中执行并返回上游生成器，其抛出的异常会直接传给调用方；
+        生成器随后在后台线程中被完整消费，订阅者断开不会中断上游读取。
+        """
+        with self._lock:
+            existing = self._broadcasts.get(key)
+            if existing is None:
+                broadcast = _Broadcast()
+                self._broadcasts[key] = broadcast
+        if existing is not None:
+            joined = self.join(key)
+            if joined is not None:
+                return joined
+            return self.stream(key, start_fn)
+
+        try:
+            generator = start_fn()
+        except Exception as e:
+            broadcast.error = e
+            self._finish(key, broadcast)
+            raise
+        broadcast.set_started()
+
+        threading.Thread(
+            target=self._pump, args=(key, broadcast, generator),
+            name=f"singleflight-{self.name}", daemon=True
+        ).start()
+        return broadcast.subscribe()
+
+    def _pump(self, key, broadcast, generator):
+        """在后台读取上游生成器，并通知所有订阅者"""
+        try:
+            for chunk in generator:
+                with broadcast.cond:
+                    broadcast.chunks.append(chunk)
+                    broadcast.wake()
+        except Exception as e:
+            print(f"[{self.name}] 上游流读取出错: {e}")
+            broadcast.error = e
+        finally:
+            self._finish(key, broadcast)
+
+    async def join_async(self, key):
+        """join 的异步版本"""
+        with self._lock:
+            broadcast = self._broadcasts.get(key)
+            if broadcast is None:
+                return None
+            broadcast.subscribers += 1
+        await broadcast.wait_started()
+        if broadcast.error is not None and not broadcast.chunks:
+            return None
+        print(f"[{self.name}] 合并重复请求，订阅进行中的流 (订阅者 {broadcast.subscribers})")
+        return broadcast.asubscribe()
+
+    async def stream_async(self, key, start_fn):
+        """stream 的异步版本
+
+        start_fn 为协程函数，返回上游异步生成器 (在事件循环的任务中读取)
+        或同步生成器 (与 stream 相同，在后台线程中读取)。
+        """
+        with self._lock:
+            existing = self._broadcasts.get(key)
+            if existing is None:
+                broadcast = _Broadcast()
+                self._broadcasts[key] = broadcast
+        if existing is not None:
+            joined = await self.join_async(key)
+            if joined is not None:
+                return joined
+            return await self.stream_async(key, start_fn)
+
+        try:
+            generator = await start_fn()
+        except BaseException as e: # 包括协程被取消，避免后来者一直等待
+            broadcast.error = e
+            self._finish(key, broadcast)
+            raise
+        broadcast.set_started()
+
+        if hasattr(generator, '__anext__'):
+            task = asyncio.get_running_loop().create_task(self._apump(key, broadcast, generator))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            threading.Thread(
+                target=self._pump, args=(key, broadcast, generator),
+                name=f"singleflight-{self.name}", daemon=True
+            ).start()
+        return broadcast.asubscribe()
+
+    async def _apump(self, key, broadcast, generator):
+        """_pump 的异步版本"""
+        try:
+            async for chunk in generator:
+                with broadcast.cond:
+                    broadcast.chunks.append(chunk)
+                    broadcast.wake()
+        except Exception as e:
+            print(f"[{self.name}] 上游流读取出错: {e}")
+            broadcast.error = e
+        finally:
+            self._finish(key, broadcast)
+
+    def _finish(self, key, broadcast):
+        with self._lock:
+            if self._broadcasts.get(key) is broadcast:
+                del self._broadcasts[key]
+        broadcast.started.set()
+        with broadcast.cond:
+            broadcast.finished = True
+            broadcast.wake()
+
+transcription_flight = SingleFlight('transcribe')
+report_flight = SingleFlight('analyze')
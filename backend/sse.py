@@ -0,0 +1,190 @@
+# backend/sse.py
+import json
+import time
+import asyncio
+import queue
+import threading
+from backend.config import get_config # 从 config 模块导入
+
+# ai.json 中用于 SSE 输出配置的保留键
+SSE_CONFIG_KEY = 'sse'
+
+DEFAULT_SSE_CONFIG = {
+    "coalesce_ms": 40,          # 合并窗口：窗口内到达的 token 合并为一帧
+    "coalesce_chars": 512,      # 合并帧中文本字符数达到该值时立即发送
+    "heartbeat_seconds": 15,    # 上游无输出超过该时长时发送心跳注释行
+}
+
+# 可以跨 delta 拼接的文本字段
+_TEXT_FIELDS = ('content', 'reasoning_content', 'refusal')
+
+_END = object()
+
+def get_sse_config():
+    """返回合并默认值后的 SSE 输出配置"""
+    sse_config = dict(DEFAULT_SSE_CONFIG)
+    sse_config.update(get_config().get(SSE_CONFIG_KEY) or {})
+    return sse_config
+
+def wants_sse(accept_header, data):
+    """请求头 Accept 含 text/event-stream 或请求体中 format 为 sse 时使用 SSE 输出"""
+    return 'text/event-stream' in (accept_header or '') or (data or {}).get('format') == 'sse'
+
+def format_event(data, event=None, event_id=None):
+    """编码一帧 SSE；data 为 dict 时输出紧凑 JSON，event_id 为断线重连时浏览器回传的 Last-Event-ID"""
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    frame = f"id: {event_id}\n" if event_id is not None else ""
+    frame += f"event: {event}\n" if event else ""
+    return frame + f"data: {data}\n\n"
+
+def compact_delta(delta):
+    """只保留 delta 中有值的字段"""
+    return delta.model_dump(exclude_none=True)
+
+def _text_size(frame):
+    return sum(len(frame.get(field) or '') for field in _TEXT_FIELDS)
+
+def _merge(pending, frame):
+    """尝试把 frame 合并到 pending 中；frame 含非文本字段 (如 tool_calls) 时不合并"""
+    if pending is None or any(key not in _TEXT_FIELDS for key in frame):
+        return False
+    for field in _TEXT_FIELDS:
+        if field in frame:
+            pending[field] = pending.get(field, '') + frame[field]
+    return True
+
+class _Coalescer:
+    """合并窗口的状态；add/tick 返回需要立即发送的 SSE 文本列表"""
+
+    def __init__(self, sse_config):
+        self.window = sse_config['coalesce_ms'] / 1000
+        self.max_chars = sse_config['coalesce_chars']
+        self.heartbeat = sse_config['heartbeat_seconds']
+        self.pending = None
+        self.deadline = None # 当前合并帧的发送时间
+        self.last_sent = time.monotonic()
+
+    def timeout(self):
+        """距离下一次需要发送 (合并帧到期或心跳) 的秒数"""
+        now = time.monotonic()
+        timeout = self.heartbeat - (now - self.last_sent)
+        if self.deadline is not None:
+            timeout = min(timeout, self.deadline - now)
+        return max(timeout, 0)
+
+    def _flush(self):
+        if self.pending is None:
+            return []
+        frame = format_event(self.pending)
+        self.pending, self.deadline = None, None
+        self.last_sent = time.monotonic()
+        return [frame]
+
+    def add(self, item):
+        if isinstance(item, str): # 已编码的错误事件
+            out = self._flush() + [item]
+            self.last_sent = time.monotonic()
+            return out
+        if not item:
+            return []
+        out = []
+        if not _merge(self.pending, item):
+            out = self._flush()
+            self.pending, self.deadline = dict(item), time.monotonic() + self.window
+        if _text_size(self.pending) >= self.max_chars:
+            out += self._flush()
+        return out
+
+    def tick(self):
+        """等待超时：发送到期的合并帧，否则发送心跳注释行"""
+        if self.pending is not None and time.monotonic() >= self.deadline:
+            return self._flush()
+        self.last_sent = time.monotonic()
+        return [": ping\n\n"] # 注释行，客户端会忽略
+
+    def finish(self):
+        return self._flush() + [format_event("[DONE]", event='done')]
+
+def coalesce_sse(frames, sse_config=None):
+    """将 delta 帧流转换为 SSE 事件流
+
+    上游迭代在后台线程中进行，本生成器按合并窗口从队列中取帧：
+    窗口内的文本帧合并为一帧发送，上游长时间无输出时发送心跳，流结束时发送 done 事件。
+
+    Args:
+        frames: 产出 dict 帧的可迭代对象 (通常是 compact_delta 的结果)
+
+    Returns:
+        generator: 产出 SSE 文本
+    """
+    coalescer = _Coalescer(sse_config or get_sse_config())
+    items = queue.Queue()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for frame in frames:
+                if stop.is_set(): # 客户端已断开，停止读取上游
+                    break
+                items.put(frame)
+        except Exception as e:
+            print(f"流式生成过程中出错: {e}")
+            items.put(format_event({"error": "流式生成过程中出错"}, event='error'))
+        finally:
+            close = getattr(frames, 'close', None)
+            if close:
+                close()
+            items.put(_END)
+
+    threading.Thread(target=pump, name='sse-pump', daemon=True).start()
+
+    def generate():
+        try:
+            while True:
+                try:
+                    item = items.get(timeout=coalescer.timeout())
+                except queue.Empty:
+                    yield from coalescer.tick()
+                    continue
+                if item is _END:
+                    break
+                yield from coalescer.add(item)
+            yield from coalescer.finish()
+        finally:
+            stop.set()
+
+    return generate()
+
+async def coalesce_sse_async(frames, sse_config=None):
+    """coalesce_sse 的异步版本 (ASGI 模式)，frames 为异步可迭代对象"""
+    coalescer = _Coalescer(sse_config or get_sse_config())
+    items = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for frame in frames:
+                await items.put(frame)
+        except Exception as e:
+            print(f"流式生成过程中出错: {e}")
+            await items.put(format_event({"error": "流式生成过程中出错"}, event='error'))
+        finally:
+            await items.put(_END)
+
+    task = asyncio.ensure_future(pump())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(items.get(), coalescer.timeout())
+            except asyncio.TimeoutError:
+                for frame in coalescer.tick():
+                    yield frame
+                continue
+            if item is _END:
+                break
+            for frame in coalescer.add(item):
+                yield frame
+        for frame in coalescer.finish():
+            yield frame
+    finally:
+        task.cancel()
@@ -0,0 +1,79 @@
+# backend/stream_log.py
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from backend.config import get_config # 从 config 模块导入
+from backend.metrics import StreamTimer
+
+# ai.json 中用于流式日志配置的保留键
+STREAM_LOG_CONFIG_KEY = 'stream_log'
+
+DEFAULT_STREAM_LOG_CONFIG = {
+    "sample_every": 50,      # 每多少个分块输出一条进度日志，0 表示只输出开始和结束
+    "preview_chars": 80,     # 进度日志中附带的最近输出预览长度
+}
+
+def get_stream_log_config():
+    """返回合并默认值后的流式日志配置"""
+    stream_log_config = dict(DEFAULT_STREAM_LOG_CONFIG)
+    stream_log_config.update(get_config().get(STREAM_LOG_CONFIG_KEY) or {})
+    return stream_log_config
+
+def _build_logger():
+    """日志先进入内存队列，由后台线程写到 stdout，流式生成线程不会因终端输出而阻塞"""
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger('backend.stream')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return logger
+
+_logger = _build_logger()
+
+def log_event(event, **fields):
+    """输出一条结构化 (单行 JSON) 日志"""
+    _logger.info(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False))
+
+class StreamLog:
+    """流式输出的采样日志：开始、每 sample_every 块一次进度、结束各一条
+
+    同时记录首 token 时间和输出速率指标，应在发起上游调用前创建。
+    """
+
+    def __init__(self, path, model, **fields):
+        self.timer = StreamTimer(path, model)
+        config = get_stream_log_config()
+        self.sample_every = config['sample_every']
+        self.preview_chars = config['preview_chars']
+        self.fields = {"path": path, "model": model, **fields}
+        self.chunks = 0
+        self.chars = 0
+        self.tail = ''
+        log_event('stream_start', **self.fields)
+
+    def chunk(self, text):
+        self.timer.chunk(text)
+        self.chunks += 1
+        self.chars += len(text)
+        if self.preview_chars:
+            self.tail = (self.tail + text)[-self.preview_chars:]
+        if self.sample_every and self.chunks % self.sample_every == 0:
+            log_event('stream_progress', chunks=self.chunks, chars=self.chars, preview=self.tail, **self.fields)
+
+    def finish(self, error=None):
+        duration = self.timer.finish()
+        fields = {"chunks": self.chunks, "chars": self.chars, "duration": round(duration, 3), **self.fields}
+        if self.timer.first_at is not None:
+            fields["ttft"] = round(self.timer.first_at - self.timer.start, 3)
+        if error is not None:
+            fields["error"] = str(error)
+        log_event('stream_error' if error is not None else 'stream_end', **fields)
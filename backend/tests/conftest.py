@@ -0,0 +1,6 @@
+# backend/tests/conftest.py
+import os
+import sys
+
+# 从仓库根目录导入 backend (与 python -m backend.xxx 的运行方式一致)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
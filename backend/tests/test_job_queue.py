@@ -0,0 +1,249 @@
+# backend/tests/test_job_queue.py
+import json
+import time
+import threading
+import pytest
+import backend.job_queue as jq
+
+# 测试用任务类型：返回 outcomes[object_name] 中预设的 (结果, 状态码[, 响应头])
+outcomes = {}
+
+@jq.job_kind('test-echo', jq.PRIORITY_TRANSCRIPTION, ('object_name',))
+def run_echo_job(job):
+    return outcomes.get(job.payload['object_name'], ({"echo": job.payload['object_name']}, 200))
+
+@pytest.fixture
+def jobs_config(tmp_path, monkeypatch):
+    """每个测试使用独立的任务数据库"""
+    config = dict(jq.DEFAULT_JOBS_CONFIG, retry_backoff_seconds=5, max_attempts=3,
+                  lease_seconds=60, poll_interval_seconds=0.01)
+    monkeypatch.setattr(jq, 'JOBS_DATABASE_FILE', str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(jq, '_local', threading.local())
+    monkeypatch.setattr(jq, '_db_ready', False)
+    monkeypatch.setattr(jq, 'get_jobs_config', lambda: config)
+    outcomes.clear()
+    return config
+
+def _submit(object_name):
+    result, status_code = jq.submit_job('test-echo', {"object_name": object_name})
+    assert status_code == 202
+    return result['job_id']
+
+def _run_one(pool):
+    row = pool._claim()
+    assert row is not None
+    pool._execute(jq.Job(row, pool))
+    return row
+
+def _row(job_id):
+    return jq._fetch_job(job_id)
+
+def test_claim_and_finish(jobs_config):
+    job_id = _submit('a.wav')
+    pool = jq.JobWorkerPool('/tmp', '/tmp', workers=1, jobs_config=jobs_config)
+
+    row = _run_one(pool)
+
+    assert row['id'] == job_id
+    job, status_code = jq.get_job(job_id)
+    assert status_code == 200
+    assert job['status'] == jq.STATUS_SUCCEEDED
+    assert job['attempts'] == 1
+    assert job['result'] == {"echo": "a.wav"}
+    assert pool._claim() is None
+
+def test_retry_with_backoff_then_fail(jobs_config):
+    job_id = _submit('busy.wav')
+    outcomes['busy.wav'] = ({"error": "上游繁忙"}, 503)
+    pool = jq.JobWorkerPool('/tmp', '/tmp', workers=1, jobs_config=jobs_config)
+
+    before = time.time()
+    _run_one(pool)
+    row = _row(job_id)
+    assert row['status'] == jq.STATUS_QUEUED
+    assert row['error'] == "上游繁忙"
+    assert row['run_after'] >= before + jobs_config['retry_backoff_seconds']
+    assert pool._claim() is None # 退避期间不可领取
+
+    # 第二次失败退避时间翻倍；Retry-After 优先
+    jq._get_connection().execute('UPDATE jobs SET run_after = 0 WHERE id = ?', (job_id,))
+    outcomes['busy.wav'] = ({"error": "限流"}, 429, {"Retry-After": "42"})
+    before = time.time()
+    _run_one(pool)
+    assert _row(job_id)['run_after'] == pytest.approx(before + 42, abs=2)
+
+    # 次数用尽后标记失败
+    jq._get_connection().execute('UPDATE jobs SET run_after = 0 WHERE id = ?', (job_id,))
+    _run_one(pool)
+    row = _row(job_id)
+    assert row['status'] == jq.STATUS_FAILED
+    assert row['attempts'] == jobs_config['max_attempts']
+
+def test_non_retryable_error_fails_immediately(jobs_config):
+    job_id = _submit('bad.wav')
+    outcomes['bad.wav'] = ({"error": "参数错误"}, 400)
+    pool = jq.JobWorkerPool('/tmp', '/tmp', workers=1, jobs_config=jobs_config)
+
+    _run_one(pool)
+
+    row = _row(job_id)
+    assert row['status'] == jq.STATUS_FAILED
+    assert row['attempts'] == 1
+
+def test_requeue_on_lease_expiry(jobs_config):
+    job_id = _submit('a.wav')
+    pool = jq.JobWorkerPool('/tmp', '/tmp', workers=1, jobs_config=jobs_config)
+    pool._claim()
+    jq._get_connection().execute('UPDATE jobs SET lease_expires = ? WHERE id = ?', (time.time() - 1, job_id))
+
+    assert jq.requeue_expired(jobs_config) == 1
+
+    row = _row(job_id)
+    assert row['status'] == jq.STATUS_QUEUED
+    assert row['worker'] is None
+    # 原工作线程迟到的结果不会覆盖重新排队的任务
+    pool._finish(jq.Job(dict(row, attempts=1), pool), {"echo": "stale"}, 200)
+    assert _row(job_id)['status'] == jq.STATUS_QUEUED
+
+def test_requeue_marks_failed_after_max_attempts(jobs_config):
+    job_id = _submit('a.wav')
+    pool = jq.JobWorkerPool('/tmp', '/tmp', workers=1, jobs_config=jobs_config)
+    pool._claim()
+    jq._get_connection().execute(
+        'UPDATE jobs SET lease_expires = ?, attempts = ? WHERE id = ?',
+        (time.time() - 1, jobs_config['max_attempts'], job_id)
+    )
+
+    jq.requeue_expired(jobs_config)
+
+    assert _row(job_id)['status'] == jq.STATUS_FAILED
+
+def test_worker_survives_finish_failure(jobs_config, monkeypatch):
+    jobs_config['lease_seconds'] = 0.2
+    job_id = _submit('a.wav')
+    pool = jq.JobWorkerPool('/tmp', '/tmp', workers=1, jobs_config=jobs_config)
+    original_finish = pool._finish
+    failures = [1]
+
+    def flaky_finish(*args, **kwargs):
+        if failures[0]:
+            failures[0] -= 1
+            raise jq.sqlite3.OperationalError('database is locked')
+        return original_finish(*args, **kwargs)
+
+    monkeypatch.setattr(pool, '_finish', flaky_finish)
+    pool.start()
+    try:
+        deadline = time.monotonic() + 10
+        while _row(job_id)['status'] != jq.STATUS_SUCCEEDED and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert _row(job_id)['status'] == jq.STATUS_SUCCEEDED
+        assert _row(job_id)['attempts'] == 2 # 租约到期后重新排队并再次执行
+        assert all(thread.is_alive() for thread in pool._threads)
+    finally:
+        pool.stop(timeout=2)
+
+def test_dedupe_active_jobs(jobs_config):
+    first = _submit('a.wav')
+    result, _ = jq.submit_job('test-echo', {"object_name": "a.wav"})
+    assert result == {"job_id": first, "status": jq.STATUS_QUEUED, "deduplicated": True}
+
+    other, _ = jq.submit_job('test-echo', {"object_name": "a.wav"}, dedupe=False)
+    assert other['job_id'] != first
+
+    # 已结束的任务不再参与查重
+    pool = jq.JobWorkerPool('/tmp', '/tmp', workers=1, jobs_config=jobs_config)
+    _run_one(pool)
+    _run_one(pool)
+    result, _ = jq.submit_job('test-echo', {"object_name": "a.wav"})
+    assert result['deduplicated'] is False
+
+def test_concurrent_submit_deduplicates(jobs_config):
+    jq._ensure_db()
+    job_ids = []
+
+    def submit():
+        job_ids.append(jq.submit_job('test-echo', {"object_name": "same.wav"})[0]['job_id'])
+
+    threads = [threading.Thread(target=submit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(job_ids)) == 1
+
+# --- 进度事件与断线续传 ---
+
+def _progress_events(job_id, last_event_id=None, count=1):
+    """读取 iter_job_events 的前 count 个 progress 事件，返回 [(id, data)]"""
+    events = []
+    stream = jq.iter_job_events(job_id, last_event_id=last_event_id)
+    for frame in stream:
+        fields = dict(line.split(': ', 1) for line in frame.strip().split('\n') if ': ' in line)
+        if fields.get('event') == 'progress':
+            events.append((fields.get('id'), json.loads(fields['data'])))
+            if len(events) == count:
+                break
+    stream.close()
+    return events
+
+def _running_job(jobs_config, tail, chars):
+    job_id = _submit('a.wav')
+    pool = jq.JobWorkerPool('/tmp', '/tmp', workers=1, jobs_config=jobs_config)
+    job = jq.Job(pool._claim(), pool)
+    job.progress({"chars": chars, "tail": tail}, force=True)
+    return job_id, job
+
+def test_events_without_position_have_no_id(jobs_config):
+    job_id = _submit('a.wav')
+
+    [(event_id, data)] = _progress_events(job_id)
+
+    assert event_id is None
+    assert data['status'] == jq.STATUS_QUEUED
+
+def test_events_first_connection_resets(jobs_config):
+    job_id, _ = _running_job(jobs_config, "0123456789", 10)
+
+    [(event_id, data)] = _progress_events(job_id)
+
+    assert event_id == "1:10"
+    assert data['reset'] is True
+    assert data['delta'] == "0123456789"
+    assert 'truncated' not in data
+
+def test_events_resume_from_last_event_id(jobs_config):
+    job_id, _ = _running_job(jobs_config, "0123456789", 10)
+
+    [(event_id, data)] = _progress_events(job_id, last_event_id="1:4")
+
+    assert event_id == "1:10"
+    assert data['delta'] == "456789"
+    assert 'reset' not in data
+
+def test_events_reset_after_retry_or_large_gap(jobs_config):
+    job_id, _ = _running_job(jobs_config, "0123456789", 100)
+
+    # 上一次执行的位置不能接续
+    [(_, data)] = _progress_events(job_id, last_event_id="2:4")
+    assert data['reset'] is True
+
+    # 落后超过保存的末尾长度：只能发送末尾并标记 truncated
+    [(_, data)] = _progress_events(job_id, last_event_id="1:4")
+    assert data['reset'] is True
+    assert data['truncated'] is True
+    assert data['delta'] == "0123456789"
+
+    # 格式错误的 Last-Event-ID 按首次连接处理
+    [(_, data)] = _progress_events(job_id, last_event_id="garbage")
+    assert data['reset'] is True
+
+def test_events_done_after_finish(jobs_config):
+    job_id, job = _running_job(jobs_config, "abc", 3)
+    job._pool._finish(job, {"transcription_text": "abc"}, 200)
+
+    frames = list(jq.iter_job_events(job_id, last_event_id="1:3"))
+
+    assert frames[-1].startswith("event: done\n")
+    assert json.loads(frames[-1].split('data: ', 1)[1])['result'] == {"transcription_text": "abc"}
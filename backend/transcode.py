@@ -0,0 +1,172 @@
+# backend/transcode.py
+"""上传后在后台把音频转码为语音质量的压缩格式
+
+WAV 等未压缩音频保存后提交到后台队列，由 ffmpeg 子进程混音为单声道、重采样并编码
+(默认 16kHz / 32kbps MP3)；完成后登记到音频存储，之后转录和播放都读取压缩版本，
+原文件只在上传时要求保留 (keep_original) 或配置 keep_original 时保留；不保留时也要等 original_grace_seconds
+之后才删除，转码完成前已经开始的转录仍在读取原文件。
+开启分段转录时，达到分段时长阈值的 WAV 不转码 (分段转录需要按帧切分 WAV)。
+
+转码在独立的 ffmpeg 进程中进行，不占用 Web 进程的 CPU 和 GIL；同时运行的 ffmpeg 进程数由 workers 限制。
+未安装 ffmpeg 时跳过转码，音频保持原样。
+"""
+import os
+import shutil
+import secrets
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from backend.config import get_config # 从 config 模块导入
+from backend.audio_store import get_audio_store, is_compact_path, UPLOADS_DIR_NAME
+from backend.audio_segments import get_segmented_config, wav_info
+from backend.metrics import registry, Counter
+
+# ai.json 中用于转码配置的保留键
+TRANSCODE_CONFIG_KEY = 'transcode'
+
+DEFAULT_TRANSCODE_CONFIG = {
+    "enabled": False,                # 是否在上传后自动转码
+    "codec": "mp3",                  # mp3 (各上游都接受) 或 opus (更小，需上游支持 ogg 输入)
+    "bitrate": "32k",
+    "sample_rate": 16000,
+    "channels": 1,
+    "source_extensions": [".wav"],   # 只转码这些格式 (已压缩的格式再转码收益很小)
+    "keep_original": False,          # 默认是否保留原文件 (上传时可单独指定)
+    "original_grace_seconds": 3600,  # 不保留原文件时，转码完成后再过多久删除原文件
+    "workers": 2,                    # 同时运行的 ffmpeg 进程数
+    "timeout_seconds": 600,
+    "ffmpeg_path": "ffmpeg",
+}
+
+# codec -> (ffmpeg 编码器, 扩展名)
+CODECS = {
+    "mp3": ("libmp3lame", ".mp3"),
+    "opus": ("libopus", ".ogg"),
+}
+
+transcode_jobs = registry.register(Counter(
+    'audio_transcode_jobs_total', '后台音频转码任务数', ('result',)
+))
+transcode_saved_bytes = registry.register(Counter(
+    'audio_transcode_saved_bytes_total', '转码节省的存储字节数'
+))
+
+def get_transcode_config():
+    """返回合并默认值后的转码配置"""
+    transcode_config = dict(DEFAULT_TRANSCODE_CONFIG)
+    transcode_config.update(get_config().get(TRANSCODE_CONFIG_KEY) or {})
+    return transcode_config
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()       # (audio_folder, object_name)，避免同一文件重复排队
+_pending_lock = threading.Lock()
+_missing_ffmpeg_reported = False
+
+def _get_executor(workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix='transcode')
+        return _executor
+
+def build_ffmpeg_command(transcode_config, source_path, target_path):
+    """返回转码使用的 ffmpeg 命令行"""
+    encoder, _ = CODECS[transcode_config['codec']]
+    return [
+        transcode_config['ffmpeg_path'], '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', source_path,
+        '-vn', '-ac', str(transcode_config['channels']), '-ar', str(transcode_config['sample_rate']),
+        '-c:a', encoder, '-b:a', transcode_config['bitrate'],
+        target_path
+    ]
+
+def schedule_transcode(audio_folder, object_name, keep_original=None):
+    """上传完成后调用：符合条件时提交后台转码，返回是否已提交"""
+    global _missing_ffmpeg_reported
+    transcode_config = get_transcode_config()
+    if not transcode_config['enabled']:
+        return False
+    if os.path.splitext(object_name)[1].lower() not in transcode_config['source_extensions']:
+        return False
+    if transcode_config['codec'] not in CODECS:
+        print(f"未知的转码格式: {transcode_config['codec']}，跳过转码")
+        return False
+    if shutil.which(transcode_config['ffmpeg_path']) is None:
+        if not _missing_ffmpeg_reported:
+            _missing_ffmpeg_reported = True
+            print(f"未找到 ffmpeg ({transcode_config['ffmpeg_path']})，上传的音频将保持原样")
+        return False
+
+    key = (os.path.abspath(audio_folder), object_name)
+    with _pending_lock:
+        if key in _pending:
+            return False
+        _pending.add(key)
+    if keep_original is None:
+        keep_original = transcode_config['keep_original']
+    _get_executor(transcode_config['workers']).submit(_run_job, key, transcode_config, bool(keep_original))
+    return True
+
+def _run_job(key, transcode_config, keep_original):
+    audio_folder, object_name = key
+    try:
+        result = transcode_audio(audio_folder, object_name, transcode_config, keep_original)
+        transcode_jobs.inc(result=result)
+        get_audio_store(audio_folder).purge_replaced_originals() # 顺带清理之前转码的、保留期已过的原文件
+    except Exception as e:
+        transcode_jobs.inc(result='error')
+        print(f"转码 {object_name} 时出错: {e}")
+    finally:
+        with _pending_lock:
+            _pending.discard(key)
+
+def _needs_wav_for_segments(source_path):
+    """开启分段转录且时长达到阈值的 WAV 需要保持原格式，转码后将无法分段"""
+    segmented_config = get_segmented_config()
+    if not segmented_config['enabled']:
+        return False
+    info = wav_info(source_path)
+    if info is None:
+        return False
+    total_frames, framerate = info
+    return total_frames / framerate >= segmented_config['min_duration_seconds']
+
+def transcode_audio(audio_folder, object_name, transcode_config=None, keep_original=False):
+    """同步转码一个音频，返回结果: transcoded / skipped / kept_for_segments / no_gain / failed"""
+    transcode_config = transcode_config or get_transcode_config()
+    store = get_audio_store(audio_folder)
+    source_path = store.resolve(object_name)
+    if source_path is None or not os.path.isfile(source_path) or is_compact_path(source_path):
+        return 'skipped' # 不存在、已被淘汰或已经转码过
+    if _needs_wav_for_segments(source_path):
+        return 'kept_for_segments'
+
+    _, extension = CODECS[transcode_config['codec']]
+    uploads_dir = os.path.join(store.root, UPLOADS_DIR_NAME) # 与存储同一文件系统，登记时原子移动
+    os.makedirs(uploads_dir, exist_ok=True)
+    target_path = os.path.join(uploads_dir, f"transcode-{secrets.token_hex(8)}{extension}")
+    try:
+        completed = subprocess.run(
+            build_ffmpeg_command(transcode_config, source_path, target_path),
+            capture_output=True, text=True, timeout=transcode_config['timeout_seconds']
+        )
+        if completed.returncode != 0 or not os.path.isfile(target_path):
+            print(f"ffmpeg 转码 {object_name} 失败: {completed.stderr.strip()[-500:]}")
+            return 'failed'
+        source_size, target_size = os.path.getsize(source_path), os.path.getsize(target_path)
+        if target_size >= source_size:
+            return 'no_gain'
+        if store.attach_compact(object_name, target_path, extension, keep_original=keep_original,
+                                delete_original_after=transcode_config['original_grace_seconds']) is None:
+            return 'skipped'
+        if not keep_original:
+            transcode_saved_bytes.inc(source_size - target_size)
+        print(f"转码完成: {object_name} {source_size} -> {target_size} 字节")
+        return 'transcoded'
+    except subprocess.TimeoutExpired:
+        print(f"ffmpeg 转码 {object_name} 超时")
+        return 'failed'
+    finally:
+        if os.path.exists(target_path):
+            os.remove(target_path)
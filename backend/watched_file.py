@@ -0,0 +1,80 @@
+# backend/watched_file.py
+import os
+import time
+import hashlib
+import threading
+from collections import namedtuple
+
+# 文件内容快照：value 为解析后的内容，version 为文本内容的 sha256 (与 text_fingerprint 一致)
+FileSnapshot = namedtuple('FileSnapshot', ['value', 'version', 'mtime'])
+
+class WatchedFile:
+    """常驻内存的文件内容，变化时自动重新加载
+
+    - 读取时最多每 reload_interval 秒 stat 一次文件，(mtime, size) 变化才重新读取
+    - 重新加载得到完整的新快照后整体替换，读取方始终看到一致的旧值或新值
+    - 解析失败 (如编辑到一半的 JSON) 或文件被删除时保留上一次成功加载的快照
+    """
+
+    def __init__(self, path, loader=None, reload_interval=2.0):
+        self.path = path
+        self.loader = loader or (lambda text: text)
+        self.reload_interval = float(reload_interval)
+
+        self._snapshot = None    # 当前快照 (不可变，整体替换)
+        self._stat_key = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock() # 仅用于重新加载文件，读取路径不加锁
+
+        self._reload(force=True)
+
+    def _reload(self, force=False):
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        with self._reload_lock:
+            if not force and now < self._next_check:
+                return
+            self._next_check = now + self.reload_interval
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                if self._snapshot is not None and self._stat_key is not None:
+                    print(f"警告: {self.path} 不存在，继续使用已加载的内容")
+                    self._stat_key = None
+                return
+            stat_key = (stat.st_mtime_ns, stat.st_size)
+            if stat_key == self._stat_key:
+                return
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    text = f.read()
+                value = self.loader(text)
+            except Exception as e:
+                print(f"警告: 重新加载 {self.path} 失败，继续使用已加载的内容: {e}")
+                return
+            version = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            if self._snapshot is None or version != self._snapshot.version:
+                print(f"已加载 {self.path} (版本 {version[:12]})")
+            self._snapshot = FileSnapshot(value, version, stat.st_mtime)
+            self._stat_key = stat_key
+
+    def snapshot(self):
+        """返回当前快照；文件从未成功加载过时返回 None"""
+        self._reload()
+        return self._snapshot
+
+_files = {}
+_files_lock = threading.Lock()
+
+def get_watched_file(path, loader=None, reload_interval=2.0):
+    """获取 path 对应的进程级 WatchedFile (首次调用时创建)"""
+    path = os.path.abspath(path)
+    watched = _files.get(path)
+    if watched is None:
+        with _files_lock:
+            watched = _files.get(path)
+            if watched is None:
+                watched = WatchedFile(path, loader=loader, reload_interval=reload_interval)
+                _files[path] = watched
+    return watched